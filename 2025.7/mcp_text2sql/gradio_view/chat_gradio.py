@@ -1,34 +1,151 @@
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
 import gradio as gr
+from langchain_core.messages import AIMessage, ToolMessage
 
-from sql_graph.text2sql_graph import make_graph
+from sql_graph.env_utils import METRICS_PORT
+from sql_graph.graph_manager import graph_manager
+from sql_graph.log_utils import log
+from sql_graph.message_utils import message_text
+from sql_graph.metrics import start_metrics_server
+from sql_graph.text2sql_graph import last_question
 
 
-async def execute_graph(chat_bot: List[Dict]) -> List[Dict]:
-    """ 执行工作流的函数"""
+def progress_message(title: str, content: str) -> Dict:
+    """工作流的中间过程，在聊天框里显示成可以折叠的提示"""
+    return {'role': 'assistant', 'content': content, 'metadata': {'title': title}}
+
+
+class ChatStream:
+    """把工作流的 updates 和 messages 事件转换成聊天框里的消息：中间过程显示为提示，最终答案逐字显示"""
+
+    def __init__(self, chat_bot: List[Dict]):
+        self.chat_bot = chat_bot
+        self.answer: Optional[Dict] = None  # 正在逐字输出的答案
+        self.sql_item: Optional[Dict] = None  # 最近一次要执行的SQL
+
+    def on_token(self, chunk, metadata: Dict) -> bool:
+        """大模型输出的一个token，只显示生成最终答案的节点的文字；返回是否需要刷新页面"""
+        if metadata.get('langgraph_node') != 'generate_query' or not isinstance(chunk, AIMessage):
+            return False
+        if chunk.tool_calls or getattr(chunk, 'tool_call_chunks', None):
+            return False
+        text = message_text(chunk)
+        if not text:
+            return False
+        if self.answer is None:
+            self.answer = {'role': 'assistant', 'content': ''}
+            self.chat_bot.append(self.answer)
+        self.answer['content'] += text
+        return True
+
+    def on_update(self, node: str, update: Optional[Dict]) -> bool:
+        """一个节点执行完成，返回是否需要刷新页面"""
+        changed = False
+        for message in (update or {}).get('messages', []):
+            print(message.pretty_repr(html=True))  # 输出消息的表示形式
+            if isinstance(message, AIMessage):
+                changed = self._on_ai_message(node, message) or changed
+            elif isinstance(message, ToolMessage):
+                changed = self._on_tool_message(message) or changed
+        return changed
+
+    def _on_ai_message(self, node: str, message: AIMessage) -> bool:
+        if not message.tool_calls:
+            if node not in ('generate_query', 'give_up'):
+                return False
+            # 以完整的回答为准（候选SQL模式或者模型不支持流式输出时没有逐字输出）
+            if self.answer is None:
+                self.answer = {'role': 'assistant', 'content': ''}
+                self.chat_bot.append(self.answer)
+            self.answer['content'] = message_text(message)
+            return True
+        if self.answer is not None:  # 调用工具之前输出的文字不是最终答案
+            self.chat_bot.remove(self.answer)
+            self.answer = None
+        changed = False
+        for tool_call in message.tool_calls:
+            if tool_call['name'] != 'db_query_tool':
+                continue
+            query = tool_call['args'].get('query')
+            if not query:
+                self.chat_bot.append(progress_message('📄 获取下一页结果', tool_call['args'].get('cursor', '')))
+            elif node == 'check_query' and self.sql_item is not None:
+                # 检查节点修正了SQL，替换掉刚才显示的SQL
+                self.sql_item['content'] = f'```sql\n{query}\n```'
+                self.sql_item['metadata']['title'] = '🛠️ 执行SQL（已修正）'
+            else:
+                title = '⚡ 执行缓存中的SQL' if node == 'lookup_cache' else '🛠️ 执行SQL'
+                self.sql_item = progress_message(title, f'```sql\n{query}\n```')
+                self.chat_bot.append(self.sql_item)
+            changed = True
+        return changed
+
+    def _on_tool_message(self, message: ToolMessage) -> bool:
+        content = message_text(message).strip()
+        if message.name == 'list_tables_tool':
+            self.chat_bot.append(progress_message('📋 选择的表', content))
+            return True
+        if message.name == 'db_query_tool' and (content.startswith('错误') or content.startswith('Error')):
+            self.chat_bot.append(progress_message('❌ SQL执行出错，重新生成', content))
+            return True
+        return False
+
+
+async def execute_graph(chat_bot: List[Dict], request: gr.Request):
+    """ 执行工作流的函数：边执行边把中间过程和答案输出到聊天框"""
     user_input = chat_bot[-1]['content']
-    result = ''  # AI助手的最后一条消息
-
-    inputs = {
-        "input": user_input
-    }
-    async with make_graph() as graph:
-
-        async for event in graph.astream({"messages": [{"role": "user", "content": user_input}]},
-                                         stream_mode="values"):
-            messages = event.get('messages')
-            if messages:
-                if isinstance(messages, list):
-                    message = messages[-1]  # 如果消息是列表，则取最后一个
-                if message.__class__.__name__ == 'AIMessage':
-                    if message.content:
-                        print(result)
-                        result = message.content  # 需要在Webui展示的消息
-                msg_repr = message.pretty_repr(html=True)
-                print(msg_repr)  # 输出消息的表示形式
-
-    chat_bot.append({'role': 'assistant', 'content': result})
-    return chat_bot
+    history_size = len(chat_bot)
+    # 每个页面会话对应工作流的一个thread，后续的问题在之前的状态（表结构、查询结果）上继续
+    thread_id = request.session_hash
+    config = {"configurable": {"thread_id": thread_id}}
+
+    # 工作流和MCP连接在应用启动时创建，所有会话共享；MCP连接异常时重连一次再执行
+    for attempt in range(2):
+        del chat_bot[history_size:]  # 重试时去掉上一次输出的内容
+        stream = ChatStream(chat_bot)
+        graph = None
+        try:
+            graph = await graph_manager.get_graph()
+            inputs = {"messages": [{"role": "user", "content": user_input}]}
+            if attempt and graph.checkpointer is not None:
+                snapshot = await graph.aget_state(config)
+                if snapshot.next and last_question(snapshot.values.get('messages', [])) == user_input:
+                    inputs = None  # 问题已经保存在状态里，从出错的节点继续执行
+            async for mode, data in graph.astream(inputs, config, stream_mode=["messages", "updates"]):
+                if mode == 'messages':
+                    changed = stream.on_token(*data)
+                else:
+                    changed = False
+                    for node, update in data.items():
+                        changed = stream.on_update(node, update) or changed
+                if changed:
+                    yield chat_bot
+            await graph_manager.finish_turn(thread_id)
+            break
+        except asyncio.CancelledError:
+            # 用户点击了停止：正在等待的大模型请求和工具调用会随之取消，连接不需要重建
+            log.info(f'用户取消了问题: {user_input}')
+            raise
+        except Exception as e:
+            log.exception(e)
+            if attempt == 0 and graph_manager.is_session_error(e):
+                # 连接是所有会话共享的，只有连接本身出问题时才重建；其他错误重试也没用，直接告诉用户
+                await graph_manager.reset(graph)
+                continue
+            del chat_bot[history_size:]
+            chat_bot.append({'role': 'assistant', 'content': f'执行出错: {e}'})
+            break
+
+    yield chat_bot
+
+
+async def warm_up():
+    """页面加载时预先建立MCP连接并编译工作流（只有第一次真正执行）"""
+    try:
+        await graph_manager.get_graph()
+    except Exception as e:
+        log.exception(e)
 
 
 def do_graph(user_input, chat_bot):
@@ -49,9 +166,19 @@ with gr.Blocks(title='调用MCP服务的TEXT2SQL项目', css=css) as instance:
 
     input_textbox = gr.Textbox(label='请输入你的问题📝', value='')  # 输入框组件
 
-    input_textbox.submit(do_graph, [input_textbox, chatbot], [input_textbox, chatbot]).then(execute_graph, chatbot,
-                                                                                            chatbot)
+    stop_button = gr.Button('停止')  # 取消正在执行的问题
+
+    submit_event = input_textbox.submit(do_graph, [input_textbox, chatbot], [input_textbox, chatbot]).then(
+        execute_graph, chatbot, chatbot)
+    stop_button.click(None, None, None, cancels=[submit_event])
+    instance.load(warm_up)
 
 if __name__ == '__main__':
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)  # 工作流各节点耗时等指标
     # 启动Gradio的应用
-    instance.launch(debug=True)
+    try:
+        instance.launch(debug=True)
+    finally:
+        # 应用退出时断开共享的MCP连接
+        graph_manager.close()
@@ -0,0 +1,69 @@
+"""
+对比 SQLDatabase（原来的单个SQLAlchemy引擎）和 SQLitePool（只读连接池）在多线程并发查询下的吞吐量。
+
+用法（在 mcp_server 目录下执行，和 start_server 使用同一个数据库）：
+    python -m mcp_server.bench_sqlite_pool --threads 1 4 8 16 --seconds 5
+"""
+import argparse
+import json
+import threading
+import time
+
+from langchain_community.utilities import SQLDatabase
+
+from mcp_server.sqlite_pool import SQLitePool
+
+QUERIES = [
+    "SELECT Name FROM Artist ORDER BY Name LIMIT 10",
+    "SELECT COUNT(*) FROM Track",
+    "SELECT c.Country, SUM(i.Total) AS total FROM Invoice i JOIN Customer c ON c.CustomerId = i.CustomerId "
+    "GROUP BY c.Country ORDER BY total DESC LIMIT 5",
+    "SELECT a.Title, COUNT(t.TrackId) FROM Album a JOIN Track t ON t.AlbumId = a.AlbumId "
+    "GROUP BY a.AlbumId ORDER BY 2 DESC LIMIT 5",
+]
+
+
+def run_benchmark(run_query, threads: int, seconds: float) -> float:
+    """threads 个线程循环执行 QUERIES，返回每秒完成的查询数"""
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(i):
+        n = 0
+        while time.perf_counter() < deadline:
+            run_query(QUERIES[n % len(QUERIES)])
+            n += 1
+        counts[i] = n
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite访问层吞吐量测试')
+    parser.add_argument('--db', default='../chinook.db')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    db = SQLDatabase.from_uri(f'sqlite:///{args.db}')
+    pool = SQLitePool(args.db, size=args.pool_size)
+    report = []
+    for threads in args.threads:
+        engine_qps = run_benchmark(db.run_no_throw, threads, args.seconds)
+        pool_qps = run_benchmark(pool.run_no_throw, threads, args.seconds)
+        report.append({'threads': threads, 'sqlalchemy_qps': round(engine_qps, 1), 'pool_qps': round(pool_qps, 1),
+                       'speedup': round(pool_qps / engine_qps, 2) if engine_qps else None})
+        print(f'线程数 {threads:>3}: SQLDatabase {engine_qps:>9.1f} 次/秒, SQLitePool {pool_qps:>9.1f} 次/秒')
+    pool.close()
+    print(json.dumps(report, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
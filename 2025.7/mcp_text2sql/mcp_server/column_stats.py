@@ -0,0 +1,200 @@
+"""
+列统计：离线扫描数据库的每张表，统计每一列的行数、不同值数量、空值比例、最小/最大值和最常见的值，
+写到数据库旁边的 <数据库文件>.stats.sqlite，column_stats_tool 直接读这个文件回答，
+大模型不用再通过 db_query_tool 执行 SELECT DISTINCT / COUNT 之类的探查查询。
+
+统计时每张表一次扫描算出所有列的计数和最值，最常见的值每列一次分组查询（唯一列和BLOB列跳过）。
+先写到临时文件再替换，正在读取的服务不会看到写了一半的结果。数据变化后需要重新运行：
+    python -m mcp_server.column_stats --database chinook
+    python -m mcp_server.column_stats --db ../chinook.db --top-k 10 --tables Track Album
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from sql_graph.log_utils import log
+
+_SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE table_stats (table_name TEXT PRIMARY KEY, row_count INTEGER, seconds REAL, profiled_at TEXT);
+CREATE TABLE column_stats (
+    table_name TEXT, column_name TEXT, type TEXT, null_count INTEGER, distinct_count INTEGER,
+    min_value TEXT, max_value TEXT, top_values TEXT, PRIMARY KEY (table_name, column_name)
+);
+"""
+_COLUMNS_PER_SCAN = 200  # 每列4个聚合值，SQLite默认最多2000个结果列
+
+
+def stats_path(db_path: str) -> str:
+    return f'{db_path}.stats.sqlite'
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _short(value, length: int = 80):
+    """最值和常见值只保留开头，BLOB不保存内容"""
+    if isinstance(value, bytes):
+        return f'<BLOB {len(value)}字节>'
+    if isinstance(value, str) and len(value) > length:
+        return value[:length] + '...'
+    return value
+
+
+def profile_table(conn: sqlite3.Connection, table: str, top_k: int = 10) -> tuple:
+    """统计一张表，返回 (行数, [(列名, 类型, 空值数, 不同值数, 最小值, 最大值, 常见值JSON)])"""
+    columns = [(row[1], row[2] or '') for row in conn.execute(f'PRAGMA table_info({_quote(table)})')]
+    row_count = conn.execute(f'SELECT COUNT(*) FROM {_quote(table)}').fetchone()[0]
+    aggregates = []
+    for i in range(0, len(columns), _COLUMNS_PER_SCAN):  # 结果列数有上限，列很多的表分几次扫描
+        selects = ', '.join(f'COUNT({_quote(c)}), COUNT(DISTINCT {_quote(c)}), MIN({_quote(c)}), MAX({_quote(c)})'
+                            for c, _ in columns[i:i + _COLUMNS_PER_SCAN])
+        aggregates.extend(conn.execute(f'SELECT {selects} FROM {_quote(table)}').fetchone())
+    results = []
+    for i, (column, type_name) in enumerate(columns):
+        non_null, distinct, min_value, max_value = aggregates[i * 4: i * 4 + 4]
+        top_values = []
+        if top_k and 0 < distinct < non_null and 'BLOB' not in type_name.upper():
+            top_values = [[_short(v), n] for v, n in conn.execute(
+                f'SELECT {_quote(column)}, COUNT(*) AS n FROM {_quote(table)} WHERE {_quote(column)} IS NOT NULL '
+                f'GROUP BY {_quote(column)} ORDER BY n DESC LIMIT {int(top_k)}')]
+        results.append((column, type_name, row_count - non_null, distinct, _short(min_value), _short(max_value),
+                        json.dumps(top_values, ensure_ascii=False)))
+    return row_count, results
+
+
+def profile_database(db_path: str, output: Optional[str] = None, top_k: int = 10,
+                     tables: Optional[Iterable[str]] = None) -> str:
+    """
+    统计数据库（只读打开）的所有表，写入列统计文件，返回文件路径；
+    指定 tables 时只重新统计这些表，其他表保留已有的统计
+    """
+    db_path = os.path.abspath(db_path)
+    output = output or stats_path(db_path)
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    tmp_path = f'{output}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    if tables and os.path.exists(output):
+        shutil.copyfile(output, tmp_path)
+    out = sqlite3.connect(tmp_path)
+    try:
+        names = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name")]
+        if tables:
+            wanted = {t.lower() for t in tables}
+            names = [n for n in names if n.lower() in wanted]
+        if not out.execute("SELECT 1 FROM sqlite_master WHERE name = 'meta'").fetchone():
+            out.executescript(_SCHEMA)
+        start = time.perf_counter()
+        for table in names:
+            table_start = time.perf_counter()
+            row_count, columns = profile_table(conn, table, top_k)
+            seconds = time.perf_counter() - table_start
+            out.execute('DELETE FROM column_stats WHERE table_name = ?', (table,))
+            out.execute('INSERT OR REPLACE INTO table_stats VALUES (?, ?, ?, ?)',
+                        (table, row_count, seconds, time.strftime('%Y-%m-%d %H:%M:%S')))
+            out.executemany('INSERT INTO column_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            [(table, *column) for column in columns])
+            log.info(f'列统计: {table} {row_count}行 {len(columns)}列，耗时{seconds * 1000:.0f}ms')
+        schema_version = conn.execute('PRAGMA schema_version').fetchone()[0]
+        out.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('source', db_path), ('schema_version', str(schema_version)), ('top_k', str(top_k))])
+        out.commit()
+        log.info(f'列统计完成: {len(names)}张表，耗时{time.perf_counter() - start:.1f}秒，写入 {output}')
+    finally:
+        out.close()
+        conn.close()
+    os.replace(tmp_path, output)
+    return output
+
+
+class ColumnStatsStore:
+    """读取列统计文件，文件被重新生成（修改时间变化）时自动重新加载；整个文件很小，直接放在内存里"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._mtime = None
+        self._meta: Dict[str, str] = {}
+        self._tables: Dict[str, dict] = {}  # 小写表名 -> {'name', 'row_count', 'columns': [...]}
+        self._lock = threading.Lock()
+
+    def _load(self) -> bool:
+        """返回统计文件是否存在"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return True
+        with self._lock:
+            if mtime != self._mtime:
+                conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+                try:
+                    meta = dict(conn.execute('SELECT key, value FROM meta'))
+                    tables = {name.lower(): {'name': name, 'row_count': rows, 'profiled_at': at, 'columns': []}
+                              for name, rows, at in conn.execute(
+                                  'SELECT table_name, row_count, profiled_at FROM table_stats')}
+                    for row in conn.execute('SELECT * FROM column_stats ORDER BY rowid'):
+                        tables[row[0].lower()]['columns'].append(row[1:])
+                finally:
+                    conn.close()
+                self._meta, self._tables, self._mtime = meta, tables, mtime
+        return True
+
+    def schema_version(self) -> Optional[int]:
+        return int(self._meta['schema_version']) if self._load() and 'schema_version' in self._meta else None
+
+    def describe(self, table: str, columns: Iterable[str] = ()) -> Optional[str]:
+        """
+        返回一张表（可以只要其中几列）的统计说明；统计文件不存在返回None，
+        表不存在时返回以 错误 开头的说明
+        """
+        if not self._load():
+            return None
+        stats = self._tables.get(table.strip('"`[] ').lower())
+        if stats is None:
+            return f'错误: 表 {table} 没有列统计，有统计的表: {", ".join(t["name"] for t in self._tables.values())}'
+        wanted = {c.strip('"`[] ').lower() for c in columns if c.strip()}
+        row_count = stats['row_count']
+        lines = [f'表 {stats["name"]}: {row_count}行（统计时间 {stats["profiled_at"]}）']
+        for name, type_name, nulls, distinct, min_value, max_value, top_values in stats['columns']:
+            if wanted and name.lower() not in wanted:
+                continue
+            parts = [f'空值{nulls / row_count:.1%}' if row_count else '空表',
+                     f'{distinct}个不同值' + ('（唯一）' if row_count and distinct == row_count - nulls else '')]
+            if min_value is not None:
+                parts.append(f'最小值 {min_value}，最大值 {max_value}')
+            top = json.loads(top_values or '[]')
+            if top:
+                parts.append('最常见: ' + ', '.join(f'{v}({n})' for v, n in top))
+            lines.append(f'- {name} {type_name}: ' + '，'.join(parts))
+        if wanted and len(lines) == 1:
+            return f'错误: 表 {stats["name"]} 没有列 {", ".join(sorted(wanted))}'
+        return '\n'.join(lines)
+
+
+def main():
+    from mcp_server.db_registry import DatabaseRegistry, parse_mapping
+    from sql_graph.env_utils import MCP_DATABASES, MCP_DATABASE_DIR, MCP_DEFAULT_DATABASE
+
+    parser = argparse.ArgumentParser(description='离线统计数据库每一列的分布，写入列统计文件')
+    parser.add_argument('--database', default=MCP_DEFAULT_DATABASE, help='MCP服务里的数据库名字')
+    parser.add_argument('--db', help='直接指定数据库文件（优先于 --database）')
+    parser.add_argument('--output', help='列统计文件，默认是 <数据库文件>.stats.sqlite')
+    parser.add_argument('--top-k', type=int, default=10, help='每列保存多少个最常见的值')
+    parser.add_argument('--tables', nargs='*', help='只统计这些表，默认统计所有表')
+    args = parser.parse_args()
+
+    db_path = args.db or DatabaseRegistry(parse_mapping(MCP_DATABASES), MCP_DATABASE_DIR).resolve(args.database)
+    profile_database(db_path, args.output, args.top_k, args.tables)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine
+
+from mcp_server.column_stats import ColumnStatsStore, stats_path
+from mcp_server.query_guard import QueryGuard
+from mcp_server.result_cache import ResultCache
+from mcp_server.result_pager import ResultPager
+from mcp_server.sqlite_pool import SQLitePool
+from mcp_server.table_retriever import TableRetriever
+from mcp_server.value_index import ValueIndex
+from sql_graph.log_utils import log
+from sql_graph.metrics import metrics_registry
+
+DB_OPENED = metrics_registry.counter('mcp_db_opened_total', 'MCP服务打开数据库的次数', ('database',))
+DB_CLOSED = metrics_registry.counter('mcp_db_closed_total', 'MCP服务关闭数据库的次数（idle：空闲超时，lru：打开的数据库太多）',
+                                     ('reason',))
+
+_NAME_RE = re.compile(r'^[A-Za-z0-9_-]+$')  # 数据库名字只能是简单的标识符，不能拼出其他目录的路径
+
+
+class UnknownDatabase(ValueError):
+    pass
+
+
+def parse_mapping(value: str) -> Dict[str, str]:
+    """解析 名字=值,名字=值 格式的配置"""
+    mapping = {}
+    for item in value.split(','):
+        name, sep, target = item.partition('=')
+        if sep and name.strip() and target.strip():
+            mapping[name.strip()] = target.strip()
+    return mapping
+
+
+def cursor_database(cursor: str) -> str:
+    """分页的cursor以 数据库名字. 开头，返回其中的数据库名字（没有时返回空字符串）"""
+    name, sep, _ = (cursor or '').partition('.')
+    return name if sep else ''
+
+
+class Database:
+    """一个数据库在MCP服务里用到的全部资源：表检索索引、只读连接池、结果分页、结果缓存、列统计、文本值索引和查询代价守卫"""
+
+    def __init__(self, name: str, path: str, connections: int, guard: QueryGuard, cache_bytes: int):
+        self.name = name
+        self.path = path
+        self.guard = guard  # 守卫按表名缓存行数，每个数据库单独一个
+        self.engine = create_engine(f'sqlite:///{path}')
+        self.table_retriever = TableRetriever(self.engine)
+        # 没读完的游标在调用返回之后还各占一个连接（最多 connections 的一半），连接池要在同时执行的调用数之外
+        # 再留出这些连接，否则游标开着时同时执行的调用会等不到连接
+        max_cursors = max(1, connections // 2)
+        self.pool = SQLitePool(path, size=connections + max_cursors, guard=guard)
+        self.result_pager = ResultPager(self.pool, page_rows=50, page_bytes=8 * 1024,
+                                        max_open=max_cursors, token_prefix=f'{name}.')
+        self.result_cache = ResultCache(path, max_bytes=cache_bytes)
+        self.column_stats = ColumnStatsStore(stats_path(path))  # 离线生成的列统计（见 column_stats）
+        self.value_index = ValueIndex(path)  # 第一次调用 value_lookup_tool 时在后台建立
+        self.in_use = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        self.result_pager.close()
+        self.pool.close()
+        self.result_cache.close()
+        self.value_index.close()
+        self.engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            'path': self.path,
+            'in_use': self.in_use,
+            'idle_seconds': round(time.monotonic() - self.last_used, 1),
+            'result_cache': self.result_cache.stats(),
+            'query_guard': self.guard.stats(),
+            'result_pager': self.result_pager.stats(),
+            'value_index': self.value_index.stats(),
+        }
+
+
+class DatabaseRegistry:
+    """
+    多数据库注册表：每次工具调用指定数据库的名字，第一次用到时才打开（建连接池、结果缓存等）。
+
+    - 名字先在 databases 配置里找路径，找不到时到 database_dir 目录下找 <名字>.db；
+    - 打开的数据库按LRU排列，超过 max_open 个时关闭最久没用的；超过 idle_seconds 没有使用的也会关闭
+      （有打开的数据库时后台定时器每 evict_interval 秒检查一次，没有新的调用也会关闭），
+      关闭时释放连接池、游标、结果缓存和文本值索引。正在使用的数据库不会被关闭，服务退出时调用 close()；
+    - 每个数据库同时执行的调用数不超过它的连接数（limits 里单独设置，默认 connections），
+      在进入线程池之前排队，一个数据库的慢查询不会占满线程池、拖慢其他数据库。
+    """
+
+    def __init__(self, databases: Dict[str, str], database_dir: str = '', max_open: int = 16,
+                 idle_seconds: float = 600, connections: int = 4, limits: Optional[Dict[str, int]] = None,
+                 guard_options: Optional[dict] = None, cache_bytes: int = 32 * 1024 * 1024,
+                 evict_interval: float = 60):
+        self.databases = {name: os.path.abspath(path) for name, path in databases.items()}
+        self.database_dir = os.path.abspath(database_dir) if database_dir else ''
+        self.max_open = max_open
+        self.idle_seconds = idle_seconds
+        self.connections = connections
+        self.limits = limits or {}
+        self.guard_options = guard_options or {}
+        self.cache_bytes = cache_bytes
+        self.evict_interval = evict_interval
+        self._open: 'OrderedDict[str, Database]' = OrderedDict()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self.opened = 0
+        self.closed = 0
+
+    def names(self, limit: int = 20) -> List[str]:
+        """可以使用的数据库名字（目录下的数据库很多时只列出前 limit 个）"""
+        names = set(self.databases)
+        if self.database_dir and os.path.isdir(self.database_dir):
+            names.update(f[:-3] for f in os.listdir(self.database_dir) if f.endswith('.db') and _NAME_RE.match(f[:-3]))
+        return sorted(names)[:limit]
+
+    def resolve(self, name: str) -> str:
+        """数据库名字 -> 文件路径，数据库不存在时抛出 UnknownDatabase"""
+        path = self.databases.get(name)
+        if path is None and self.database_dir and _NAME_RE.match(name or ''):
+            path = os.path.join(self.database_dir, f'{name}.db')
+        if path is None or not os.path.isfile(path):
+            raise UnknownDatabase(f'数据库 {name} 不存在，可用的数据库有: {", ".join(self.names())}')
+        return path
+
+    def _limit(self, name: str) -> int:
+        return self.limits.get(name, self.connections)
+
+    @asynccontextmanager
+    async def limit(self, name: str):
+        """限制同一个数据库同时执行的工具调用数，在事件循环里排队"""
+        try:
+            self.resolve(name)
+        except UnknownDatabase:  # 不存在的名字不创建信号量，由 lease 返回错误
+            yield
+            return
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            semaphore = self._semaphores.setdefault(name, asyncio.Semaphore(self._limit(name)))
+        async with semaphore:
+            yield
+
+    def _evict(self, now: float) -> List[Database]:
+        """从打开的数据库里移除空闲超时的和超出数量上限的，调用方需要持有锁，返回后在锁外关闭"""
+        evicted = []
+        for name, database in list(self._open.items()):
+            if database.in_use == 0 and now - database.last_used > self.idle_seconds:
+                evicted.append((self._open.pop(name), 'idle'))
+        for name, database in list(self._open.items()):  # 从最久没用的开始
+            if len(self._open) <= self.max_open:
+                break
+            if database.in_use == 0:
+                evicted.append((self._open.pop(name), 'lru'))
+        for database, reason in evicted:
+            DB_CLOSED.inc(reason=reason)
+            log.info(f'关闭数据库 {database.name}（{reason}），已打开{len(self._open)}个')
+        self.closed += len(evicted)
+        return [database for database, _ in evicted]
+
+    @contextmanager
+    def lease(self, name: str):
+        """借用一个数据库（需要时打开），借用期间不会被关闭"""
+        with self._lock:
+            database = self._open.get(name)
+            if database is None:
+                path = self.resolve(name)
+                database = Database(name, path, self._limit(name), QueryGuard(**self.guard_options), self.cache_bytes)
+                self._open[name] = database
+                self.opened += 1
+                DB_OPENED.inc(database=name)
+                log.info(f'打开数据库 {name}: {path}')
+                self._schedule_evict()
+            else:
+                self._open.move_to_end(name)
+            database.in_use += 1
+            evicted = self._evict(time.monotonic())
+        for old in evicted:
+            old.close()
+        try:
+            yield database
+        finally:
+            with self._lock:
+                database.in_use -= 1
+                database.last_used = time.monotonic()
+
+    def _schedule_evict(self):
+        """有打开的数据库并且没有定时器时，evict_interval 秒之后检查一次空闲的数据库，调用方需要持有锁"""
+        if self._timer is None and self._open:
+            self._timer = threading.Timer(self.evict_interval, self._timed_evict)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_evict(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.evict_idle()
+        except Exception as e:
+            log.exception(f'关闭空闲的数据库失败: {e}')
+        with self._lock:
+            self._schedule_evict()  # 还有打开的数据库时继续检查
+
+    def evict_idle(self):
+        """关闭空闲超时的数据库（后台定时器调用，lease 时也会顺便检查）"""
+        with self._lock:
+            evicted = self._evict(time.monotonic())
+        for database in evicted:
+            database.close()
+
+    def close(self):
+        """服务退出时关闭所有打开的数据库"""
+        with self._lock:
+            databases = list(self._open.values())
+            self._open.clear()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if databases:
+            log.info(f'关闭所有打开的数据库: {", ".join(d.name for d in databases)}')
+        for database in databases:
+            database.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            databases = {name: database.stats() for name, database in self._open.items()}
+        return {'open': len(databases), 'max_open': self.max_open, 'opened': self.opened, 'closed': self.closed,
+                'databases': databases}
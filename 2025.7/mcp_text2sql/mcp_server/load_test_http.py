@@ -0,0 +1,141 @@
+"""
+Streamable HTTP 多进程部署的压测：依次用不同的工作进程数启动MCP服务，多个客户端进程并发调用 db_query_tool，
+输出每种进程数下的吞吐量、延迟，以及相对第一种进程数的加速比和扩展效率（加速比 / 进程数倍数）。
+客户端本身也要占CPU，压测机最好和服务分开，或者保证 client-procs 个核留给客户端。
+
+用法（在 mcp_server 目录下执行，和 start_server 使用同一个数据库）：
+    python -m mcp_server.load_test_http --workers 1 2 4 --client-procs 4 --concurrency 8 --seconds 10
+只压测已经启动的服务：
+    python -m mcp_server.load_test_http --url http://127.0.0.1:8000/mcp --client-procs 4 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import List, Tuple
+
+from mcp import ClientSession
+from mcp.client.streamable_http import streamablehttp_client
+
+from mcp_server.bench_sqlite_pool import QUERIES
+from sql_graph.bench_text2sql import summarize
+
+
+def _query(n: int) -> str:
+    # 每次带上不同的常量：规范化之后的SQL不同，不会命中结果缓存，保证每次都真正执行查询
+    return f'SELECT * FROM ({QUERIES[n % len(QUERIES)]}) WHERE {n} = {n}'
+
+
+async def _client(url: str, measure_from: float, deadline: float, latencies: List[float]) -> int:
+    """一个MCP会话循环调用工具直到 deadline，返回出错的次数"""
+    errors = 0
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            while time.time() < deadline:
+                start = time.time()
+                try:
+                    result = await session.call_tool('db_query_tool', {'query': _query(random.randrange(1 << 30))})
+                    failed = result.isError
+                except Exception:
+                    failed = True
+                if start >= measure_from:
+                    if failed:
+                        errors += 1
+                    else:
+                        latencies.append(time.time() - start)
+    return errors
+
+
+def _client_process(args: Tuple[str, int, float, float]) -> Tuple[List[float], int]:
+    url, concurrency, measure_from, deadline = args
+
+    async def run():
+        latencies = []
+        errors = await asyncio.gather(*(_client(url, measure_from, deadline, latencies) for _ in range(concurrency)))
+        return latencies, sum(errors)
+
+    return asyncio.run(run())
+
+
+def run_load(url: str, client_procs: int, concurrency: int, seconds: float, warmup: float) -> dict:
+    """client_procs 个进程、每个进程 concurrency 个会话并发压测，预热 warmup 秒之后计时 seconds 秒"""
+    measure_from = time.time() + warmup
+    deadline = measure_from + seconds
+    with multiprocessing.Pool(client_procs) as pool:
+        results = pool.map(_client_process, [(url, concurrency, measure_from, deadline)] * client_procs)
+    latencies = [v for r in results for v in r[0]]
+    return {'requests': len(latencies), 'errors': sum(r[1] for r in results),
+            'qps': round(len(latencies) / seconds, 1), 'latency': summarize(latencies)}
+
+
+def _wait_ready(base_url: str, timeout: float = 60):
+    """等待服务开始接受请求（用 /metrics 探测）"""
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            with urllib.request.urlopen(f'{base_url}/metrics', timeout=2):
+                return
+        except OSError:
+            time.sleep(0.3)
+    raise TimeoutError(f'服务没有在{timeout}秒内启动: {base_url}')
+
+
+def start_server(workers: int, port: int) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, '-m', 'mcp_server.start_server', '--transport', 'streamable-http',
+                                '--host', '127.0.0.1', '--port', str(port), '--workers', str(workers)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        _wait_ready(f'http://127.0.0.1:{port}')
+    except BaseException:
+        process.kill()
+        raise
+    return process
+
+
+def scaling_report(results: List[dict]) -> List[dict]:
+    """以第一组结果为基准计算加速比和扩展效率"""
+    base = results[0]
+    for r in results:
+        r['speedup'] = round(r['qps'] / base['qps'], 2) if base['qps'] else None
+        if r.get('workers') and base.get('workers') and r['speedup'] is not None:
+            r['efficiency'] = round(r['speedup'] / (r['workers'] / base['workers']), 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streamable HTTP 多进程部署的压测')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='依次测试的服务工作进程数')
+    parser.add_argument('--url', help='压测已经启动的服务（不再自己启动服务），例如 http://127.0.0.1:8000/mcp')
+    parser.add_argument('--port', type=int, default=8765, help='自己启动服务时使用的端口')
+    parser.add_argument('--client-procs', type=int, default=4, help='客户端进程数')
+    parser.add_argument('--concurrency', type=int, default=8, help='每个客户端进程的并发会话数')
+    parser.add_argument('--seconds', type=float, default=10, help='计时的时长')
+    parser.add_argument('--warmup', type=float, default=3, help='开始计时前的预热时长')
+    args = parser.parse_args()
+
+    results = []
+    if args.url:
+        results.append(run_load(args.url, args.client_procs, args.concurrency, args.seconds, args.warmup))
+    for workers in [] if args.url else args.workers:
+        server = start_server(workers, args.port)
+        try:
+            result = run_load(f'http://127.0.0.1:{args.port}/mcp', args.client_procs, args.concurrency,
+                              args.seconds, args.warmup)
+        finally:
+            server.terminate()
+            server.wait(30)
+        result = {'workers': workers, **result}
+        print(f'工作进程 {workers:>2}: {result["qps"]:>8.1f} 次/秒, p50 {result["latency"]["p50_ms"]}ms, '
+              f'p99 {result["latency"]["p99_ms"]}ms, 出错 {result["errors"]}')
+        results.append(result)
+    print(json.dumps(scaling_report(results), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
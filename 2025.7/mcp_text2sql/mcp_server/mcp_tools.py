@@ -1,48 +1,245 @@
-from langchain_community.utilities import SQLDatabase
+import asyncio
+import json
+from typing import List
+
 from mcp.server import FastMCP
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
 
+from mcp_server.db_registry import DatabaseRegistry, UnknownDatabase, cursor_database, parse_mapping
+from mcp_server.query_guard import QueryTooExpensive
+from mcp_server.search_cache import SearchCache, normalize_query
+from mcp_server.search_ranker import deduplicate, rank, split_passages, truncate_to_budget
+from mcp_server.worker_pool import ToolExecutor
+from sql_graph.env_utils import QUERY_MAX_SCAN_ROWS, QUERY_MAX_JOIN_ROWS, QUERY_TIMEOUT, MCP_DATABASES, \
+    MCP_DATABASE_DIR, MCP_DEFAULT_DATABASE, MCP_DB_MAX_OPEN, MCP_DB_IDLE_SECONDS, MCP_DB_CONNECTIONS, \
+    MCP_DB_CONNECTION_LIMITS, SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE, TABLE_RETRIEVAL_MIN_TABLES
+from sql_graph.metrics import metrics_registry
 from sql_graph.my_llm import zhipuai_client
 
 mcp_server = FastMCP(name='lx-mcp', instructions='我自己的MCP服务', port=8000)
-db = SQLDatabase.from_uri('sqlite:///../chinook.db')
+TABLE_TOP_K = 8  # 按问题检索时挑选的相关表数（再补上外键关联的表）
+MAX_SUB_QUERIES = 5  # multi_search_tool 一次最多搜索的问题数
+# 每次工具调用指定要查询的数据库：第一次用到时打开，打开的数据库按LRU和空闲时间关闭。
+# 每个数据库有自己的只读连接池（执行查询前检查执行计划的代价，执行超时则中断）、结果分页和结果缓存，
+# 同时执行的调用数不超过它的连接数
+db_registry = DatabaseRegistry(
+    parse_mapping(MCP_DATABASES), MCP_DATABASE_DIR, max_open=MCP_DB_MAX_OPEN, idle_seconds=MCP_DB_IDLE_SECONDS,
+    connections=MCP_DB_CONNECTIONS, limits={k: int(v) for k, v in parse_mapping(MCP_DB_CONNECTION_LIMITS).items()},
+    guard_options={'max_scan_rows': QUERY_MAX_SCAN_ROWS, 'max_join_rows': QUERY_MAX_JOIN_ROWS, 'timeout': QUERY_TIMEOUT})
+# 阻塞的工具函数放到线程池执行，避免卡住事件循环；每个工具单独限制并发数
+# value_lookup_tool 在索引还没建好时最多阻塞2秒，单独限制，不占满线程池
+tool_executor = ToolExecutor(max_workers=24, limits={'db_query_tool': 16, 'list_tables_tool': 4,
+                                                     'my_search_tool': 4, 'value_lookup_tool': 4})
+# 搜索结果缓存，同时进行的相同搜索只调用一次接口
+search_cache = SearchCache(ttl=SEARCH_CACHE_TTL, max_entries=SEARCH_CACHE_SIZE)
+
+
+def _search(query: str) -> List[dict]:
+    response = zhipuai_client.web_search.web_search(
+        search_engine="search-std",
+        search_query=query
+    )
+    print(response)
+    return [{'title': d.title or '', 'link': d.link or '', 'content': d.content or ''}
+            for d in response.search_result or []]
+
+
+async def _cached_search(query: str) -> List[dict]:
+    return await search_cache.get_or_fetch(query, lambda: tool_executor.run('my_search_tool', _search, query))
 
 
 @mcp_server.tool('my_search_tool', description='专门搜索互联网中的内容')
-def my_search(query: str) -> str:
+async def my_search(query: str) -> str:
     """搜索互联网上的内容"""
     try:
-        response = zhipuai_client.web_search.web_search(
-            search_engine="search-std",
-            search_query=query
-        )
-        print(response)
-        if response.search_result:
-            return "\n\n".join([d.content for d in response.search_result])
-    except Exception as e:
+        results = await _cached_search(query)
+    except Exception as e:  # 失败的结果不缓存，下一次重新搜索
         print(e)
         return '没有搜索到任何内容！'
+    if results:
+        return "\n\n".join([d['content'] for d in results])
+    return '没有搜索到任何内容！'
+
+
+@mcp_server.tool('multi_search_tool', description=f'同时搜索多个相关的问题（最多{MAX_SUB_QUERIES}个），'
+                                                  f'返回去重、按相关度排序并且不超过 max_tokens 的搜索结果，每段带有来源')
+async def multi_search(queries: List[str], max_tokens: int = 2000) -> str:
+    """一次调用并发搜索多个子问题，合并成一份精简的上下文，代替多次顺序调用 my_search_tool"""
+    unique = {}
+    for query in queries:
+        if query.strip():
+            unique.setdefault(normalize_query(query), query)
+    unique = list(unique.values())[:MAX_SUB_QUERIES]
+    if not unique:
+        return '错误: 请至少提供一个要搜索的问题。'
+    responses = await asyncio.gather(*(_cached_search(q) for q in unique), return_exceptions=True)
+    passages = []
+    for i, results in enumerate(responses):
+        if isinstance(results, BaseException):
+            print(results)
+            continue
+        for result in results:
+            passages.extend(split_passages(result, i))
+    total = len(passages)
+    passages = rank(deduplicate(passages), unique)
+    blocks = truncate_to_budget(passages, max_tokens)
+    if not blocks:
+        return '没有搜索到任何内容！'
+    failed = sum(1 for r in responses if isinstance(r, BaseException))
+    footer = f'-- 搜索了{len(unique)}个问题' + (f'（{failed}个失败）' if failed else '') + \
+             f'，共{total}段，去重后{len(passages)}段，按相关度保留了{len(blocks)}段'
+    return '\n\n'.join(blocks) + '\n' + footer
+
 
+def _list_tables(database: str, question: str) -> str:
+    try:
+        with db_registry.lease(database) as db:
+            table_retriever = db.table_retriever
+            table_names = table_retriever.refresh().table_names
+            if question and len(table_names) > TABLE_RETRIEVAL_MIN_TABLES:
+                # 表太多时全部交给大模型既慢又容易选错，先用本地索引挑出候选表
+                return ", ".join(table_retriever.search(question, TABLE_TOP_K))
+            return ", ".join(table_names)  #   ['emp': “这是一个员工表，”, '']
+    except UnknownDatabase as e:
+        return f'错误: {e}'
+
+
+@mcp_server.tool('list_tables_tool', description='输入是用户的问题（可以为空字符串）和数据库名字（可以不传）, '
+                                                 '返回数据库中与问题相关的：以逗号分隔的表名字列表')
+async def list_tables_tool(question: str = '', database: str = MCP_DEFAULT_DATABASE) -> str:
+    """输入是用户的问题（可以为空字符串）, 返回数据库中与问题相关的：以逗号分隔的表名字列表"""
+    async with db_registry.limit(database):
+        return await tool_executor.run('list_tables_tool', _list_tables, database, question)
 
-@mcp_server.tool('list_tables_tool', description='输入是一个空字符串, 返回数据库中的所有：以逗号分隔的表名字列表')
-def list_tables_tool() -> str:
-    """输入是一个空字符串, 返回数据库中的所有：以逗号分隔的表名字列表"""
-    return ", ".join(db.get_usable_table_names())  #   ['emp': “这是一个员工表，”, '']
+
+def _run_query(database: str, query: str, cursor: str) -> str:
+    try:
+        with db_registry.lease(database) as db:
+            if cursor:
+                try:
+                    return db.result_pager.next_page(cursor)
+                except KeyError:
+                    return "错误: cursor格式不正确，请重新执行查询。"
+            if not query:
+                return "错误: 请提供要执行的SQL查询语句。"
+            cached = db.result_cache.get(query)
+            if cached is not None:
+                return cached
+            result, next_cursor = db.result_pager.first_page(query)
+            if next_cursor is None:
+                db.result_cache.put(query, result)  # 只缓存一页就能返回完的结果
+            return result
+    except UnknownDatabase as e:
+        return f'错误: {e}'
+    except QueryTooExpensive as e:
+        return e.to_message()  # 结构化的错误信息，大模型可以据此改写SQL
+    except Exception as e:
+        return f'Error: {e}'
 
 
 @mcp_server.tool()
-def db_query_tool(query: str) -> str:
+async def db_query_tool(query: str = '', cursor: str = '', database: str = MCP_DEFAULT_DATABASE) -> str:
     """
     执行SQL查询并返回结果。
     如果查询不正确，将返回错误信息。
     如果返回错误，请重写查询语句，检查后重试。
 
+    结果的第一行是列名，后面每行是一条CSV格式的数据（NULL表示空值），最后一行是以 -- 开头的说明。
+    每次最多返回50行；如果说明里给出了cursor，并且确实需要更多数据，
+    只传入cursor参数（不传query）再次调用即可获取下一页。
+
     Args:
         query (str): 要执行的SQL查询语句
+        cursor (str): 获取下一页时使用，上一次调用返回的cursor
+        database (str): 要查询的数据库名字，不传时使用默认的数据库；获取下一页时不需要传
 
     Returns:
         str: 查询结果或错误信息
     """
-    result = db.run_no_throw(query)  # 执行查询（不抛出异常）
-    if not result:
-        return "错误: 查询失败。请修改查询语句后重试。"
-    return result
+    database = cursor_database(cursor) or database  # cursor里带着它所在的数据库
+    async with db_registry.limit(database):
+        return await tool_executor.run('db_query_tool', _run_query, database, query, cursor)
+
+
+def _column_stats(database: str, table: str, columns: str) -> str:
+    try:
+        with db_registry.lease(database) as db:
+            result = db.column_stats.describe(table, columns.split(','))
+            if result is None:
+                return (f'错误: 数据库 {database} 还没有生成列统计（python -m mcp_server.column_stats --database {database}），'
+                        f'请直接用 db_query_tool 查询')
+            try:
+                with db.pool.connection() as conn:
+                    schema_version = conn.execute('PRAGMA schema_version').fetchone()[0]
+            except TimeoutError:  # 连接都在用：统计本身不需要连接，照样返回，只是没法检查是否过期
+                return result + '\n-- 数据库繁忙，没有检查统计之后表结构是否有变化'
+            if db.column_stats.schema_version() != schema_version:
+                result += '\n-- 统计之后表结构有变化，统计可能已经过期'
+            return result
+    except UnknownDatabase as e:
+        return f'错误: {e}'
+
+
+@mcp_server.tool('column_stats_tool', description='返回表中每一列的统计信息：行数、空值比例、不同值数量、最小/最大值和最常见的值。'
+                                                  '需要了解列的取值（比如有哪些状态、日期范围、是否有空值）时使用，'
+                                                  '不需要再执行 SELECT DISTINCT / COUNT 之类的查询')
+async def column_stats_tool(table: str, columns: str = '', database: str = MCP_DEFAULT_DATABASE) -> str:
+    """
+    返回预先统计好的列信息。
+
+    Args:
+        table (str): 表名
+        columns (str): 以逗号分隔的列名，为空时返回所有列
+        database (str): 数据库名字，不传时使用默认的数据库
+    """
+    async with db_registry.limit(database):
+        return await tool_executor.run('column_stats_tool', _column_stats, database, table, columns)
+
+
+def _value_lookup(database: str, text: str, table: str, column: str) -> str:
+    try:
+        with db_registry.lease(database) as db:
+            results = db.value_index.lookup(text, table, column, wait=2)
+    except UnknownDatabase as e:
+        return f'错误: {e}'
+    if results is None:
+        return f'数据库 {database} 的文本值索引正在建立（第一次使用），请稍后再试，或者直接用 db_query_tool 查询'
+    if not results:
+        return f'没有找到和 {text} 相似的值'
+    # 值按SQL字符串字面量的写法给出（单引号转义），可以直接放进 WHERE 条件
+    return '\n'.join(f"{r['table']}.{r['column']} = '{r['value'].replace(chr(39), chr(39) * 2)}'"
+                     f"（{r['rows']}行，相似度{r['score']}）" for r in results)
+
+
+@mcp_server.tool('value_lookup_tool', description='在数据库文本列的所有取值里模糊查找和给定文字相似的值，返回 表.列 = 准确的值。'
+                                                  '问题里提到人名、地名、名称等具体的值时，先用它找到数据库里的准确写法，'
+                                                  '再写到SQL的 WHERE 条件里')
+async def value_lookup_tool(text: str, table: str = '', column: str = '', database: str = MCP_DEFAULT_DATABASE) -> str:
+    """
+    模糊查找数据库里的文本值。
+
+    Args:
+        text (str): 问题里提到的值（可以有拼写错误、大小写不同）
+        table (str): 只在这张表里查找，为空时查找所有表
+        column (str): 只在这一列里查找，为空时查找所有文本列
+        database (str): 数据库名字，不传时使用默认的数据库
+    """
+    async with db_registry.limit(database):
+        return await tool_executor.run('value_lookup_tool', _value_lookup, database, text, table, column)
+
+
+@mcp_server.tool('server_metrics_tool', description='返回MCP服务的运行指标（缓存命中率等），JSON格式')
+def server_metrics_tool() -> str:
+    """返回MCP服务的运行指标，JSON格式"""
+    return json.dumps({
+        'databases': db_registry.stats(),
+        'search_cache': search_cache.stats(),
+        'tool_executor': tool_executor.stats(),
+    }, ensure_ascii=False)
+
+
+@mcp_server.custom_route('/metrics', methods=['GET'])
+async def metrics(request: Request) -> PlainTextResponse:
+    """Prometheus格式的指标：工具排队时间、执行时间（db_query_tool的执行时间即SQLite耗时）"""
+    return PlainTextResponse(metrics_registry.render(), media_type='text/plain; version=0.0.4')
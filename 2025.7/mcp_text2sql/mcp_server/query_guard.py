@@ -0,0 +1,152 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# 执行计划中的一行，例如：SCAN t / SCAN TABLE Track / SEARCH a USING INTEGER PRIMARY KEY (rowid=?)
+_PLAN_RE = re.compile(r'^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?(.*)$', re.IGNORECASE)
+# FROM / JOIN / 逗号 后面的 表名 [AS] 别名
+_ALIAS_RE = re.compile(r'(?:\bfrom|\bjoin|,)\s+["`\[]?(\w+)["`\]]?(?:\s+(?:as\s+)?(\w+))?', re.IGNORECASE)
+_NOT_ALIAS = {'where', 'on', 'using', 'join', 'left', 'right', 'inner', 'outer', 'cross', 'natural', 'full',
+              'group', 'order', 'limit', 'having', 'union', 'except', 'intersect', 'window', 'as'}
+
+
+class QueryTooExpensive(Exception):
+    """查询代价过高（执行计划超过阈值，或者执行超时）"""
+
+    def __init__(self, reason: str, detail: str, plan: List[str] = None):
+        super().__init__(f'{reason}: {detail}')
+        self.reason = reason
+        self.detail = detail
+        self.plan = plan or []
+
+    def to_message(self) -> str:
+        """返回给大模型的结构化错误信息，告诉它怎么修改SQL"""
+        return '错误: ' + json.dumps({
+            'error': 'too_expensive',
+            'reason': self.reason,
+            'detail': self.detail,
+            'plan': self.plan,
+            'suggestion': '请添加更严格的WHERE条件、使用带索引的列做JOIN、避免笛卡尔积，或者先聚合再关联',
+        }, ensure_ascii=False)
+
+
+def parse_aliases(query: str) -> Dict[str, str]:
+    """从SQL里解析 别名 -> 表名 的映射（够用的简单实现，不处理所有语法）"""
+    aliases = {}
+    for table, alias in _ALIAS_RE.findall(query):
+        aliases[table.lower()] = table
+        if alias and alias.lower() not in _NOT_ALIAS:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+class QueryGuard:
+    """
+    查询代价守卫：执行前用 EXPLAIN QUERY PLAN 估算代价，执行中用 progress handler 控制最长执行时间。
+
+    - 单张表的全表扫描（SCAN）超过 max_scan_rows 行，拒绝执行；
+    - 同一层嵌套循环里多个全表扫描的行数乘积超过 max_join_rows（比如笛卡尔积），拒绝执行；
+    - 执行超过 timeout 秒，中断查询。
+    表的行数用 max(rowid) 估算（只读B树的最右边，O(log n)），缓存 stats_ttl 秒。
+    """
+
+    def __init__(self, max_scan_rows: int = 5_000_000, max_join_rows: int = 50_000_000,
+                 timeout: float = 10, stats_ttl: float = 300):
+        self.max_scan_rows = max_scan_rows
+        self.max_join_rows = max_join_rows
+        self.timeout = timeout
+        self.stats_ttl = stats_ttl
+        self._row_counts = {}  # 表名 -> (估算行数, 时间)
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.interrupted = 0
+
+    def _table_rows(self, conn: sqlite3.Connection, table: str) -> int:
+        with self._lock:
+            cached = self._row_counts.get(table)
+        if cached and time.time() - cached[1] < self.stats_ttl:
+            return cached[0]
+        try:
+            rows = conn.execute(f'SELECT max(rowid) FROM "{table}"').fetchone()[0] or 0
+        except sqlite3.OperationalError:  # WITHOUT ROWID 的表
+            rows = conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+        with self._lock:
+            self._row_counts[table] = (rows, time.time())
+        return rows
+
+    def _analyze(self, conn: sqlite3.Connection, query: str):
+        """解析执行计划，返回 (执行计划文本列表, [(父节点, 操作, 表名, 估算行数, 是否自动索引)])"""
+        plan = conn.execute(f'EXPLAIN QUERY PLAN {query}').fetchall()
+        tables = {name.lower(): name for (name,) in
+                  conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        aliases = parse_aliases(query)
+        steps = []
+        for _, parent, _, detail in plan:
+            match = _PLAN_RE.match(detail)
+            if not match:
+                continue
+            op, name, _, rest = match.groups()
+            table = tables.get(name.lower()) or tables.get(aliases.get(name.lower(), '').lower())
+            if table is None:  # 子查询、临时表等
+                continue
+            steps.append((parent, op.upper(), table, self._table_rows(conn, table), 'AUTOMATIC' in rest.upper()))
+        return [row[3] for row in plan], steps
+
+    def check(self, conn: sqlite3.Connection, query: str):
+        """检查执行计划，代价过高时抛出 QueryTooExpensive"""
+        details, steps = self._analyze(conn, query)
+        loop_rows = {}  # 同一个父节点下的全表扫描行数乘积
+        for parent, op, table, rows, automatic in steps:
+            if op != 'SCAN' and not automatic:
+                continue
+            if rows > self.max_scan_rows:
+                self.rejected += 1
+                raise QueryTooExpensive('unbounded_scan', f'需要全表扫描 {table}（约{rows}行），超过上限{self.max_scan_rows}行',
+                                        details)
+            if op == 'SCAN':  # 自动索引只需要扫描一次，不参与嵌套循环的乘积
+                loop_rows[parent] = loop_rows.get(parent, 1) * max(rows, 1)
+                if loop_rows[parent] > self.max_join_rows:
+                    self.rejected += 1
+                    raise QueryTooExpensive('join_too_large', f'多表全表扫描的嵌套循环约{loop_rows[parent]}行组合，'
+                                                              f'超过上限{self.max_join_rows}', details)
+
+    def estimate_cost(self, conn: sqlite3.Connection, query: str) -> int:
+        """
+        粗略估算查询代价（越小越好）：各层嵌套循环中全表扫描行数的乘积之和，
+        自动索引按扫描一次计算，每次索引查找按1计算。SQL有语法错误或者表、列不存在时抛出 sqlite3.Error。
+        """
+        _, steps = self._analyze(conn, query)
+        loop_rows = {}
+        cost = 0
+        for parent, op, table, rows, automatic in steps:
+            if op == 'SCAN':
+                loop_rows[parent] = loop_rows.get(parent, 1) * max(rows, 1)
+            elif automatic:
+                cost += rows
+            else:
+                cost += 1
+        return cost + sum(loop_rows.values())
+
+    @contextmanager
+    def deadline(self, conn: sqlite3.Connection, timeout: float = None):
+        """在这个上下文中执行的查询超过 timeout 秒会被中断，抛出 QueryTooExpensive"""
+        timeout = self.timeout if timeout is None else timeout
+        end = time.monotonic() + timeout
+        # 每执行1000条虚拟机指令检查一次时间，返回非0值会让SQLite中断当前查询
+        conn.set_progress_handler(lambda: 1 if time.monotonic() > end else 0, 1000)
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e) and time.monotonic() > end:
+                self.interrupted += 1
+                raise QueryTooExpensive('timeout', f'查询执行超过{timeout}秒被中断') from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+    def stats(self) -> dict:
+        return {'rejected': self.rejected, 'interrupted': self.interrupted}
@@ -0,0 +1,129 @@
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from sql_graph.log_utils import log
+
+# 依次匹配：注释、字符串、带引号的标识符、数字、单词、其他符号
+_TOKEN_RE = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<ident>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+  | (?P<number>\d+\.\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?|\d+(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><>|!=|<=|>=|==|\|\||\S)
+""", re.VERBOSE | re.DOTALL)
+_SIMPLE_IDENT_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    把SQL转换成规范形式作为缓存的key：去掉注释和结尾的分号，合并空白，
+    关键字和标识符统一小写（SQLite不区分大小写），数字统一格式（007 -> 7，1.50 -> 1.5），
+    字符串常量保持原样（区分大小写）。
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(sql):
+        kind, value = match.lastgroup, match.group()
+        if kind == 'comment':
+            continue
+        if kind == 'ident':
+            name = value[1:-1]
+            value = name.lower() if _SIMPLE_IDENT_RE.match(name) else value
+        elif kind == 'word':
+            value = value.lower()
+        elif kind == 'number':
+            value = str(int(value)) if value.isdigit() else repr(float(value))
+        tokens.append(value)
+    while tokens and tokens[-1] == ';':
+        tokens.pop()
+    return ' '.join(tokens)
+
+
+def is_read_only(canonical_sql: str) -> bool:
+    """只缓存查询语句的结果"""
+    return canonical_sql.startswith('select ') or canonical_sql.startswith('with ')
+
+
+class ResultCache:
+    """
+    db_query_tool 的查询结果缓存，key 是规范化之后的SQL。
+
+    用一个专门的只读连接读取 PRAGMA data_version：其他连接提交了任何修改，这个值都会变化，
+    变化时清空整个缓存。缓存总大小按字节数限制，超出时按LRU淘汰。
+    """
+
+    def __init__(self, db_path: str, max_bytes: int = 32 * 1024 * 1024, max_entry_bytes: int = 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes  # 单条结果超过这个大小不缓存
+        self._conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, check_same_thread=False)
+        self._entries: 'OrderedDict[str, str]' = OrderedDict()
+        self._data_version = None
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_data_version(self):
+        """数据库有修改时清空缓存，调用方需要持有锁"""
+        version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            if self._entries:
+                self.invalidations += 1
+                log.info(f'数据库已修改（data_version {self._data_version} -> {version}），清空查询结果缓存')
+            self._entries.clear()
+            self.bytes = 0
+            self._data_version = version
+
+    def get(self, sql: str) -> Optional[str]:
+        key = canonicalize_sql(sql)
+        if not is_read_only(key):
+            return None
+        with self._lock:
+            self._check_data_version()
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, sql: str, result: str):
+        key = canonicalize_sql(sql)
+        size = len(key.encode('utf-8')) + len(result.encode('utf-8'))
+        if not is_read_only(key) or size > self.max_entry_bytes:
+            return
+        with self._lock:
+            self._check_data_version()
+            if key in self._entries:
+                old = self._entries.pop(key)
+                self.bytes -= len(key.encode('utf-8')) + len(old.encode('utf-8'))
+            while self._entries and self.bytes + size > self.max_bytes:
+                old_key, old = self._entries.popitem(last=False)
+                self.bytes -= len(old_key.encode('utf-8')) + len(old.encode('utf-8'))
+                self.evictions += 1
+            self._entries[key] = result
+            self.bytes += size
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self._conn.close()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,210 @@
+import base64
+import csv
+import io
+import json
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+from mcp_server.sqlite_pool import SQLitePool, truncate_value
+
+
+@dataclass
+class OpenCursor:
+    """还没有读完的查询：占用连接池中的一个连接，直到读完、过期或被淘汰"""
+    conn: sqlite3.Connection
+    cursor: sqlite3.Cursor
+    columns: List[str]
+    query: str
+    rows_sent: int = 0
+    pending: Optional[tuple] = None  # 上一页因为字节数超限没放下的一行
+    last_used: float = field(default_factory=time.time)
+    closed: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class ResultPager:
+    """
+    分页返回查询结果：第一行是列名，后面是CSV格式的数据，最后一行是注释说明是否还有更多结果。
+
+    每页最多 page_rows 行、page_bytes 字节；结果没读完时返回一个 cursor，
+    下一页直接从还开着的 sqlite3 游标继续读，不会重新执行查询。
+    最多同时保留 max_open 个游标（每个占一个连接），超过 ttl 秒没有读取的游标自动关闭。
+
+    cursor 里同时编码了查询语句和已经返回的行数：游标不在这个进程里（多进程部署时请求落到了其他工作进程）
+    或者已经被关闭时，重新执行查询并跳过已经返回的行，任何一个进程都能接着返回下一页。
+    """
+
+    def __init__(self, pool: SQLitePool, page_rows: int = 50, page_bytes: int = 8 * 1024,
+                 ttl: float = 120, max_open: int = 4, token_prefix: str = ''):
+        self.pool = pool
+        self.token_prefix = token_prefix  # 加在cursor前面，多个数据库时用来找到cursor所在的数据库
+        self.page_rows = page_rows
+        self.page_bytes = page_bytes
+        self.ttl = ttl
+        self.max_open = max_open
+        self._cursors = {}  # cursor token -> OpenCursor
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.expired = 0
+        self.resumed = 0  # 游标不在本进程、重新执行查询的次数
+
+    def _encode_row(self, row) -> str:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerow(
+            ['NULL' if v is None else truncate_value(v, self.pool.max_string_length) for v in row])
+        return buffer.getvalue()
+
+    def _read_page(self, state: OpenCursor) -> Tuple[str, bool]:
+        """读取一页，返回 (页面内容, 是否已经读完)"""
+        lines = [self._encode_row(state.columns)]
+        size = len(lines[0].encode('utf-8'))
+        count = 0
+        exhausted = False
+        while count < self.page_rows:
+            row = state.pending if state.pending is not None else state.cursor.fetchone()
+            state.pending = None
+            if row is None:
+                exhausted = True
+                break
+            line = self._encode_row(row)
+            line_size = len(line.encode('utf-8'))
+            if count and size + line_size > self.page_bytes:
+                state.pending = row  # 放到下一页
+                break
+            lines.append(line)
+            size += line_size
+            count += 1
+        if not exhausted and state.pending is None:
+            # 恰好读满一页时，预读一行判断后面还有没有数据
+            state.pending = state.cursor.fetchone()
+            exhausted = state.pending is None
+        state.rows_sent += count
+        self.pages += 1
+        return ''.join(lines), exhausted
+
+    def _token(self, cursor_id: str, state: OpenCursor) -> str:
+        """cursor：本进程里的游标编号 ~ 压缩后的 [查询语句, 已经返回的行数]"""
+        payload = zlib.compress(json.dumps([state.query, state.rows_sent], ensure_ascii=False).encode('utf-8'))
+        return f'{self.token_prefix}{cursor_id}~{base64.urlsafe_b64encode(payload).decode().rstrip("=")}'
+
+    def _parse(self, token: str) -> Tuple[str, str, int]:
+        """cursor -> (游标编号, 查询语句, 已经返回的行数)，格式不对时抛出 KeyError"""
+        try:
+            cursor_id, payload = token[len(self.token_prefix):].split('~', 1)
+            query, offset = json.loads(zlib.decompress(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))))
+            return cursor_id, str(query), int(offset)
+        except (ValueError, TypeError, zlib.error) as e:
+            raise KeyError(token) from e
+
+    def _footer(self, state: OpenCursor, token: Optional[str]) -> str:
+        if token is None:
+            return f'-- 共{state.rows_sent}行'
+        return f'-- 已返回{state.rows_sent}行，还有更多结果。需要时用 db_query_tool(cursor="{token}") 获取下一页'
+
+    def _close(self, state: OpenCursor):
+        state.closed = True
+        try:
+            state.cursor.close()
+        finally:
+            self.pool.release(state.conn)
+
+    def _expire(self):
+        """关闭过期的游标；游标数量已满时关闭最久没用的那个"""
+        now = time.time()
+        with self._lock:
+            stale = [t for t, s in self._cursors.items() if now - s.last_used > self.ttl]
+            if len(self._cursors) - len(stale) >= self.max_open:
+                alive = sorted((s.last_used, t) for t, s in self._cursors.items() if t not in stale)
+                stale.append(alive[0][1])
+            states = [self._cursors.pop(t) for t in stale]
+        for state in states:
+            with state.lock:
+                self._close(state)
+            self.expired += 1
+
+    def _open(self, query: str, offset: int = 0) -> Tuple[str, Optional[str]]:
+        """执行查询，跳过前 offset 行后返回一页，返回 (页面内容, cursor)；全部读完时 cursor 为 None"""
+        self._expire()
+        guard = self.pool.guard
+        conn = self.pool.acquire()
+        try:
+            if guard is not None:
+                guard.check(conn, query)
+            with guard.deadline(conn) if guard else nullcontext():
+                cursor = conn.execute(query)
+                state = OpenCursor(conn, cursor, [d[0] for d in cursor.description or ()], query)
+                skipped = 0
+                while skipped < offset:
+                    rows = cursor.fetchmany(min(offset - skipped, 1000))
+                    if not rows:
+                        break
+                    skipped += len(rows)
+                state.rows_sent = skipped
+                page, exhausted = self._read_page(state)
+        except BaseException:
+            self.pool.release(conn)
+            raise
+        if exhausted:
+            self._close(state)
+            return page + self._footer(state, None), None
+        cursor_id = secrets.token_urlsafe(6)
+        token = self._token(cursor_id, state)
+        with self._lock:
+            self._cursors[cursor_id] = state
+        return page + self._footer(state, token), token
+
+    def first_page(self, query: str) -> Tuple[str, Optional[str]]:
+        """执行查询并返回第一页，返回 (页面内容, cursor)；全部读完时 cursor 为 None"""
+        return self._open(query)
+
+    def next_page(self, token: str) -> str:
+        """根据 cursor 返回下一页，cursor 格式不对时抛出 KeyError"""
+        cursor_id, query, offset = self._parse(token)
+        self._expire()
+        with self._lock:
+            state = self._cursors.get(cursor_id)
+        if state is None or state.rows_sent != offset:
+            # 游标不在这个进程、已经关闭，或者同一页被重复读取：重新执行查询
+            self.resumed += 1
+            return self._open(query, offset)[0]
+        guard = self.pool.guard
+        with state.lock:
+            if state.closed or state.rows_sent != offset:  # 刚好被其他线程判定为过期或者读走了这一页
+                self.resumed += 1
+                return self._open(query, offset)[0]
+            state.last_used = time.time()
+            try:
+                with guard.deadline(state.conn) if guard else nullcontext():
+                    page, exhausted = self._read_page(state)
+            except BaseException:
+                with self._lock:
+                    self._cursors.pop(cursor_id, None)
+                self._close(state)
+                raise
+            if exhausted:
+                with self._lock:
+                    self._cursors.pop(cursor_id, None)
+                self._close(state)
+                return page + self._footer(state, None)
+        return page + self._footer(state, self._token(cursor_id, state))
+
+    def close(self):
+        """关闭所有还没读完的游标，把连接还给连接池"""
+        with self._lock:
+            states = list(self._cursors.values())
+            self._cursors.clear()
+        for state in states:
+            with state.lock:
+                if not state.closed:
+                    self._close(state)
+
+    def stats(self) -> dict:
+        return {'open_cursors': len(self._cursors), 'pages': self.pages, 'expired': self.expired,
+                'resumed': self.resumed}
+
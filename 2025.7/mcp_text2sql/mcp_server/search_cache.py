@@ -0,0 +1,106 @@
+import asyncio
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from sql_graph.log_utils import log
+from sql_graph.metrics import metrics_registry
+
+SEARCH_REQUESTS = metrics_registry.counter('mcp_search_requests_total',
+                                           '搜索请求按缓存结果的计数（hit：命中缓存，joined：等待进行中的相同搜索，miss：调用接口）',
+                                           ('result',))
+SEARCH_UPSTREAM_SECONDS = metrics_registry.histogram('mcp_search_upstream_seconds', '调用搜索接口的耗时（秒）', ('status',))
+
+
+def normalize_query(query: str) -> str:
+    """缓存的key：全角转半角、忽略大小写、合并空白"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', query)).strip().casefold()
+
+
+class SearchCache:
+    """
+    搜索结果缓存：按规范化之后的问题缓存 ttl 秒，最多 max_entries 条（LRU淘汰）。
+    同一时间进行中的相同搜索只调用一次接口（single-flight），其他请求等待同一个结果；
+    接口调用在单独的任务里执行，发起的请求被取消（比如客户端断开）不影响其他等待的请求。
+    调用失败的结果不缓存。缓存在进程内，多进程部署时每个进程各有一份。
+    """
+
+    def __init__(self, ttl: float = 600, max_entries: int = 1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()  # key -> (过期时间, 结果)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.joined = 0
+        self.errors = 0
+        self.upstream_seconds = 0.0
+
+    def _get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _put(self, key: str, result: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            result = await fetch()
+            status = 'ok'
+            self._put(key, result)
+            return result
+        except BaseException:
+            self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.upstream_seconds += elapsed
+            SEARCH_UPSTREAM_SECONDS.observe(elapsed, status=status)
+            self._inflight.pop(key, None)
+
+    async def get_or_fetch(self, query: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """返回缓存的结果；没有时调用 fetch()，或者等待进行中的相同搜索"""
+        key = normalize_query(query)
+        result = self._get(key)
+        if result is not None:
+            self.hits += 1
+            SEARCH_REQUESTS.inc(result='hit')
+            return result
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            SEARCH_REQUESTS.inc(result='miss')
+            task = asyncio.create_task(self._fetch(key, fetch))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # 等待的请求都取消了也不报警告
+            self._inflight[key] = task
+        else:
+            self.joined += 1
+            SEARCH_REQUESTS.inc(result='joined')
+            log.debug(f'等待进行中的相同搜索: {query}')
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses + self.joined
+        return {
+            'entries': len(self._entries),
+            'inflight': len(self._inflight),
+            'hits': self.hits,
+            'misses': self.misses,
+            'joined': self.joined,
+            'hit_rate': (self.hits + self.joined) / total if total else 0.0,
+            'upstream_errors': self.errors,
+            'avg_upstream_ms': round(self.upstream_seconds / self.misses * 1000, 2) if self.misses else 0.0,
+        }
@@ -0,0 +1,107 @@
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Sequence, Set
+
+from mcp_server.table_retriever import BM25, tokenize
+from sql_graph.context_compactor import estimate_tokens
+
+_PARAGRAPH_RE = re.compile(r'\n\s*\n|\n')
+_SHINGLE = 5  # 判断重复时比较的字符片段长度（中文不需要分词）
+
+
+@dataclass
+class Passage:
+    """搜索结果里的一段文字"""
+    text: str
+    title: str = ''
+    link: str = ''
+    queries: Set[int] = field(default_factory=set)  # 哪些子问题的搜索结果里出现过（去重时合并）
+    score: float = 0.0
+
+
+def split_passages(result: Dict[str, str], query_index: int, max_chars: int = 400) -> List[Passage]:
+    """把一条搜索结果的正文按段落切开，太短的段落和后面的合并，太长的按 max_chars 切断"""
+    passages = []
+    buffer = ''
+    for paragraph in _PARAGRAPH_RE.split(result.get('content') or ''):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        buffer = f'{buffer}\n{paragraph}' if buffer else paragraph
+        if len(buffer) < max_chars // 4:
+            continue
+        while buffer:
+            passages.append(Passage(buffer[:max_chars], result.get('title', ''), result.get('link', ''), {query_index}))
+            buffer = buffer[max_chars:]
+    if buffer:
+        passages.append(Passage(buffer, result.get('title', ''), result.get('link', ''), {query_index}))
+    return passages
+
+
+def _shingles(text: str) -> Set[str]:
+    text = re.sub(r'\s+', '', unicodedata.normalize('NFKC', text)).casefold()
+    if len(text) <= _SHINGLE:
+        return {text}
+    return {text[i:i + _SHINGLE] for i in range(len(text) - _SHINGLE + 1)}
+
+
+def deduplicate(passages: List[Passage], threshold: float = 0.8) -> List[Passage]:
+    """
+    去掉重复的段落：两段的字符片段有 threshold 以上重合（按较短的一段计算，转载、摘要和原文也算重复）时只保留较长的一段，
+    并把它出现过的子问题合并过去。
+    """
+    kept: List[Passage] = []
+    kept_shingles: List[Set[str]] = []
+    for passage in sorted(passages, key=lambda p: len(p.text), reverse=True):
+        shingles = _shingles(passage.text)
+        for other, other_shingles in zip(kept, kept_shingles):
+            if len(shingles & other_shingles) >= threshold * min(len(shingles), len(other_shingles)):
+                other.queries |= passage.queries
+                break
+        else:
+            kept.append(passage)
+            kept_shingles.append(shingles)
+    return kept
+
+
+def rank(passages: List[Passage], queries: Sequence[str], overlap_bonus: float = 0.2) -> List[Passage]:
+    """
+    按相关度排序：每个子问题单独算BM25，除以这个子问题的最高分归一化后相加，
+    同时和多个子问题相关的段落排在前面；被多个子问题搜到的段落再加 overlap_bonus。
+    """
+    if not passages:
+        return []
+    index = BM25({i: tokenize(f'{p.title} {p.text}') for i, p in enumerate(passages)})
+    for query in queries:
+        hits = index.search(tokenize(query), len(passages))
+        if not hits:
+            continue
+        best = hits[0][1]
+        for i, score in hits:
+            passages[i].score += score / best
+    for passage in passages:
+        passage.score += overlap_bonus * (len(passage.queries) - 1)
+    return sorted(passages, key=lambda p: p.score, reverse=True)
+
+
+def truncate_to_budget(passages: List[Passage], max_tokens: int) -> List[str]:
+    """按顺序放入段落（带来源），直到用完token预算；第一段就放不下时截断它"""
+    blocks = []
+    used = 0
+    for passage in passages:
+        source = f'[{len(blocks) + 1}] {passage.title} {passage.link}'.strip()
+        block = f'{source}\n{passage.text}'
+        tokens = estimate_tokens(block)
+        if used + tokens > max_tokens:
+            if blocks:
+                continue  # 后面较短的段落可能还放得下
+            # 按比例截断（中英文混合时估算不精确，再留一点余量）
+            keep = max(0, int(len(block) * (max_tokens - used) / tokens * 0.9))
+            block = block[:keep]
+            tokens = estimate_tokens(block)
+            if not block:
+                break
+        blocks.append(block)
+        used += tokens
+    return blocks
@@ -0,0 +1,138 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+from mcp_server.query_guard import QueryGuard
+from sql_graph.log_utils import log
+
+
+def truncate_value(value, length: int, suffix: str = '...'):
+    """和 SQLDatabase.run 一样截断过长的字符串，避免结果太长"""
+    if not isinstance(value, str) or length <= 0 or len(value) <= length:
+        return value
+    return value[: length - len(suffix)].rsplit(' ', 1)[0] + suffix
+
+
+class SQLitePool:
+    """
+    只读的SQLite连接池，给MCP服务的工具并发使用。
+
+    - 连接用 mode=ro 打开（immutable=True 时再加 immutable=1，数据库文件确定不会被修改时使用，省掉文件锁），
+      并设置 query_only，任何写操作都会失败；
+    - 每个连接设置 mmap_size 和 cache_size，读多写少的场景下减少系统调用和重复读页；
+    - 连接按需创建，最多 size 个；池子空了就等待，超时抛出 TimeoutError；
+    - 传入 guard 时，执行前检查执行计划的代价，执行中限制最长时间（见 QueryGuard）。
+    """
+
+    def __init__(self, db_path: str, size: int = 8, immutable: bool = False,
+                 mmap_size: int = 256 * 1024 * 1024, cache_size_kb: int = 64 * 1024,
+                 acquire_timeout: float = 30, max_string_length: int = 300, guard: Optional[QueryGuard] = None):
+        self.db_path = os.path.abspath(db_path)
+        self.size = size
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.acquire_timeout = acquire_timeout
+        self.max_string_length = max_string_length
+        self.guard = guard
+        self._idle = queue.LifoQueue()  # 后进先出，优先复用热的连接
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = f'file:{self.db_path}?mode=ro'
+        if self.immutable:
+            uri += '&immutable=1'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')  # 负数表示单位是KB
+        conn.execute('PRAGMA query_only = 1')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def acquire(self, timeout: float = None) -> sqlite3.Connection:
+        """借出一个连接，必须调用 release 归还（一般用 connection() 上下文）"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.acquire_timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise TimeoutError(f'等待数据库连接超时，连接池大小: {self.size}')
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        """归还连接，broken=True 时直接关闭"""
+        if not broken and conn.in_transaction:
+            conn.rollback()
+        if broken or self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """从池中借一个连接，用完自动归还"""
+        conn = self.acquire(timeout)
+        broken = False
+        try:
+            yield conn
+        except sqlite3.ProgrammingError:  # 连接已经不可用，丢弃
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def execute(self, query: str) -> Tuple[List[str], List[tuple]]:
+        """执行查询，返回 (列名列表, 所有行)"""
+        with self.connection() as conn:
+            if self.guard is None:
+                cursor = conn.execute(query)
+                rows = cursor.fetchall()
+            else:
+                self.guard.check(conn, query)
+                with self.guard.deadline(conn):
+                    cursor = conn.execute(query)
+                    rows = cursor.fetchall()
+            columns = [d[0] for d in cursor.description or ()]
+        return columns, rows
+
+    def run(self, query: str) -> str:
+        """和 SQLDatabase.run 的返回格式一致：有结果返回元组列表的字符串，没有结果返回空字符串"""
+        _, rows = self.execute(query)
+        rows = [tuple(truncate_value(v, self.max_string_length) for v in row) for row in rows]
+        return str(rows) if rows else ''
+
+    def run_no_throw(self, query: str) -> str:
+        """执行查询，出错时返回错误信息而不是抛出异常"""
+        try:
+            return self.run(query)
+        except Exception as e:
+            return f'Error: {e}'
+
+    def close(self):
+        """关闭所有空闲连接，正在使用的连接在归还时关闭"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+        log.info(f'SQLite连接池已关闭: {self.db_path}')
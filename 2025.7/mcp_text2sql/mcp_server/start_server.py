@@ -1,4 +1,104 @@
-from mcp_server.mcp_tools import mcp_server
+"""
+启动MCP服务。
+
+开发调试（默认）：单进程，SSE传输：
+    python -m mcp_server.start_server
+生产部署：Streamable HTTP传输，多个工作进程监听同一个端口，各自用只读连接打开同一个数据库：
+    python -m mcp_server.start_server --transport streamable-http --workers 4 --host 0.0.0.0 \
+        --allowed-hosts mcp.example.com:* 10.0.0.5:*
+
+多进程时使用无状态模式（stateless_http）：请求不依赖某个进程里的会话，可以落到任意一个工作进程；
+工具调用的结果直接作为JSON响应返回（json_response），不再为每个请求保持一个SSE流。
+分页的 cursor 里带着查询语句和已经返回的行数，下一页落到其他工作进程时会重新执行查询并跳过已返回的行。
+默认开启 DNS rebinding 保护，只接受 Host 头是 localhost 的请求；其他地址访问时要用 --allowed-hosts
+（或者 MCP_ALLOWED_HOSTS）列出允许的 Host，--allowed-hosts '*' 才会关闭保护。
+客户端设置 MCP_TRANSPORT=streamable_http、MCP_SERVER_URL=http://<host>:8000/mcp。
+注意 /metrics 只返回处理这次抓取的那个工作进程的指标。
+"""
+import argparse
+import os
+from contextlib import asynccontextmanager
+
+import uvicorn
+from mcp.server.transport_security import TransportSecuritySettings
+
+from mcp_server.mcp_tools import db_registry, mcp_server
+from sql_graph.env_utils import MCP_ALLOWED_HOSTS
+from sql_graph.log_utils import log
+
+_LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+_LOCAL_ALLOWED_HOSTS = ['127.0.0.1:*', 'localhost:*', '[::1]:*']
+
+
+def configure_transport_security(allowed_hosts: str, bind_host: str):
+    """按允许的 Host 列表设置 DNS rebinding 保护：空表示只允许 localhost，* 表示关闭保护"""
+    hosts = [h.strip() for h in allowed_hosts.split(',') if h.strip()]
+    if hosts == ['*']:
+        log.warning('已关闭 DNS rebinding 保护（--allowed-hosts *），请由网络和网关负责访问控制')
+        mcp_server.settings.transport_security = None
+        return
+    hosts = _LOCAL_ALLOWED_HOSTS + hosts
+    mcp_server.settings.transport_security = TransportSecuritySettings(
+        enable_dns_rebinding_protection=True, allowed_hosts=hosts,
+        allowed_origins=[f'{scheme}://{h}' for h in hosts for scheme in ('http', 'https')])
+    if bind_host not in _LOOPBACK_HOSTS and hosts == _LOCAL_ALLOWED_HOSTS:
+        log.warning(f'监听 {bind_host} 但是只允许 localhost 的 Host 头，其他地址的请求会被拒绝（421），'
+                    f'需要时用 --allowed-hosts 列出允许的 Host')
+
+
+def create_app():
+    """uvicorn 的应用工厂，每个工作进程调用一次"""
+    mcp_server.settings.stateless_http = True
+    mcp_server.settings.json_response = True
+    configure_transport_security(os.getenv('MCP_ALLOWED_HOSTS', MCP_ALLOWED_HOSTS),
+                                 os.getenv('MCP_BIND_HOST', mcp_server.settings.host))
+    app = mcp_server.streamable_http_app()
+    session_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(starlette_app):
+        """工作进程退出时关闭所有打开的数据库（连接池、游标、结果缓存和文本值索引）"""
+        try:
+            async with session_lifespan(starlette_app):
+                yield
+        finally:
+            db_registry.close()
+
+    app.router.lifespan_context = lifespan
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动MCP服务')
+    parser.add_argument('--transport', choices=['sse', 'streamable-http'], default='sse')
+    parser.add_argument('--host', default=mcp_server.settings.host)
+    parser.add_argument('--port', type=int, default=mcp_server.settings.port)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Streamable HTTP 的工作进程数，默认等于CPU核数')
+    parser.add_argument('--keep-alive', type=float, default=75,
+                        help='空闲的HTTP长连接保持多少秒；要比客户端（httpx默认5秒）和前面网关的空闲超时更长，'
+                             '避免服务端先关闭客户端正要复用的连接')
+    parser.add_argument('--backlog', type=int, default=2048, help='等待accept的连接队列长度')
+    parser.add_argument('--allowed-hosts', nargs='*', default=[h for h in MCP_ALLOWED_HOSTS.split(',') if h],
+                        help="允许的 Host 头（例如 mcp.example.com:*），默认只允许 localhost；'*' 表示关闭 DNS rebinding 保护")
+    args = parser.parse_args()
+
+    if args.transport == 'sse':
+        configure_transport_security(','.join(args.allowed_hosts), args.host)
+        mcp_server.settings.host = args.host
+        mcp_server.settings.port = args.port
+        try:
+            mcp_server.run(transport='sse')
+        finally:
+            db_registry.close()
+        return
+
+    os.environ['MCP_BIND_HOST'] = args.host  # 传给工作进程里的 create_app
+    os.environ['MCP_ALLOWED_HOSTS'] = ','.join(args.allowed_hosts)
+    uvicorn.run('mcp_server.start_server:create_app', factory=True, host=args.host, port=args.port,
+                workers=args.workers, timeout_keep_alive=args.keep_alive, backlog=args.backlog,
+                log_level=mcp_server.settings.log_level.lower())
+
 
 if __name__ == '__main__':
-    mcp_server.run(transport='sse')
+    main()
@@ -0,0 +1,139 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from sql_graph.db_utils import get_schema_version
+from sql_graph.log_utils import log
+
+_WORD_RE = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+|[\u4e00-\u9fff]+')
+
+
+def tokenize(value: str) -> List[str]:
+    """分词：拆分驼峰和下划线命名、统一小写、去掉英文复数；中文按单字和相邻两字切分"""
+    tokens = []
+    for word in _WORD_RE.findall(str(value)):
+        if '\u4e00' <= word[0] <= '\u9fff':
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+            continue
+        word = word.lower()
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+class BM25:
+    """最简单的BM25倒排索引，文档是分好词的token列表"""
+
+    def __init__(self, documents: Dict[str, List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_len = {doc_id: len(tokens) for doc_id, tokens in documents.items()}
+        self.avg_len = sum(self.doc_len.values()) / max(len(documents), 1)
+        self.postings = defaultdict(list)  # token -> [(文档id, 词频)]
+        for doc_id, tokens in documents.items():
+            for token, tf in Counter(tokens).items():
+                self.postings[token].append((doc_id, tf))
+        n = len(documents)
+        self.idf = {token: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for token, p in self.postings.items()}
+
+    def search(self, tokens: Iterable[str], top_k: int) -> List[tuple]:
+        """返回得分最高的 top_k 个 (文档id, 得分)，得分为0的不返回"""
+        scores = defaultdict(float)
+        for token in set(tokens):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for doc_id, tf in self.postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / self.avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+
+class TableRetriever:
+    """
+    表检索器：对表名、列名、注释和示例值建立BM25索引，为每个问题挑选最相关的 top_k 张表，
+    并且补上通过外键关联（最多两跳）的表，保证生成的SQL能够JOIN。
+    索引以 PRAGMA schema_version 为版本号，表结构变化时自动重建。
+    """
+
+    def __init__(self, engine: Engine, sample_values: int = 20):
+        self.engine = engine
+        self.sample_values = sample_values  # 每个文本列采样多少个不同的值放进索引
+        self.version = None
+        self.table_names: List[str] = []
+        self._index = None
+        self._foreign_keys: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def refresh(self) -> 'TableRetriever':
+        version = get_schema_version(self.engine)
+        if version != self.version:
+            with self._lock:
+                if version != self.version:
+                    self._build()
+                    self.version = version
+        return self
+
+    def _build(self):
+        start = time.perf_counter()
+        inspector = inspect(self.engine)
+        documents = {}
+        foreign_keys = defaultdict(set)
+        self.table_names = inspector.get_table_names()
+        with self.engine.connect() as conn:
+            for table in self.table_names:
+                tokens = tokenize(table) * 3  # 表名的权重最高
+                try:
+                    comment = inspector.get_table_comment(table).get('text')
+                except NotImplementedError:  # SQLite不支持表注释
+                    comment = None
+                if comment:
+                    tokens += tokenize(comment)
+                for column in inspector.get_columns(table):
+                    tokens += tokenize(column['name']) * 2
+                    if column.get('comment'):
+                        tokens += tokenize(column['comment'])
+                    type_name = str(column['type']).upper()
+                    if self.sample_values and ('CHAR' in type_name or 'TEXT' in type_name):
+                        rows = conn.execute(text(
+                            f'SELECT DISTINCT "{column["name"]}" FROM "{table}" '
+                            f'WHERE "{column["name"]}" IS NOT NULL LIMIT {self.sample_values}'))
+                        for (value,) in rows:
+                            tokens += tokenize(value)
+                for fk in inspector.get_foreign_keys(table):
+                    if fk.get('referred_table'):
+                        foreign_keys[table].add(fk['referred_table'])
+                        foreign_keys[fk['referred_table']].add(table)
+                documents[table] = tokens
+        self._index = BM25(documents)
+        self._foreign_keys = foreign_keys
+        log.info(f'表检索索引已重建，共{len(documents)}张表，耗时{(time.perf_counter() - start) * 1000:.0f}ms')
+
+    def search(self, question: str, top_k: int = 8, hops: int = 2) -> List[str]:
+        """返回与问题最相关的表名；一张都匹配不上时返回所有表"""
+        self.refresh()
+        start = time.perf_counter()
+        hits = [table for table, _ in self._index.search(tokenize(question), top_k)]
+        if not hits:
+            return list(self.table_names)
+        result = list(hits)
+        # 补充外键关联的表（最多 hops 跳，比如 员工 -> 客户 -> 发票），先补近的，总数不超过 2 * top_k
+        frontier = hits
+        for _ in range(hops):
+            next_frontier = []
+            for table in frontier:
+                for neighbor in sorted(self._foreign_keys.get(table, ())):
+                    if neighbor not in result and len(result) < 2 * top_k:
+                        result.append(neighbor)
+                        next_frontier.append(neighbor)
+            frontier = next_frontier
+        log.debug(f'表检索耗时{(time.perf_counter() - start) * 1000:.2f}ms: {question} -> {result}')
+        return result
@@ -0,0 +1,353 @@
+"""
+文本值的三元组（trigram）倒排索引：把数据库里文本列的不同取值按3个字符的片段建索引，
+value_lookup_tool 用它模糊查找问题里提到的实体（歌手名、国家等）在数据库里的准确写法，
+大模型不用猜 WHERE 条件里的字符串，减少因为写错字符串导致的空结果和重新生成。
+
+- 第一次查找时在后台线程扫描所有表建索引，建好之前查找返回None（百万行的表要十几秒）；
+  只收录不超过 max_length 个字符的值，长文本对匹配实体没有帮助；
+- 查找时用 Counter 统计每个值包含问题里的几个片段（太常见的片段跳过），
+  只对包含片段最多的一批候选精确计算相似度，百万行的表也能在几毫秒内返回；
+- 每次查找前检查 PRAGMA data_version，数据库被其他连接修改过时才更新：
+  表的行数增加的部分按 rowid 只读新增的行（在查找里同步完成）；行数减少（有删除）、表结构变化、
+  没有 rowid 的表马上在后台重建整个索引，建好之后替换，重建期间继续用旧的索引查找；
+  数据库变了而有的表行数没变（可能有原地UPDATE）时，距离上次建索引满 rebuild_seconds 就在后台重建（定时器触发，
+  不依赖后面的查找）。
+
+测试建索引和查找的耗时：
+    python -m mcp_server.value_index --db ../chinook.db "rolling stone" "brasil"
+"""
+import argparse
+import heapq
+import math
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from operator import itemgetter
+from typing import Dict, List, Optional, Set, Tuple
+
+from sql_graph.log_utils import log
+
+_TEXT_TYPES = ('CHAR', 'CLOB', 'TEXT')  # SQLite 的文本亲和类型
+
+
+def normalize_value(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    """前面补两个空格、后面补一个空格之后的所有3字符片段，一两个字符的值也能匹配"""
+    text = f'  {normalize_value(text)} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class _Table:
+    """一张表被索引时的状态"""
+
+    def __init__(self, name: str, columns: List[str], has_rowid: bool):
+        self.name = name
+        self.columns = columns
+        self.has_rowid = has_rowid
+        self.column_ids: List[int] = []
+        self.row_count = 0
+        self.max_rowid = 0
+
+
+class _Index:
+    """索引的数据，整个重建时新建一份再替换"""
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        self.data_version = None
+        self.built_at = time.monotonic()
+        self.tables: Dict[str, _Table] = {}
+        self.columns: List[Tuple[str, str]] = []  # 列的编号 -> (表名, 列名)
+        self.values: List[str] = []  # 值的编号 -> 原始的值
+        self.value_columns = array('i')  # 值的编号 -> 列的编号
+        self.counts = array('i')  # 值的编号 -> 出现的行数
+        self.sizes = array('i')  # 值的编号 -> 片段数
+        self.ids: List[Dict[str, int]] = []  # 列的编号 -> {值: 值的编号}
+        self.postings: Dict[str, array] = defaultdict(lambda: array('i'))  # 片段 -> 值的编号
+
+    def add(self, column_id: int, value, count: int = 1):
+        if not isinstance(value, str) or not value.strip() or len(value) > self.max_length:
+            return
+        ids = self.ids[column_id]
+        value_id = ids.get(value)
+        if value_id is not None:
+            self.counts[value_id] += count
+            return
+        value_id = ids[value] = len(self.values)
+        grams = trigrams(value)
+        self.values.append(value)
+        self.value_columns.append(column_id)
+        self.counts.append(count)
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings[gram].append(value_id)
+
+    def build(self, conn: sqlite3.Connection, tables: Dict[str, _Table]):
+        """在一个读事务里按列分组统计所有文本列，行数和最大rowid与索引的内容一致"""
+        conn.execute('BEGIN')
+        try:
+            for table in tables.values():
+                for column in table.columns:
+                    table.column_ids.append(len(self.columns))
+                    self.columns.append((table.name, column))
+                    self.ids.append({})
+                    for value, count in conn.execute(
+                            f'SELECT {_quote(column)}, COUNT(*) FROM {_quote(table.name)} '
+                            f'WHERE length({_quote(column)}) <= {int(self.max_length)} GROUP BY {_quote(column)}'):
+                        self.add(table.column_ids[-1], value, count)
+                table.row_count = conn.execute(f'SELECT COUNT(*) FROM {_quote(table.name)}').fetchone()[0]
+                if table.has_rowid:
+                    table.max_rowid = conn.execute(
+                        f'SELECT MAX(rowid) FROM {_quote(table.name)}').fetchone()[0] or 0
+                self.tables[table.name] = table
+        finally:
+            conn.execute('COMMIT')
+
+    def append_rows(self, conn: sqlite3.Connection, table: _Table, row_count: int):
+        """只索引 rowid 比上次大的新增行"""
+        columns = ', '.join(_quote(c) for c in table.columns)
+        max_rowid = table.max_rowid
+        for row in conn.execute(f'SELECT rowid, {columns} FROM {_quote(table.name)} WHERE rowid > ?',
+                                (table.max_rowid,)):
+            max_rowid = max(max_rowid, row[0])
+            for column_id, value in zip(table.column_ids, row[1:]):
+                self.add(column_id, value)
+        table.max_rowid = max_rowid
+        table.row_count = row_count
+
+
+def _scan_tables(conn: sqlite3.Connection) -> Dict[str, _Table]:
+    """有文本列的表"""
+    tables = {}
+    for name, sql in conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table' "
+                                  "AND name NOT LIKE 'sqlite_%' ORDER BY name"):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info({_quote(name)})')
+                   if any(t in (row[2] or '').upper() for t in _TEXT_TYPES)]
+        if columns:
+            tables[name] = _Table(name, columns, 'WITHOUT ROWID' not in ' '.join((sql or '').upper().split()))
+    return tables
+
+
+class ValueIndex:
+    """一个数据库（只读打开）的文本值索引，线程安全"""
+
+    def __init__(self, path: str, max_length: int = 100, rebuild_seconds: float = 60,
+                 max_posting: int = 5000, max_posting_ratio: float = 0.01, verify: int = 200):
+        self.path = path
+        self.max_length = max_length
+        self.rebuild_seconds = rebuild_seconds  # 因为原地修改而重建时，距离上次建索引至少间隔这么久
+        # 包含这个片段的值超过 max_posting 个并且超过所有值的 max_posting_ratio 时不统计（太常见，区分不了）
+        self.max_posting = max_posting
+        self.max_posting_ratio = max_posting_ratio
+        self.verify = verify  # 精确计算相似度的候选数
+        self._conn: Optional[sqlite3.Connection] = None
+        self._index: Optional[_Index] = None
+        self._building: Optional[threading.Thread] = None
+        self._pending = False  # 有没处理的原地修改，需要重建
+        self._timer: Optional[threading.Timer] = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        # data_version 只反映其他连接的修改，所以查找时一直用同一个连接（在锁里使用）
+        return sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+
+    def _build(self, data_version: int):
+        start = time.perf_counter()
+        conn = self._connect()
+        try:
+            index = _Index(self.max_length)
+            index.build(conn, _scan_tables(conn))
+            index.data_version = data_version  # 建索引之前读到的版本，期间的修改下次查找时再更新
+            log.info(f'建立文本值索引 {self.path}: {len(index.values)}个值，{len(index.postings)}个片段，'
+                     f'耗时{time.perf_counter() - start:.2f}秒')
+            with self._lock:
+                if not self._closed:
+                    self._index = index
+                    self.builds += 1
+        except Exception as e:
+            log.exception(f'建立文本值索引失败 {self.path}: {e}')
+        finally:
+            conn.close()
+            self._building = None
+
+    def _start_build(self, data_version: int):
+        """在后台线程重建整个索引，调用方需要持有锁"""
+        if self._building is None:
+            self._pending = False  # 重建读到的是开始之后的数据，之前记下的修改都会包含进去
+            self._building = threading.Thread(target=self._build, args=(data_version,), daemon=True,
+                                              name='value-index-build')
+            self._building.start()
+
+    def _pending_build(self):
+        """定时器到期：还有没处理的原地修改时开始重建"""
+        with self._lock:
+            self._timer = None
+            if self._pending and not self._closed and self._conn is not None:
+                self._start_build(self._conn.execute('PRAGMA data_version').fetchone()[0])
+
+    def _refresh(self):
+        """数据库有变化时更新索引，调用方需要持有锁"""
+        if self._conn is None:
+            self._conn = self._connect()
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        index = self._index
+        if index is None:
+            self._start_build(data_version)
+            return
+        if data_version == index.data_version or self._building is not None:
+            return
+        start = time.perf_counter()
+        added, rebuild, unchanged = 0, [], []
+        tables = _scan_tables(self._conn)
+        for name in set(index.tables) | set(tables):
+            old, new = index.tables.get(name), tables.get(name)
+            if old is None or new is None or old.columns != new.columns:
+                rebuild.append(name)  # 新建、删除的表，或者表结构变了
+                continue
+            row_count = self._conn.execute(f'SELECT COUNT(*) FROM {_quote(name)}').fetchone()[0]
+            if old.has_rowid and row_count > old.row_count:
+                added += row_count - old.row_count
+                index.append_rows(self._conn, old, row_count)
+            elif row_count != old.row_count:
+                rebuild.append(name)
+            else:
+                unchanged.append(name)  # 行数没变，可能有原地UPDATE
+        index.data_version = data_version
+        if rebuild:
+            self._start_build(data_version)
+        elif unchanged:
+            # 行数没变的表可能有原地修改（data_version 区分不了是哪张表变了）：记下来，
+            # 距离上次建索引满 rebuild_seconds 时在后台重建；一直有写入时最多每 rebuild_seconds 重建一次
+            self._pending = True
+            delay = index.built_at + self.rebuild_seconds - time.monotonic()
+            if delay <= 0:
+                self._start_build(data_version)
+            elif self._timer is None:
+                self._timer = threading.Timer(delay, self._pending_build)
+                self._timer.daemon = True
+                self._timer.start()
+        log.info(f'更新文本值索引 {self.path}: 新增{added}行，耗时{(time.perf_counter() - start) * 1000:.0f}ms'
+                 + (f'，后台重建（{", ".join(sorted(rebuild))}有变化）' if rebuild else '')
+                 + ('，可能有原地修改，等待重建' if self._pending else ''))
+
+    def lookup(self, text: str, table: str = '', column: str = '', limit: int = 10,
+               threshold: float = 0.5, wait: float = 0) -> Optional[List[dict]]:
+        """
+        查找和 text 相似的值，按相似度从高到低返回 {'table', 'column', 'value', 'rows', 'score'}；
+        相似度是 text 的片段在值里出现的比例，同分时和值的 Jaccard 相似度高的、出现行数多的排在前面。
+        索引还没有建好时最多等待 wait 秒（小数据库很快就能建好），还没建好返回None
+        """
+        if not normalize_value(text):
+            return []
+        query = trigrams(text)
+        with self._lock:
+            self._refresh()
+            index = self._index
+            building = self._building
+        if index is None:
+            if not wait or building is None:
+                return None
+            building.join(wait)
+            return self.lookup(text, table, column, limit, threshold)
+        with self._lock:
+            start = time.perf_counter()
+            table, column = table.strip('"`[] ').lower(), column.strip('"`[] ').lower()
+            allowed = None
+            if table or column:
+                allowed = {i for i, (t, c) in enumerate(index.columns)
+                           if (not table or t.lower() == table) and (not column or c.lower() == column)}
+            counts = Counter()
+            skipped = 0
+            max_posting = max(self.max_posting, int(len(index.values) * self.max_posting_ratio))
+            for gram in query:
+                posting = index.postings.get(gram)
+                if posting is None:
+                    continue
+                if len(posting) > max_posting:
+                    skipped += 1
+                    continue
+                counts.update(posting)
+            # 相似度不低于 threshold 的值至少包含 need 个片段，跳过的片段可能也包含在内
+            need = max(1, math.ceil(threshold * len(query)))
+            min_count = max(1, need - skipped)
+            candidates = [(value_id, n) for value_id, n in counts.items() if n >= min_count]
+            if allowed is not None:
+                candidates = [(value_id, n) for value_id, n in candidates if index.value_columns[value_id] in allowed]
+            candidates = heapq.nlargest(self.verify, candidates, key=itemgetter(1))
+            results = []
+            for value_id, n in candidates:
+                value = index.values[value_id]
+                shared = len(query & trigrams(value)) if skipped else n
+                if shared < need:
+                    continue
+                jaccard = shared / (len(query) + index.sizes[value_id] - shared)
+                value_table, value_column = index.columns[index.value_columns[value_id]]
+                results.append((shared / len(query), jaccard, index.counts[value_id],
+                                value_table, value_column, value))
+            results.sort(reverse=True)
+            elapsed = time.perf_counter() - start
+            self.lookups += 1
+            self.lookup_seconds += elapsed
+        log.debug(f'文本值查找 {text!r}: {len(counts)}个候选，耗时{elapsed * 1000:.2f}ms')
+        return [{'table': t, 'column': c, 'value': v, 'rows': n, 'score': round(score, 2)}
+                for score, _, n, t, c, v in results[:limit]]
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._index = None
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        index = self._index
+        return {
+            'values': len(index.values) if index else 0,
+            'trigrams': len(index.postings) if index else 0,
+            'building': self._building is not None,
+            'builds': self.builds,
+            'lookups': self.lookups,
+            'avg_lookup_ms': round(self.lookup_seconds / self.lookups * 1000, 3) if self.lookups else 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='建立文本值索引并测试模糊查找的耗时')
+    parser.add_argument('--db', required=True, help='数据库文件')
+    parser.add_argument('--limit', type=int, default=5, help='每次查找返回几个值')
+    parser.add_argument('texts', nargs='+', help='要查找的文字')
+    args = parser.parse_args()
+
+    index = ValueIndex(args.db)
+    start = time.perf_counter()
+    while index.lookup(args.texts[0]) is None:
+        time.sleep(0.1)
+    print(f'建索引: {time.perf_counter() - start:.2f}秒，{index.stats()}')
+    for text in args.texts:
+        start = time.perf_counter()
+        results = index.lookup(text, limit=args.limit)
+        print(f'{text!r}: {(time.perf_counter() - start) * 1000:.2f}ms')
+        for r in results:
+            print(f'    {r["table"]}.{r["column"]} = {r["value"]!r}（{r["rows"]}行，相似度{r["score"]}）')
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
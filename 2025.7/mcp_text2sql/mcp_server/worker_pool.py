@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from sql_graph.metrics import metrics_registry
+
+TOOL_WAIT_SECONDS = metrics_registry.histogram('mcp_tool_wait_seconds', 'MCP工具在线程池前排队等待的时间（秒）', ('tool',))
+TOOL_RUN_SECONDS = metrics_registry.histogram('mcp_tool_run_seconds', 'MCP工具在线程池中的执行时间（秒），db_query_tool即SQLite耗时',
+                                              ('tool', 'status'))
+
+
+class ToolExecutor:
+    """
+    MCP工具的工作线程池：FastMCP 会在事件循环里直接调用同步的工具函数，
+    一个慢查询就会卡住所有SSE连接。这里把阻塞的工作放到有上限的线程池中执行，
+    每个工具单独限制并发数，并且统计排队深度、执行中的数量和耗时。
+    """
+
+    def __init__(self, max_workers: int = 16, limits: Optional[Dict[str, int]] = None, default_limit: int = 4):
+        self.max_workers = max_workers
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mcp-tool')
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats = defaultdict(lambda: {
+            'waiting': 0, 'max_waiting': 0, 'in_flight': 0,
+            'completed': 0, 'failed': 0, 'wait_seconds': 0.0, 'run_seconds': 0.0,
+        })
+
+    def _semaphore(self, tool_name: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(tool_name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limits.get(tool_name, self.default_limit))
+            self._semaphores[tool_name] = semaphore
+        return semaphore
+
+    async def run(self, tool_name: str, fn: Callable, *args, **kwargs):
+        """在线程池中执行 fn，超过该工具的并发上限时排队等待"""
+        stats = self._stats[tool_name]
+        stats['waiting'] += 1
+        stats['max_waiting'] = max(stats['max_waiting'], stats['waiting'])
+        queued_at = time.perf_counter()
+        acquired = False
+        try:
+            async with self._semaphore(tool_name):
+                acquired = True
+                stats['waiting'] -= 1
+                stats['in_flight'] += 1
+                started_at = time.perf_counter()
+                stats['wait_seconds'] += started_at - queued_at
+                TOOL_WAIT_SECONDS.observe(started_at - queued_at, tool=tool_name)
+                status = 'error'
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._executor, functools.partial(fn, *args, **kwargs))
+                    status = 'ok'
+                except BaseException:
+                    stats['failed'] += 1
+                    raise
+                finally:
+                    stats['in_flight'] -= 1
+                    stats['run_seconds'] += time.perf_counter() - started_at
+                    TOOL_RUN_SECONDS.observe(time.perf_counter() - started_at, tool=tool_name, status=status)
+                stats['completed'] += 1
+                return result
+        finally:
+            if not acquired:  # 还在排队时就被取消了（比如客户端断开）
+                stats['waiting'] -= 1
+
+    def stats(self) -> dict:
+        result = {}
+        for tool_name, stats in self._stats.items():
+            done = stats['completed'] + stats['failed']
+            result[tool_name] = {
+                'limit': self.limits.get(tool_name, self.default_limit),
+                'waiting': stats['waiting'],
+                'max_waiting': stats['max_waiting'],
+                'in_flight': stats['in_flight'],
+                'completed': stats['completed'],
+                'failed': stats['failed'],
+                'avg_wait_ms': round(stats['wait_seconds'] / done * 1000, 2) if done else 0.0,
+                'avg_run_ms': round(stats['run_seconds'] / done * 1000, 2) if done else 0.0,
+            }
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
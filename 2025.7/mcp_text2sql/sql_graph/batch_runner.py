@@ -0,0 +1,194 @@
+"""
+批量执行问题集：从JSONL/CSV读取问题，用一个共享的MCP连接和同一个编译好的工作流并发执行，
+每完成一个问题就把结果和耗时追加写入输出的JSONL，进程中断后用同样的命令重新执行会跳过已经完成的问题。
+
+输入：
+    JSONL 每行一个对象 {"id": ..., "question": ...}；CSV 需要有 question 列，id 列可选。
+    没有 id 时使用行号（从1开始），所以续跑时输入文件的顺序不能变。
+输出（每行一个问题）：
+    {"id", "question", "answer", "sql", "sql_result", "error", "seconds", "llm_calls",
+     "prompt_tokens", "completion_tokens", "sql_calls", "sql_seconds", "finished_at"}
+
+用法（在 sql_graph 目录下执行，MCP服务需要先启动）：
+    python -m sql_graph.batch_runner questions.jsonl --output results.jsonl --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+from langchain_core.messages import AIMessage
+
+from sql_graph.bench_text2sql import RunRecorder
+from sql_graph.graph_manager import GraphManager
+from sql_graph.log_utils import log
+from sql_graph.message_utils import message_text
+from sql_graph.query_cache import query_cache
+from sql_graph.text2sql_graph import mcp_server_config, query_attempts
+
+
+def read_questions(path: str) -> Iterator[Tuple[str, str]]:
+    """逐行读取问题 (id, question)，不会一次性把整个文件读进内存"""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = ((n, row) for n, row in enumerate(csv.DictReader(f), 1))
+        else:
+            rows = ((n, json.loads(line)) for n, line in enumerate(f, 1) if line.strip())
+        for n, row in rows:
+            question = (row.get('question') or '').strip()
+            if not question:
+                log.warning(f'第{n}行没有问题，跳过')
+                continue
+            # id 可以是0，只有没有或者为空时才用行号
+            yield str(row['id'] if row.get('id') not in (None, '') else n), question
+
+
+def finished_ids(path: str, retry_errors: bool = False) -> Set[str]:
+    """已经写入输出文件的问题id；retry_errors 时出错的问题不算完成，续跑时会重新执行"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:  # 进程中断时最后一行可能没有写完整
+                continue
+            if retry_errors and record.get('error'):
+                done.discard(record['id'])
+            else:
+                done.add(record['id'])
+    return done
+
+
+def final_answer(state: Dict) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """从工作流的最终状态里取出 (回答, 最后执行的SQL, 最后一次执行结果的类型)"""
+    messages = state['messages']
+    answer = None
+    if isinstance(messages[-1], AIMessage) and not messages[-1].tool_calls:
+        answer = message_text(messages[-1])
+    attempts = query_attempts(messages)
+    if not attempts:
+        return answer, None, None
+    return answer, attempts[-1].sql, attempts[-1].kind
+
+
+class BatchRunner:
+    """固定数量的工作协程从问题迭代器里取问题执行，结果由调用方按完成顺序写出"""
+
+    def __init__(self, manager: GraphManager, concurrency: int = 4, timeout: float = 300, attempts: int = 2):
+        self.manager = manager
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.attempts = attempts
+
+    async def run_one(self, item_id: str, question: str) -> dict:
+        recorder = RunRecorder()
+        start = time.perf_counter()
+        answer = sql = sql_result = error = None
+        for attempt in range(self.attempts):
+            # 每个问题单独的会话；连接断开时 get_graph() 会重新连接
+            config = {'configurable': {'thread_id': f'batch-{item_id}-{attempt}'}, 'callbacks': [recorder]}
+            try:
+                graph = await self.manager.get_graph()
+                state = await asyncio.wait_for(
+                    graph.ainvoke({'messages': [{'role': 'user', 'content': question}]}, config), self.timeout)
+                answer, sql, sql_result = final_answer(state)
+                error = None if answer is not None else '工作流结束时没有给出回答'
+                break
+            except asyncio.TimeoutError:
+                error = f'超过{self.timeout}秒没有完成'
+                break  # 超时的问题重试一般也会超时
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                log.warning(f'问题 {item_id} 第{attempt + 1}次执行失败: {error}')
+        return {
+            'id': item_id,
+            'question': question,
+            'answer': answer,
+            'sql': sql,
+            'sql_result': sql_result,
+            'error': error,
+            'seconds': round(time.perf_counter() - start, 3),
+            'llm_calls': recorder.llm_calls,
+            'prompt_tokens': recorder.prompt_tokens,
+            'completion_tokens': recorder.completion_tokens,
+            'sql_calls': len(recorder.sql_seconds),
+            'sql_seconds': round(sum(recorder.sql_seconds), 3),
+            'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    async def run(self, items: Iterator[Tuple[str, str]], on_result):
+        """执行所有问题，每完成一个调用一次 on_result(结果)"""
+
+        async def worker():
+            for item_id, question in items:  # 多个协程共享同一个迭代器，按需读取输入
+                await on_result(await self.run_one(item_id, question))
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+
+
+async def run_batch(args) -> dict:
+    done = finished_ids(args.output, args.retry_errors)
+    if done:
+        log.info(f'输出文件里已经有{len(done)}个完成的问题，跳过这些问题继续执行')
+    seen = set()
+
+    def pending():
+        for item_id, question in read_questions(args.input):
+            if item_id in seen:
+                # 输入里重复的id也照常执行，输出里会有多条这个id的结果
+                log.warning(f'问题id {item_id} 重复出现，照常执行: {question}')
+            seen.add(item_id)
+            if item_id in done:
+                continue
+            yield item_id, question
+
+    # 和 bench_text2sql 一样默认关闭语义缓存：重复的问题直接命中缓存会让LLM调用次数和耗时失真
+    query_cache.enabled = args.query_cache
+    stats = {'finished': 0, 'errors': 0, 'skipped': len(done)}
+    start = time.perf_counter()
+    # 批量执行的问题互相独立，不需要保存会话的checkpoint
+    connection = {**mcp_server_config, 'url': args.mcp_url} if args.mcp_url else None
+    manager = GraphManager(connection=connection, checkpoint_db=None)
+    with open(args.output, 'a', encoding='utf-8') as out:
+        async def on_result(result: dict):
+            out.write(json.dumps(result, ensure_ascii=False) + '\n')
+            out.flush()  # 每个结果立即落盘，中断后可以从这里续跑
+            stats['finished'] += 1
+            if result['error']:
+                stats['errors'] += 1
+            if stats['finished'] % args.log_every == 0:
+                elapsed = time.perf_counter() - start
+                log.info(f'已完成{stats["finished"]}个问题，出错{stats["errors"]}个，'
+                         f'{stats["finished"] / elapsed:.2f} 个/秒')
+
+        try:
+            await BatchRunner(manager, args.concurrency, args.timeout).run(pending(), on_result)
+        finally:
+            await manager.aclose()
+    stats['seconds'] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量执行text2sql问题集，结果写入JSONL，中断后可以续跑')
+    parser.add_argument('input', help='问题文件：.jsonl 或者 .csv')
+    parser.add_argument('--output', required=True, help='结果追加写入的JSONL文件，也是续跑的进度记录')
+    parser.add_argument('--concurrency', type=int, default=4, help='同时执行的问题数')
+    parser.add_argument('--timeout', type=float, default=300, help='单个问题的超时时间（秒）')
+    parser.add_argument('--retry-errors', action='store_true', help='续跑时重新执行之前出错的问题')
+    parser.add_argument('--mcp-url', help='MCP服务的地址，默认使用 mcp_server_config')
+    parser.add_argument('--log-every', type=int, default=100, help='每完成多少个问题输出一次进度')
+    parser.add_argument('--query-cache', action='store_true', help='启用问题 -> SQL 的语义缓存')
+    args = parser.parse_args()
+
+    stats = asyncio.run(run_batch(args))
+    log.info(f'批量执行结束: {stats}')
+
+
+if __name__ == '__main__':
+    main()
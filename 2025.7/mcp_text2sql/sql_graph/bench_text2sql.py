@@ -0,0 +1,281 @@
+"""
+text2sql 工作流的离线压测：启动OpenAI兼容的桩服务（见 stub_llm_server）代替真实的大模型，
+在chinook数据库上并发执行一组问题，输出JSON格式的报告，方便做回归对比：
+端到端耗时的 p50/p95/p99、每个节点的耗时、大模型调用次数和token数、SQL工具的执行时间。
+
+用法（在 sql_graph 目录下执行，和其他模块使用同一个数据库）：
+    python -m sql_graph.bench_text2sql --repeat 5 --concurrency 4 --latency 0.3 --output bench.json
+默认在进程内直接调用MCP工具函数；传入 --mcp-url 时通过已经启动的MCP服务调用（包含传输的开销）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+from typing import List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+QUESTIONS = [
+    {'question': 'Which sales agent made the most in sales in 2009?',
+     'sql': ["SELECT e.FirstName, e.LastName, SUM(i.Total) AS total FROM Employee e "
+             "JOIN Customer c ON c.SupportRepId = e.EmployeeId JOIN Invoice i ON i.CustomerId = c.CustomerId "
+             "WHERE strftime('%Y', i.InvoiceDate) = '2009' GROUP BY e.EmployeeId ORDER BY total DESC LIMIT 1"]},
+    {'question': '每个国家的销售总额是多少？',
+     'sql': ["SELECT BillingCountry, SUM(Total) AS total FROM Invoice GROUP BY BillingCountry ORDER BY total DESC"]},
+    {'question': '曲目最多的5张专辑是哪些？',
+     'sql': ["SELECT a.Title, COUNT(t.TrackId) AS tracks FROM Album a JOIN Track t ON t.AlbumId = a.AlbumId "
+             "GROUP BY a.AlbumId ORDER BY tracks DESC LIMIT 5"]},
+    {'question': '哪位艺术家的专辑最多？',
+     'sql': ["SELECT ar.Name, COUNT(al.AlbumId) AS albums FROM Artist ar JOIN Album al ON al.ArtistId = ar.ArtistId "
+             "GROUP BY ar.ArtistId ORDER BY albums DESC LIMIT 1"]},
+    {'question': '消费金额最高的10位客户',
+     'sql': ["SELECT c.FirstName, c.LastName, SUM(i.Total) AS spent FROM Customer c "
+             "JOIN Invoice i ON i.CustomerId = c.CustomerId GROUP BY c.CustomerId ORDER BY spent DESC LIMIT 10"]},
+    {'question': '卖得最好的10首歌曲',
+     # 第一条SQL引用了不存在的列，用来覆盖 执行出错 -> 重新生成 的循环
+     'sql': ["SELECT t.Name, SUM(il.Qty) AS sold FROM Track t JOIN InvoiceLine il ON il.TrackId = t.TrackId "
+             "GROUP BY t.TrackId ORDER BY sold DESC LIMIT 10",
+             "SELECT t.Name, SUM(il.Quantity) AS sold FROM Track t JOIN InvoiceLine il ON il.TrackId = t.TrackId "
+             "GROUP BY t.TrackId ORDER BY sold DESC LIMIT 10"]},
+    {'question': '每年的发票数量和金额',
+     'sql': ["SELECT strftime('%Y', InvoiceDate) AS year, COUNT(*) AS invoices, SUM(Total) AS total "
+             "FROM Invoice GROUP BY year ORDER BY year"]},
+    {'question': '列出所有员工的姓名和职位',
+     'sql': ["SELECT FirstName, LastName, Title FROM Employee"]},
+]
+
+
+def load_questions(path: Optional[str] = None) -> List[dict]:
+    """读取问题集：[{"question": ..., "sql": [第一次生成的SQL, 出错后重试的SQL, ...]}]，不传时使用内置的问题集"""
+    if not path:
+        return QUESTIONS
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """线性插值的百分位数"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def summarize(values: List[float]) -> dict:
+    """耗时列表（秒）的统计，单位毫秒"""
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(max(values) * 1000, 2) if values else 0.0,
+    }
+
+
+class RunRecorder(BaseCallbackHandler):
+    """记录一次工作流执行中每个节点的耗时、大模型调用次数和token数、SQL工具的执行时间"""
+    run_inline = True
+
+    def __init__(self):
+        self._started = {}  # run_id -> (类别, 名字, 开始时间)
+        self.node_seconds = defaultdict(list)
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.sql_seconds = []
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        name = kwargs.get('name')
+        if not metadata or not name or metadata.get('langgraph_node') != name:  # 节点里的子调用
+            return
+        parent = self._started.get(parent_run_id)
+        if parent and parent[1] == name:  # 计时包装里调用的同名 ToolNode
+            return
+        self._started[run_id] = ('node', name, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.llm_calls += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                self.prompt_tokens += usage.get('input_tokens', 0)
+                self.completion_tokens += usage.get('output_tokens', 0)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = kwargs.get('name') or (serialized or {}).get('name')
+        if name == 'db_query_tool':
+            self._started[run_id] = ('sql', name, time.perf_counter())
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        kind, name, start = started
+        elapsed = time.perf_counter() - start
+        if kind == 'node':
+            self.node_seconds[name].append(elapsed)
+        else:
+            self.sql_seconds.append(elapsed)
+
+
+async def local_tools():
+    """进程内的MCP工具：直接调用 mcp_tools 里的工具函数，不经过MCP传输（描述和MCP服务上的一致）"""
+    from langchain_core.tools import StructuredTool
+    from mcp_server import mcp_tools
+
+    descriptions = {t.name: t.description for t in await mcp_tools.mcp_server.list_tools()}
+    return [StructuredTool.from_function(coroutine=fn, name=name, description=descriptions[name])
+            for name, fn in (('list_tables_tool', mcp_tools.list_tables_tool),
+                             ('db_query_tool', mcp_tools.db_query_tool))]
+
+
+async def run_one(graph, question: str) -> dict:
+    recorder = RunRecorder()
+    config = {'configurable': {'thread_id': f'bench-{uuid.uuid4().hex}'}, 'callbacks': [recorder]}
+    start = time.perf_counter()
+    error = None
+    try:
+        state = await graph.ainvoke({'messages': [{'role': 'user', 'content': question}]}, config)
+        if state['messages'][-1].tool_calls:
+            error = '工作流结束时没有给出回答'
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return {
+        'question': question,
+        'seconds': time.perf_counter() - start,
+        'error': error,
+        'llm_calls': recorder.llm_calls,
+        'prompt_tokens': recorder.prompt_tokens,
+        'completion_tokens': recorder.completion_tokens,
+        'sql_calls': len(recorder.sql_seconds),
+        'sql_seconds': sum(recorder.sql_seconds),
+        'node_seconds': {k: sum(v) for k, v in recorder.node_seconds.items()},
+        'node_calls': {k: len(v) for k, v in recorder.node_seconds.items()},
+    }
+
+
+async def run_benchmark(graph, questions: List[dict], repeat: int, concurrency: int) -> List[dict]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(question):
+        async with semaphore:
+            return await run_one(graph, question)
+
+    jobs = [q['question'] for _ in range(repeat) for q in questions]
+    return await asyncio.gather(*(limited(q) for q in jobs))
+
+
+def build_report(results: List[dict], wall_seconds: float, settings: dict) -> dict:
+    ok = [r for r in results if not r['error']]
+    nodes = defaultdict(list)
+    node_calls = defaultdict(int)
+    for r in results:
+        for name, seconds in r['node_seconds'].items():
+            nodes[name].append(seconds)
+            node_calls[name] += r['node_calls'][name]
+    llm_calls = sum(r['llm_calls'] for r in results)
+    return {
+        'settings': settings,
+        'runs': len(results),
+        'errors': len(results) - len(ok),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_qps': round(len(results) / wall_seconds, 3) if wall_seconds else 0.0,
+        'latency': summarize([r['seconds'] for r in ok]),
+        'nodes': {name: {**summarize(values), 'calls': node_calls[name],
+                         'total_seconds': round(sum(values), 3)} for name, values in sorted(nodes.items())},
+        'llm': {
+            'calls': llm_calls,
+            'calls_per_question': round(llm_calls / len(results), 3) if results else 0.0,
+            'prompt_tokens': sum(r['prompt_tokens'] for r in results),
+            'completion_tokens': sum(r['completion_tokens'] for r in results),
+        },
+        'sql': {
+            'calls': sum(r['sql_calls'] for r in results),
+            'total_seconds': round(sum(r['sql_seconds'] for r in results), 3),
+            'per_question': summarize([r['sql_seconds'] for r in results]),
+        },
+        'failures': [{'question': r['question'], 'error': r['error']} for r in results if r['error']][:20],
+    }
+
+
+async def main_async(args) -> dict:
+    # 大模型的地址要在导入工作流之前设置好（my_llm 在导入时创建客户端）
+    from sql_graph.stub_llm_server import ScriptedLLM, start_stub_server
+
+    questions = load_questions(args.questions)
+    stub = ScriptedLLM({q['question']: q['sql'] for q in questions}, args.latency, args.jitter,
+                       args.tokens_per_second)
+    server, base_url = start_stub_server(stub)
+    os.environ.update({'LLM_BASE_URL': base_url, 'LLM_MODEL': 'stub', 'LLM_API_KEY': 'stub'})
+
+    from sql_graph.graph_manager import GraphManager
+    from sql_graph.query_cache import query_cache
+    from sql_graph.text2sql_graph import build_graph, mcp_server_config
+
+    query_cache.enabled = args.query_cache
+    manager = None
+    try:
+        if args.mcp_url:
+            manager = GraphManager(connection={**mcp_server_config, 'url': args.mcp_url}, checkpoint_db=None)
+            graph = await manager.get_graph()
+        else:
+            graph = build_graph(await local_tools())
+        for q in questions[:args.warmup]:  # 预热：建立连接、加载表结构快照和表索引
+            await run_one(graph, q['question'])
+        start = time.perf_counter()
+        results = await run_benchmark(graph, questions, args.repeat, args.concurrency)
+        wall_seconds = time.perf_counter() - start
+    finally:
+        if manager is not None:
+            await manager.aclose()
+        server.shutdown()
+
+    settings = {k: v for k, v in vars(args).items() if k != 'output'}
+    return build_report(results, wall_seconds, settings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='text2sql工作流离线压测（使用大模型桩服务）')
+    parser.add_argument('--questions', help='问题集JSON文件，默认使用内置的chinook问题集')
+    parser.add_argument('--repeat', type=int, default=3, help='每个问题执行的次数')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=1, help='正式计时前预热执行的问题数')
+    parser.add_argument('--latency', type=float, default=0.3, help='桩服务每次请求的固定延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='桩服务延迟的随机抖动上限（秒）')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='模拟的输出速度，0表示不模拟')
+    parser.add_argument('--mcp-url', help='通过已启动的MCP服务调用工具，例如 http://localhost:8000/sse')
+    parser.add_argument('--query-cache', action='store_true', help='启用问题 -> SQL 的语义缓存')
+    parser.add_argument('--output', help='报告写入的JSON文件，默认输出到标准输出')
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
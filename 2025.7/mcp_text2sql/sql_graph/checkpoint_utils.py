@@ -0,0 +1,85 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from sql_graph.log_utils import log
+
+# 记录每个会话最后一次活动的时间，用来清理长时间没有使用的会话（checkpoints 表里没有时间列）
+_ACTIVITY_DDL = '''
+CREATE TABLE IF NOT EXISTS thread_activity (
+    thread_id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL
+)
+'''
+
+# 每个会话只保留最新的 keep_last 个checkpoint（checkpoint_id 按时间递增）
+_PRUNE_OLD_SQL = '''
+DELETE FROM checkpoints WHERE rowid IN (
+    SELECT rowid FROM (
+        SELECT rowid, ROW_NUMBER() OVER (
+            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rn
+        FROM checkpoints {where}
+    ) WHERE rn > ?
+)
+'''
+
+# checkpoint 删除之后，属于它的中间写入也没有用了
+_PRUNE_WRITES_SQL = '''
+DELETE FROM writes WHERE {where} NOT EXISTS (
+    SELECT 1 FROM checkpoints c
+    WHERE c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns
+      AND c.checkpoint_id = writes.checkpoint_id
+)
+'''
+
+
+@asynccontextmanager
+async def open_checkpointer(db_path: str):
+    """打开SQLite的checkpoint存储，必须在使用它的事件循环里打开和关闭"""
+    async with AsyncSqliteSaver.from_conn_string(db_path) as saver:
+        await saver.setup()
+        async with saver.lock:
+            await saver.conn.execute(_ACTIVITY_DDL)
+            await saver.conn.commit()
+        yield saver
+
+
+async def touch_thread(saver: AsyncSqliteSaver, thread_id: str):
+    """记录会话的最后活动时间"""
+    async with saver.lock:
+        await saver.conn.execute(
+            'INSERT INTO thread_activity (thread_id, updated_at) VALUES (?, ?) '
+            'ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at',
+            (thread_id, time.time()))
+        await saver.conn.commit()
+
+
+async def prune_checkpoints(saver: AsyncSqliteSaver, keep_last: int = 5, max_idle_days: Optional[float] = None,
+                            thread_id: Optional[str] = None) -> Tuple[int, int]:
+    """
+    压缩checkpoint：每个会话只保留最新的 keep_last 个，超过 max_idle_days 天没有活动的会话整个删除。
+    每个checkpoint保存的是完整的状态（消息列表），只有最新的那个用于继续对话，旧的只占空间。
+    传入 thread_id 时只处理这个会话。返回 (删除的checkpoint数, 删除的会话数)。
+    """
+    keep_last = max(1, keep_last)
+    where, params = ('WHERE thread_id = ?', (thread_id,)) if thread_id else ('', ())
+    deleted_threads = []
+    async with saver.lock:
+        conn = saver.conn
+        if max_idle_days is not None and thread_id is None:
+            cutoff = time.time() - max_idle_days * 86400
+            async with conn.execute('SELECT thread_id FROM thread_activity WHERE updated_at < ?', (cutoff,)) as cur:
+                deleted_threads = [row[0] for row in await cur.fetchall()]
+            for stale in deleted_threads:
+                await conn.execute('DELETE FROM checkpoints WHERE thread_id = ?', (stale,))
+                await conn.execute('DELETE FROM writes WHERE thread_id = ?', (stale,))
+                await conn.execute('DELETE FROM thread_activity WHERE thread_id = ?', (stale,))
+        cur = await conn.execute(_PRUNE_OLD_SQL.format(where=where), params + (keep_last,))
+        deleted = cur.rowcount
+        await conn.execute(_PRUNE_WRITES_SQL.format(where='thread_id = ? AND' if thread_id else ''), params)
+        await conn.commit()
+    if deleted or deleted_threads:
+        log.info(f'checkpoint压缩: 删除了{deleted}个旧checkpoint，{len(deleted_threads)}个不活跃的会话')
+    return deleted, len(deleted_threads)
@@ -0,0 +1,169 @@
+import json
+import re
+import threading
+from typing import List, Sequence
+
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, ToolMessage
+
+from sql_graph.env_utils import CONTEXT_TOKEN_BUDGET
+from sql_graph.log_utils import log
+from sql_graph.message_utils import message_text
+from sql_graph.metrics import metrics_registry
+
+CONTEXT_TOKENS = metrics_registry.counter('text2sql_context_tokens_total',
+                                          '生成SQL时发给大模型的消息token数（估算），before：压缩前，after：压缩后',
+                                          ('stage',))
+CONTEXT_COMPACTIONS = metrics_registry.counter('text2sql_context_compactions_total', '上下文压缩的调用次数')
+
+_CJK_RE = re.compile(r'[　-〿一-鿿＀-￯]')
+# 只保留最新一份结果的工具：旧的表清单、表结构对现在的问题没有帮助
+_LATEST_ONLY_TOOLS = ('sql_db_schema', 'list_tables_tool')
+_MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符等固定开销
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中文按每个字1个token，其他字符按每4个字符1个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: AnyMessage) -> int:
+    tokens = estimate_tokens(message_text(message)) + _MESSAGE_OVERHEAD
+    for tool_call in getattr(message, 'tool_calls', None) or []:
+        tokens += estimate_tokens(json.dumps(tool_call['args'], ensure_ascii=False)) + _MESSAGE_OVERHEAD
+    return tokens
+
+
+def summarize_result(content: str, keep_rows: int = 3) -> str:
+    """把db_query_tool的CSV结果缩短成 表头 + 前几行 + 结尾的行数说明，错误信息只保留开头"""
+    stripped = content.strip()
+    if stripped.startswith('错误') or stripped.startswith('Error'):
+        return stripped[:300]
+    lines = stripped.splitlines()
+    footer = [line for line in lines if line.startswith('-- ')]
+    rows = [line for line in lines if not line.startswith('-- ')]
+    if len(rows) <= keep_rows + 1:
+        return stripped
+    omitted = len(rows) - keep_rows - 1
+    return '\n'.join(rows[:keep_rows + 1] + [f'-- （旧的查询结果，省略了{omitted}行）'] + footer)
+
+
+def _replace_content(message: ToolMessage, content: str) -> ToolMessage:
+    return message.model_copy(update={'content': content})
+
+
+class ContextCompactor:
+    """
+    生成SQL之前压缩要发给大模型的消息（只影响这一次调用，工作流状态里的消息保持完整）：
+
+    1. 表清单和表结构只保留最新的一份，旧的替换成一句说明；
+    2. 除了最后一条以外的查询结果缩短成 表头 + 前几行 + 行数；
+    3. 还超过 budget 时，从最早的一轮对话开始整轮删除（当前这一轮和最新的表结构不删）；
+    4. 还超过时，缩短最后一条查询结果。
+    替换内容时保留 tool_call_id，删除时整轮删除，工具调用和工具结果始终成对出现；
+    执行被取消或出错时留在历史里、没有结果的工具调用也会去掉。
+    """
+
+    def __init__(self, budget: int = 8000, keep_rows: int = 3):
+        self.budget = budget
+        self.keep_rows = keep_rows
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def _shrink_stale_results(self, messages: List[AnyMessage]) -> List[AnyMessage]:
+        latest = {}  # 工具名 -> 最新一条结果的位置
+        for i, message in enumerate(messages):
+            if isinstance(message, ToolMessage):
+                latest[message.name] = i
+        result = []
+        for i, message in enumerate(messages):
+            if isinstance(message, ToolMessage) and i != latest[message.name]:
+                if message.name in _LATEST_ONLY_TOOLS:
+                    message = _replace_content(message, '（已省略，以后面最新的结果为准）')
+                elif message.name == 'db_query_tool':
+                    message = _replace_content(message, summarize_result(message_text(message), self.keep_rows))
+            result.append(message)
+        return result
+
+    @staticmethod
+    def _drop_unpaired(messages: List[AnyMessage]) -> List[AnyMessage]:
+        """去掉没有结果的工具调用，以及找不到对应调用的工具结果"""
+        answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+        messages = [m for m in messages if not (isinstance(m, AIMessage) and m.tool_calls
+                                                and any(c['id'] not in answered for c in m.tool_calls))]
+        called = {c['id'] for m in messages if isinstance(m, AIMessage) for c in m.tool_calls}
+        return [m for m in messages if not isinstance(m, ToolMessage) or m.tool_call_id in called]
+
+    @staticmethod
+    def _drop_oldest_turn(messages: List[AnyMessage]) -> List[AnyMessage]:
+        """删掉最早的一轮对话（一个用户问题到下一个用户问题之前的所有消息），只剩一轮时不删"""
+        starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if len(starts) < 2:
+            return messages
+        # 最新的表结构可能是前几轮获取的（表没有变化时后面的轮次直接复用），删除时保留下来
+        pinned = next((m.tool_call_id for m in reversed(messages)
+                       if isinstance(m, ToolMessage) and m.name == 'sql_db_schema'), None)
+        kept = [m for m in messages[starts[0]:starts[1]]
+                if (isinstance(m, ToolMessage) and m.tool_call_id == pinned)
+                or (isinstance(m, AIMessage) and m.tool_calls and all(c['id'] == pinned for c in m.tool_calls))]
+        return messages[:starts[0]] + kept + messages[starts[1]:]
+
+    def _truncate_last_result(self, messages: List[AnyMessage], overflow: int) -> List[AnyMessage]:
+        for i in range(len(messages) - 1, -1, -1):
+            message = messages[i]
+            if isinstance(message, ToolMessage) and message.name == 'db_query_tool':
+                content = message_text(message)
+                keep = max(200, len(content) - overflow * 4 - 100)  # 多留一点给结尾的说明
+                if keep < len(content):
+                    content = content[:keep].rsplit('\n', 1)[0] + '\n-- （结果太长，后面的行已省略）'
+                    return messages[:i] + [_replace_content(message, content)] + messages[i + 1:]
+                break
+        return messages
+
+    def compact(self, messages: Sequence[AnyMessage], reserved: int = 0) -> List[AnyMessage]:
+        """返回压缩后的消息列表，reserved 是系统提示词等额外内容占用的token数"""
+        budget = self.budget - reserved
+        before = sum(message_tokens(m) for m in messages)
+        result = self._shrink_stale_results(self._drop_unpaired(list(messages)))
+        total = sum(message_tokens(m) for m in result)
+        while total > budget:
+            shorter = self._drop_oldest_turn(result)
+            if len(shorter) == len(result):
+                break
+            result = shorter
+            total = sum(message_tokens(m) for m in result)
+        if total > budget:
+            result = self._truncate_last_result(result, total - budget)
+            total = sum(message_tokens(m) for m in result)
+        if total > budget:
+            log.warning(f'压缩后的上下文仍然超过预算: {total + reserved} > {self.budget} tokens')
+
+        with self._lock:
+            self.calls += 1
+            self.tokens_before += before
+            self.tokens_after += total
+        CONTEXT_COMPACTIONS.inc()
+        CONTEXT_TOKENS.inc(before, stage='before')
+        CONTEXT_TOKENS.inc(total, stage='after')
+        if before > total:
+            log.info(f'上下文压缩: {before} -> {total} tokens，节省{before - total}，消息 {len(messages)} -> {len(result)}')
+        return result
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'budget': self.budget,
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'tokens_saved': self.tokens_before - self.tokens_after,
+        }
+
+
+# 生成SQL时共享的上下文压缩器
+context_compactor = ContextCompactor(CONTEXT_TOKEN_BUDGET)
+metrics_registry.gauge('text2sql_context_tokens_saved', '上下文压缩累计节省的token数（估算，进程启动以来）',
+                       lambda: context_compactor.stats()['tokens_saved'])
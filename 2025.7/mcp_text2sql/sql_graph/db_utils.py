@@ -0,0 +1,8 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+
+def get_schema_version(engine: Engine) -> int:
+    """读取SQLite的 PRAGMA schema_version：任何建表、删表、改表操作都会让它加1"""
+    with engine.connect() as conn:
+        return conn.execute(text('PRAGMA schema_version')).scalar()
@@ -7,3 +7,63 @@ load_dotenv(override=True)
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
 ZHIPU_API_KEY = os.getenv('ZHIPU_API_KEY')
+
+# 覆盖默认大模型服务的地址、模型名和密钥（比如指向本地的OpenAI兼容服务或者压测用的桩服务），为空时使用智谱AI
+LLM_BASE_URL = os.getenv('LLM_BASE_URL')
+LLM_MODEL = os.getenv('LLM_MODEL')
+LLM_API_KEY = os.getenv('LLM_API_KEY')
+
+# 查询代价守卫：单表全表扫描的行数上限、多表嵌套循环的行数上限、单条SQL的最长执行时间（秒）
+QUERY_MAX_SCAN_ROWS = int(os.getenv('QUERY_MAX_SCAN_ROWS', 5_000_000))
+QUERY_MAX_JOIN_ROWS = int(os.getenv('QUERY_MAX_JOIN_ROWS', 50_000_000))
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', 10))
+
+# 工作流连接MCP服务使用的传输方式（sse 或者 streamable_http）和地址
+MCP_TRANSPORT = os.getenv('MCP_TRANSPORT', 'sse')
+MCP_SERVER_URL = os.getenv('MCP_SERVER_URL', 'http://localhost:8000/mcp' if MCP_TRANSPORT == 'streamable_http'
+                           else 'http://localhost:8000/sse')
+
+# 表的数量超过这个值（大的数据库）时，list_tables_tool 才按问题检索相关的表，否则返回所有表
+TABLE_RETRIEVAL_MIN_TABLES = int(os.getenv('TABLE_RETRIEVAL_MIN_TABLES', 30))
+
+# MCP服务允许的 Host 头（逗号分隔，例如 mcp.example.com:*,10.0.0.5:8000），用于 DNS rebinding 保护；
+# 为空时只允许 localhost，* 表示关闭保护（由网络和网关负责访问控制）
+MCP_ALLOWED_HOSTS = os.getenv('MCP_ALLOWED_HOSTS', '')
+
+# MCP服务可以查询的数据库：名字=路径，逗号分隔；不在列表里的名字到 MCP_DATABASE_DIR 目录下找 <名字>.db
+MCP_DATABASES = os.getenv('MCP_DATABASES', 'chinook=../chinook.db')
+MCP_DATABASE_DIR = os.getenv('MCP_DATABASE_DIR', '')
+# 工具调用不指定数据库时使用的数据库
+MCP_DEFAULT_DATABASE = os.getenv('MCP_DEFAULT_DATABASE', 'chinook')
+# 同时打开的数据库数量上限（按LRU关闭），空闲多少秒后关闭，每个数据库的连接数（同时执行的查询数）上限
+MCP_DB_MAX_OPEN = int(os.getenv('MCP_DB_MAX_OPEN', 16))
+MCP_DB_IDLE_SECONDS = float(os.getenv('MCP_DB_IDLE_SECONDS', 600))
+MCP_DB_CONNECTIONS = int(os.getenv('MCP_DB_CONNECTIONS', 4))
+# 单独设置某些数据库的连接数上限：名字=数量，逗号分隔，比如 chinook=8；默认都用 MCP_DB_CONNECTIONS
+MCP_DB_CONNECTION_LIMITS = os.getenv('MCP_DB_CONNECTION_LIMITS', '')
+
+# my_search_tool 的搜索结果缓存：有效期（秒）和最多缓存的条数
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', 600))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', 1000))
+
+# 并发生成候选SQL的数量（1表示关闭），采样温度，第一条有效SQL返回后等待其他候选的秒数
+SQL_CANDIDATES = int(os.getenv('SQL_CANDIDATES', 1))
+SQL_CANDIDATE_TEMPERATURE = float(os.getenv('SQL_CANDIDATE_TEMPERATURE', 0.7))
+SQL_CANDIDATE_GRACE = float(os.getenv('SQL_CANDIDATE_GRACE', 0.3))
+
+# 每个问题最多允许SQL执行失败（或结果为空）后重新生成的次数，超过后直接结束
+MAX_SQL_RETRIES = int(os.getenv('MAX_SQL_RETRIES', 3))
+
+# 每个问题最多调用几次探查数据的工具（column_stats_tool 等），用完后只能写SQL或者直接回答
+MAX_EXPLORE_CALLS = int(os.getenv('MAX_EXPLORE_CALLS', 3))
+
+# 每次调用大模型生成SQL时，消息（含系统提示词）的token预算，超出时压缩旧的工具结果和历史对话
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', 8000))
+
+# 多轮对话的checkpoint存储（SQLite文件），每个会话保留的checkpoint数量，不活跃会话的保留天数
+CHECKPOINT_DB = os.getenv('CHECKPOINT_DB', '../checkpoints.sqlite')
+CHECKPOINT_KEEP_LAST = int(os.getenv('CHECKPOINT_KEEP_LAST', 5))
+CHECKPOINT_MAX_IDLE_DAYS = float(os.getenv('CHECKPOINT_MAX_IDLE_DAYS', 7))
+
+# Gradio应用暴露 /metrics 指标接口的端口，0表示不启动（MCP服务的指标在它自己端口的 /metrics 上）
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
@@ -1,35 +1,76 @@
+"""
+命令行里和工作流对话。对话保存在 CHECKPOINT_DB 里，用同一个 --thread-id 再次启动时在之前的对话上继续，
+上一次没有执行完（比如中途退出或者连接断开）的问题会先接着执行完：
+    python -m sql_graph.execute_graph --thread-id cli-demo
+"""
+import argparse
 import asyncio
+import uuid
 
 from sql_graph.draw_png import draw_graph
-from sql_graph.text2sql_graph import make_graph
+from sql_graph.graph_manager import GraphManager
+from sql_graph.log_utils import log
+from sql_graph.text2sql_graph import last_question
 
 
-async def execute_graph():
+async def run_turn(manager: GraphManager, config: dict, user_input: str = None):
+    """执行一轮对话并打印每一步的最新消息；user_input 为空时从保存的状态继续执行。MCP连接异常时重连一次再执行"""
+    for attempt in range(2):
+        graph = None
+        try:
+            graph = await manager.get_graph()
+            inputs = {"messages": [{"role": "user", "content": user_input}]} if user_input else None
+            if attempt and user_input:
+                snapshot = await graph.aget_state(config)
+                if snapshot.next and last_question(snapshot.values.get('messages', [])) == user_input:
+                    inputs = None  # 问题已经保存在状态里，从出错的节点继续执行
+            async for event in graph.astream(inputs, config, stream_mode="values"):
+                event["messages"][-1].pretty_print()
+            await manager.finish_turn(config["configurable"]["thread_id"])
+            return
+        except Exception as e:
+            log.exception(e)
+            if attempt == 0 and manager.is_session_error(e):
+                await manager.reset(graph)
+                continue
+            print(f'执行出错: {e}')
+            return
+
+
+async def execute_graph(thread_id: str, draw: bool = True):
     """执行该 工作流"""
-    async with make_graph() as graph:
-        draw_graph(graph, 'text2sql.png')
+    manager = GraphManager()
+    config = {"configurable": {"thread_id": thread_id}}
+    try:
+        graph = await manager.get_graph()
+        if draw:
+            draw_graph(graph, 'text2sql.png')
+        print(f'会话: {thread_id}（用 --thread-id {thread_id} 启动可以继续这个会话）')
+        snapshot = await graph.aget_state(config)
+        messages = snapshot.values.get('messages', []) if snapshot.values else []
+        if messages:
+            print(f'继续之前的会话，已有{len(messages)}条消息，上一个问题: {last_question(messages)}')
+        if snapshot.next:
+            print('上一个问题没有执行完，继续执行')
+            await run_turn(manager, config)
         while True:
             user_input = input("用户：")
             if user_input.lower() in ['q', 'exit', 'quit']:
                 print('对话结束，拜拜！')
                 break
-            else:
-                async for event in graph.astream({"messages": [{"role": "user", "content": user_input}]},
-                                                 stream_mode="values"):
-                    event["messages"][-1].pretty_print()
+            if user_input.strip():
+                await run_turn(manager, config, user_input)
+    finally:
+        await manager.aclose()
 
 
-if __name__ == '__main__':
-    # db = SQLDatabase.from_uri('sqlite:///../chinook.db')
-    # toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-    #
-    # tools = toolkit.get_tools()
-    # for tool in tools:
-    #     print('工具名字: ', tool.name, '工具描述: ', tool.description)
-    #
-    # list_tables_tool = next(tool for tool in tools if tool.name == 'sql_db_list_tables')
-    #
-    # resp = list_tables_tool.invoke("")
-    # print(resp)
-    asyncio.run(execute_graph())
+def main():
+    parser = argparse.ArgumentParser(description='命令行里和text2sql工作流对话')
+    parser.add_argument('--thread-id', default=None, help='会话id，使用之前的会话id时在之前的对话上继续，默认新建一个会话')
+    parser.add_argument('--no-draw', action='store_true', help='不输出工作流的结构图')
+    args = parser.parse_args()
+    asyncio.run(execute_graph(args.thread_id or f'cli-{uuid.uuid4().hex[:8]}', not args.no_draw))
 
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Optional
+
+import anyio
+import httpx
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+from mcp.shared.exceptions import McpError
+
+from sql_graph.checkpoint_utils import open_checkpointer, prune_checkpoints, touch_thread
+from sql_graph.env_utils import CHECKPOINT_DB, CHECKPOINT_KEEP_LAST, CHECKPOINT_MAX_IDLE_DAYS
+from sql_graph.log_utils import log
+from sql_graph.text2sql_graph import build_graph, mcp_server_config
+
+# MCP连接或会话出问题时的异常，只有这些才需要重建共享的连接；大模型接口报错、递归次数超限等直接告诉用户
+SESSION_ERRORS = (McpError, anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream,
+                  httpx.TransportError)
+
+
+class GraphManager:
+    """
+    常驻的工作流管理器：整个进程只建立一次MCP长连接、只编译一次工作流，所有会话共享。
+
+    MCP的SSE会话基于anyio的任务组，必须在同一个任务里进入和退出，
+    所以连接由一个后台任务持有：建立连接 -> 编译工作流 -> 等待关闭信号 -> 断开连接。
+    连接断开（后台任务结束）后，下一次 get_graph() 会自动重连。
+
+    checkpoint_db 不为空时，工作流带SQLite的checkpointer编译，调用时传入
+    {"configurable": {"thread_id": ...}}，同一个会话的后续问题在之前的状态上继续。
+    """
+
+    def __init__(self, server_name: str = 'lx_mcp', connection: Optional[dict] = None,
+                 checkpoint_db: Optional[str] = CHECKPOINT_DB):
+        self.server_name = server_name
+        self.connection = connection or mcp_server_config
+        self.checkpoint_db = checkpoint_db
+        self._graph = None
+        self._checkpointer = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._error: Optional[BaseException] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def is_alive(self) -> bool:
+        return self._graph is not None and self._task is not None and not self._task.done()
+
+    async def get_graph(self):
+        """获取共享的工作流，第一次调用（或者连接断开之后）会建立连接"""
+        if self.is_alive:
+            return self._graph
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_alive:
+                await self._start()
+        return self._graph
+
+    async def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error = None
+        self._task = asyncio.create_task(self._run(self._ready, self._stop), name='mcp-graph-session')
+        await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    async def _run(self, ready: asyncio.Event, stop: asyncio.Event):
+        """后台任务：持有MCP会话直到收到关闭信号或者连接异常"""
+        client = MultiServerMCPClient({self.server_name: self.connection})
+        try:
+            async with client.session(self.server_name) as session, AsyncExitStack() as stack:
+                tools = await load_mcp_tools(session)
+                if self.checkpoint_db:
+                    self._checkpointer = await stack.enter_async_context(open_checkpointer(self.checkpoint_db))
+                    await prune_checkpoints(self._checkpointer, CHECKPOINT_KEEP_LAST, CHECKPOINT_MAX_IDLE_DAYS)
+                self._graph = build_graph(tools, self._checkpointer)
+                log.info(f'MCP会话已建立，加载了{len(tools)}个工具，工作流编译完成')
+                ready.set()
+                await stop.wait()
+        except Exception as e:
+            log.exception(e)
+            self._error = e
+        finally:
+            self._graph = None
+            self._checkpointer = None
+            ready.set()
+            log.info('MCP会话已关闭')
+
+    def is_session_error(self, error: BaseException) -> bool:
+        """执行出错是不是因为MCP连接或会话断开（包括任务组抛出的异常组里的异常）"""
+        if isinstance(error, BaseExceptionGroup):
+            return any(self.is_session_error(e) for e in error.exceptions)
+        return isinstance(error, SESSION_ERRORS) or (self._task is not None and self._task.done())
+
+    async def finish_turn(self, thread_id: str):
+        """一轮对话结束后调用：记录会话的活动时间，只保留这个会话最新的几个checkpoint"""
+        checkpointer = self._checkpointer
+        if checkpointer is None:
+            return
+        try:
+            await touch_thread(checkpointer, thread_id)
+            await prune_checkpoints(checkpointer, CHECKPOINT_KEEP_LAST, thread_id=thread_id)
+        except Exception as e:
+            log.warning(f'压缩会话 {thread_id} 的checkpoint失败: {e}')
+
+    async def reset(self, graph=None):
+        """关闭当前连接，下一次 get_graph() 会重新连接（用于执行失败后的重连）。
+        传入出错时使用的 graph 时，如果连接已经被其他会话重建过就不再关闭"""
+        task, stop = self._task, self._stop
+        if task is None or (graph is not None and graph is not self._graph):
+            return
+        stop.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=10)
+        except Exception as e:
+            log.warning(f'关闭MCP会话时出现异常: {e}')
+            task.cancel()
+        finally:
+            if self._task is task:
+                self._task = None
+                self._graph = None
+
+    async def aclose(self):
+        """应用关闭时调用，断开MCP连接"""
+        await self.reset()
+
+    def close(self, timeout: float = 10):
+        """给其他线程（比如Gradio主线程退出时）调用的同步关闭方法"""
+        loop = self._loop
+        if self._task is None or loop is None or loop.is_closed():
+            return
+        if loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self.aclose(), loop)
+            try:
+                future.result(timeout)
+            except Exception as e:
+                log.warning(f'关闭MCP会话超时或失败: {e}')
+        else:
+            loop.run_until_complete(self.aclose())
+
+
+# 进程内共享的工作流管理器
+graph_manager = GraphManager()
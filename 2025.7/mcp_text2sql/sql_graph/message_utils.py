@@ -0,0 +1,15 @@
+from langchain_core.messages import BaseMessage
+
+
+def message_text(message: BaseMessage) -> str:
+    """取出消息的纯文本内容（MCP工具返回的ToolMessage内容是内容块列表，而不是字符串）"""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    parts = []
+    for block in content:
+        if isinstance(block, str):
+            parts.append(block)
+        elif isinstance(block, dict) and block.get('type') == 'text':
+            parts.append(block.get('text', ''))
+    return ''.join(parts)
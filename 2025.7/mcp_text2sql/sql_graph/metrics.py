@@ -0,0 +1,159 @@
+"""
+进程内的指标：直方图、计数器和抓取时取值的仪表（gauge），按 Prometheus 文本格式输出，可以用 start_metrics_server 暴露给抓取。
+不依赖 prometheus_client；标签只用取值有限的维度（节点名、状态等），会话id这类只写到日志的span里。
+"""
+import bisect
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from sql_graph.log_utils import log
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labels)
+        with self._lock:
+            self._values[key] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_text(self.labels, key)} {value}')
+        return lines
+
+
+class Gauge:
+    """抓取时调用 function 取当前值（比如缓存的命中率、条数），不用在每次变化时更新"""
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        try:
+            lines.append(f'{self.name} {float(self.function())}')
+        except Exception as e:
+            log.warning(f'读取指标 {self.name} 失败: {e}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # 标签 -> [每个桶的数量..., 总和, 总数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, '')) for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{_label_text(self.labels, key, le)} {cumulative}')
+                le = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{_label_text(self.labels, key, le)} {series[-1]}')
+                lines.append(f'{self.name}_sum{_label_text(self.labels, key)} {series[-2]}')
+                lines.append(f'{self.name}_count{_label_text(self.labels, key)} {series[-1]}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, function: Callable[[], float]) -> Gauge:
+        return self._register(Gauge(name, documentation, function))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(port: int, registry: 'MetricsRegistry' = None, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """在后台线程启动 /metrics 接口"""
+    registry = registry or metrics_registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # 不输出每次抓取的访问日志
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    log.info(f'指标接口已启动: http://{host}:{server.server_address[1]}/metrics')
+    return server
+
+
+# 进程内共享的指标
+metrics_registry = MetricsRegistry()
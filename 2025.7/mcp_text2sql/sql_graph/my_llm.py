@@ -1,17 +1,17 @@
 from langchain_openai import ChatOpenAI
 from zhipuai import ZhipuAI
 
-from sql_graph.env_utils import ZHIPU_API_KEY, OPENAI_API_KEY, DEEPSEEK_API_KEY
+from sql_graph.env_utils import ZHIPU_API_KEY, OPENAI_API_KEY, DEEPSEEK_API_KEY, LLM_BASE_URL, LLM_MODEL, LLM_API_KEY
 
 zhipuai_client = ZhipuAI(api_key=ZHIPU_API_KEY)  # 填写您自己的APIKey
 
 #
 # ✅ 当前激活：智谱AI GLM-4配置
-llm = ChatOpenAI(  # zhipuai的
+llm = ChatOpenAI(  # zhipuai的（可以用 LLM_BASE_URL / LLM_MODEL / LLM_API_KEY 环境变量覆盖）
     temperature=0,
-    model='glm-4-air-250414',
-    api_key=ZHIPU_API_KEY,
-    base_url="https://open.bigmodel.cn/api/paas/v4/")
+    model=LLM_MODEL or 'glm-4-air-250414',
+    api_key=LLM_API_KEY or ZHIPU_API_KEY,
+    base_url=LLM_BASE_URL or "https://open.bigmodel.cn/api/paas/v4/")
 
 
 # llm = ChatOpenAI(  # openai的
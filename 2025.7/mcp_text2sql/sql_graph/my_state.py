@@ -1,8 +1,11 @@
-from typing import TypedDict, Annotated
+from typing import TypedDict, Annotated, Optional
 
 from langchain_core.messages import AnyMessage
 from langgraph.graph import add_messages
 
 
 class SQLState(TypedDict):
-    messages: Annotated[list[AnyMessage], add_messages]
\ No newline at end of file
+    messages: Annotated[list[AnyMessage], add_messages]
+    # 最新一次获取的表结构对应的 schema_version 和表名，多轮对话中表结构没变时直接复用
+    schema_version: Optional[int]
+    schema_tables: list[str]
@@ -0,0 +1,82 @@
+import asyncio
+import inspect
+import time
+from typing import Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import run_in_executor
+
+from sql_graph.log_utils import log
+from sql_graph.metrics import metrics_registry
+
+NODE_SECONDS = metrics_registry.histogram('text2sql_node_seconds', '工作流每个节点的执行耗时（秒）', ('node', 'status'))
+NODE_TOKENS = metrics_registry.counter('text2sql_node_tokens_total', '工作流节点调用大模型使用的token数', ('node', 'type'))
+NODE_ITERATION = metrics_registry.histogram('text2sql_node_iteration', '节点执行时处于本轮问题的第几次 生成SQL->执行 循环',
+                                            ('node',), buckets=(1, 2, 3, 4, 5, 8))
+
+
+def loop_iteration(messages) -> int:
+    """本轮问题中第几次循环：已经执行过的SQL次数 + 1"""
+    executed = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage) and message.name == 'db_query_tool':
+            executed += 1
+    return executed + 1
+
+
+def token_usage(update) -> Tuple[int, int]:
+    """节点输出的AI消息里的token用量 (输入, 输出)"""
+    prompt_tokens = completion_tokens = 0
+    if not isinstance(update, dict):
+        return prompt_tokens, completion_tokens
+    for message in update.get('messages', []):
+        if isinstance(message, AIMessage) and message.usage_metadata:
+            prompt_tokens += message.usage_metadata.get('input_tokens', 0)
+            completion_tokens += message.usage_metadata.get('output_tokens', 0)
+    return prompt_tokens, completion_tokens
+
+
+def traced_node(name: str, node):
+    """
+    给工作流节点加上计时：每次执行输出一条span日志（会话id、第几次循环、耗时、token用量），
+    并且记录到节点耗时的直方图。node 可以是同步函数、异步函数或者 Runnable（比如 ToolNode）。
+    """
+
+    async def run(state, config: RunnableConfig):
+        if isinstance(node, Runnable):
+            return await node.ainvoke(state, config)
+        if inspect.iscoroutinefunction(node):
+            return await node(state)
+        return await run_in_executor(config, node, state)  # 同步节点不占用事件循环
+
+    async def wrapper(state, config: RunnableConfig):
+        session = (config.get('configurable') or {}).get('thread_id', '-')
+        iteration = loop_iteration(state['messages'])
+        status = 'ok'
+        update = None
+        start = time.perf_counter()
+        try:
+            update = await run(state, config)
+            return update
+        except asyncio.CancelledError:
+            status = 'cancelled'
+            raise
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            prompt_tokens, completion_tokens = token_usage(update)
+            NODE_SECONDS.observe(elapsed, node=name, status=status)
+            NODE_ITERATION.observe(iteration, node=name)
+            if prompt_tokens or completion_tokens:
+                NODE_TOKENS.inc(prompt_tokens, node=name, type='prompt')
+                NODE_TOKENS.inc(completion_tokens, node=name, type='completion')
+            log.info(f'span node={name} session={session} iteration={iteration} status={status} '
+                     f'duration_ms={elapsed * 1000:.1f} prompt_tokens={prompt_tokens} completion_tokens={completion_tokens}')
+
+    wrapper.__name__ = name
+    return wrapper
@@ -0,0 +1,154 @@
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from sql_graph.metrics import metrics_registry
+
+QUERY_CACHE_LOOKUPS = metrics_registry.counter('text2sql_query_cache_lookups_total', '问题->SQL缓存的查找次数（hit：命中，miss：没有命中）',
+                                               ('result',))
+
+_SPACE_RE = re.compile(r'\s+')
+_PUNCT_RE = re.compile(r'[?？!！。.,，;；:：\'"“”‘’]+')
+_NUMBER_RE = re.compile(r'\d+(?:\.\d+)?')
+_TOKEN_RE = re.compile(r'\d+(?:\.\d+)?|[a-z]+|[\u4e00-\u9fff]')
+# 不影响问题意思的词（英文单词和中文单字）；否定词（not、不、没有）和实体名都不在这里
+_STOPWORDS = frozenset('a an the of in is are was were me us please show list give tell find all'.split()
+                       + list('的了吗呢吧啊请帮我'))
+
+
+def normalize_question(question: str) -> str:
+    """问题归一化：全角转半角、统一小写、去掉标点、合并空白"""
+    question = unicodedata.normalize('NFKC', question).lower()
+    question = _PUNCT_RE.sub(' ', question)
+    return _SPACE_RE.sub(' ', question).strip()
+
+
+def content_tokens(question: str) -> frozenset:
+    """归一化之后的问题里有意义的词：英文单词、数字和中文单字，去掉停用词"""
+    return frozenset(t for t in _TOKEN_RE.findall(question) if t not in _STOPWORDS)
+
+
+@dataclass
+class CacheEntry:
+    question: str  # 归一化之后的问题
+    sql: str
+    schema_version: int
+    created_at: float
+    row: int  # 在向量矩阵中的行号
+
+
+class SemanticQueryCache:
+    """
+    问题 -> SQL 的语义缓存，只保存执行成功并且给出了最终答案的SQL。
+
+    查找时先精确匹配归一化后的问题，再用字符n-gram哈希向量在NumPy矩阵上算余弦相似度；
+    相似匹配只用来容忍停用词和语序的差别：还要求去掉停用词之后的词完全一致（包括实体名、数字和否定词），
+    避免“not in USA”命中“in USA”、“UK”命中“USA”、“2009年”命中“2010年”的SQL。
+    超过 ttl 秒的条目和表结构版本不一致的条目视为失效，容量满了按LRU淘汰。
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl: float = 24 * 3600, threshold: float = 0.9, dim: int = 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.dim = dim
+        self._entries: 'OrderedDict[str, CacheEntry]' = OrderedDict()
+        self._matrix = np.zeros((max_entries, dim), dtype=np.float32)
+        self._row_keys = [None] * max_entries
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.enabled = True  # 关闭后不再查找和保存（压测时避免重复的问题直接命中缓存）
+        self.hits = 0
+        self.misses = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        """字符2-gram和3-gram的哈希向量（L2归一化），不依赖任何外部模型"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = f' {question} '
+        for n in (2, 3):
+            for i in range(len(text) - n + 1):
+                vector[zlib.crc32(text[i:i + n].encode('utf-8')) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._matrix[entry.row] = 0
+        self._row_keys[entry.row] = None
+        self._free_rows.append(entry.row)
+
+    def _is_valid(self, entry: CacheEntry, schema_version: int) -> bool:
+        return entry.schema_version == schema_version and time.time() - entry.created_at < self.ttl
+
+    def get(self, question: str, schema_version: int) -> Optional[str]:
+        """查找缓存的SQL，没有命中返回None"""
+        if not self.enabled:
+            return None
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._is_valid(entry, schema_version):
+                self._remove(key)
+                entry = None
+            if entry is None and self._entries:
+                scores = self._matrix @ self._embed(key)
+                row = int(np.argmax(scores))
+                candidate_key = self._row_keys[row]
+                if candidate_key is not None and scores[row] >= self.threshold \
+                        and _NUMBER_RE.findall(candidate_key) == _NUMBER_RE.findall(key) \
+                        and content_tokens(candidate_key) == content_tokens(key):
+                    candidate = self._entries[candidate_key]
+                    if self._is_valid(candidate, schema_version):
+                        entry = candidate
+            if entry is None:
+                self.misses += 1
+                QUERY_CACHE_LOOKUPS.inc(result='miss')
+                return None
+            self._entries.move_to_end(entry.question)
+            self.hits += 1
+            QUERY_CACHE_LOOKUPS.inc(result='hit')
+            return entry.sql
+
+    def put(self, question: str, sql: str, schema_version: int):
+        """保存一条验证过的SQL"""
+        if not self.enabled:
+            return
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if not self._free_rows:
+                self._remove(next(iter(self._entries)))  # 淘汰最久没用过的
+            row = self._free_rows.pop()
+            self._matrix[row] = self._embed(key)
+            self._row_keys[row] = key
+            self._entries[key] = CacheEntry(key, sql, schema_version, time.time(), row)
+
+    def invalidate(self, sql: str):
+        """缓存的SQL执行失败时，删除所有对应这条SQL的缓存"""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.sql == sql]:
+                self._remove(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+# 进程内共享的问题 -> SQL 缓存
+query_cache = SemanticQueryCache()
+metrics_registry.gauge('text2sql_query_cache_hit_ratio', '问题->SQL缓存的命中率（进程启动以来）',
+                       lambda: query_cache.stats()['hit_rate'])
+metrics_registry.gauge('text2sql_query_cache_entries', '问题->SQL缓存的条数', lambda: query_cache.stats()['size'])
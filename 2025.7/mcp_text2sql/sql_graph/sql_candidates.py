@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+from typing import List, Optional
+
+from langchain_core.messages import AIMessage
+from langgraph.constants import TAG_NOSTREAM
+
+from mcp_server.query_guard import QueryGuard
+from mcp_server.result_cache import canonicalize_sql, is_read_only
+from mcp_server.sqlite_pool import SQLitePool
+from sql_graph.log_utils import log
+from sql_graph.tools_node import db
+
+# 本地只读连接，只用来对候选SQL做 EXPLAIN，不执行查询
+_explain_pool = SQLitePool(db._engine.url.database, size=4)
+_cost_guard = QueryGuard()
+
+
+def explain_cost(sql: str) -> Optional[int]:
+    """用 EXPLAIN QUERY PLAN 验证SQL（语法、表名、列名），返回估算代价；无效的SQL返回None"""
+    if not sql or not is_read_only(canonicalize_sql(sql)):
+        return None
+    try:
+        with _explain_pool.connection() as conn:
+            return _cost_guard.estimate_cost(conn, sql)
+    except sqlite3.Error as e:
+        log.debug(f'候选SQL无效: {e}: {sql}')
+        return None
+
+
+async def generate_candidates(llm_with_tools, messages: List, n: int, temperature: float = 0.7,
+                              grace: float = 0.3) -> AIMessage:
+    """
+    并发生成 n 条候选SQL，用 EXPLAIN 验证：第一条有效的SQL返回后再等待 grace 秒，
+    然后取消剩下的请求，在已经验证通过的候选里选代价最小的一条。
+    没有有效SQL时，优先返回模型的文字回答，其次返回第一条（无效的）候选，交给后面的检查和执行流程处理。
+    """
+    # 候选的输出不逐字推送到页面（只有选中的那条才有意义），打上标签方便在追踪里区分
+    sampler = llm_with_tools.bind(temperature=temperature).with_config(tags=['sql_candidate', TAG_NOSTREAM])
+    tasks = [asyncio.create_task(sampler.ainvoke(messages)) for _ in range(n)]
+    loop = asyncio.get_running_loop()
+    pending = set(tasks)
+    valid, answer, fallback, error = [], None, None, None
+    deadline = None
+    try:
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:  # 宽限时间到了
+                break
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                resp = task.result()
+                if not resp.tool_calls:
+                    answer = answer or resp
+                    continue
+                sql = resp.tool_calls[0]["args"].get("query")
+                cost = await asyncio.to_thread(explain_cost, sql)
+                if cost is None:
+                    fallback = fallback or resp
+                    continue
+                valid.append((cost, resp))
+                if deadline is None:
+                    deadline = loop.time() + grace
+    finally:
+        for task in pending:
+            task.cancel()
+
+    log.info(f'并发生成{n}条候选SQL，有效{len(valid)}条，代价: {[cost for cost, _ in valid]}')
+    if valid:
+        return min(valid, key=lambda x: x[0])[1]
+    if answer or fallback:
+        return answer or fallback
+    raise error
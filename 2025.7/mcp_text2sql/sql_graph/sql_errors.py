@@ -0,0 +1,122 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from mcp_server.query_guard import parse_aliases
+from sql_graph.metrics import metrics_registry
+from sql_graph.tools_node import schema_snapshot
+
+# db_query_tool 返回结果的分类
+OK = 'ok'
+EMPTY = 'empty'
+SYNTAX = 'syntax'
+UNKNOWN_COLUMN = 'unknown_column'
+UNKNOWN_TABLE = 'unknown_table'
+TIMEOUT = 'timeout'
+TOO_EXPENSIVE = 'too_expensive'
+OTHER = 'other'
+
+# 每类错误允许重新生成SQL的次数，超过后直接结束，不再调用大模型
+RETRY_BUDGETS = {
+    SYNTAX: 2,
+    UNKNOWN_COLUMN: 2,
+    UNKNOWN_TABLE: 1,
+    TIMEOUT: 1,
+    TOO_EXPENSIVE: 1,
+    EMPTY: 1,
+    OTHER: 1,
+}
+
+_SYNTAX_RE = re.compile(r'syntax error|incomplete input|unrecognized token|no such function|wrong number of arguments'
+                        r'|misuse of aggregate', re.IGNORECASE)
+_COLUMN_RE = re.compile(r'no such column:\s*(\S+)|ambiguous column name:\s*(\S+)', re.IGNORECASE)
+_TABLE_RE = re.compile(r'no such table:\s*(\S+)', re.IGNORECASE)
+_EMPTY_RE = re.compile(r'^-- 共0行\s*$', re.MULTILINE)
+
+SQL_RESULTS = metrics_registry.counter('text2sql_sql_results_total', 'db_query_tool 执行结果按类型的计数', ('kind',))
+
+
+@dataclass
+class QueryAttempt:
+    """本轮问题中一次SQL执行的结果"""
+    sql: Optional[str]
+    kind: str
+    detail: str
+
+
+def classify_result(content: str) -> str:
+    """把 db_query_tool 的返回分类：成功、空结果，或者各类错误"""
+    text = content.strip()
+    if not (text.startswith('错误') or text.startswith('Error')):
+        return EMPTY if _EMPTY_RE.search(text) else OK
+    if text.startswith('错误: {'):  # QueryGuard 返回的结构化错误
+        try:
+            reason = json.loads(text[len('错误: '):]).get('reason')
+            return TIMEOUT if reason == 'timeout' else TOO_EXPENSIVE
+        except ValueError:
+            pass
+    if _COLUMN_RE.search(text):
+        return UNKNOWN_COLUMN
+    if _TABLE_RE.search(text):
+        return UNKNOWN_TABLE
+    if _SYNTAX_RE.search(text):
+        return SYNTAX
+    if 'interrupted' in text:
+        return TIMEOUT
+    return OTHER
+
+
+def give_up_reason(attempts: List[QueryAttempt], max_retries: int) -> Optional[str]:
+    """判断是否应该放弃：总次数或者某一类错误超过预算，或者模型重复提交了失败过的SQL"""
+    failed = [a for a in attempts if a.kind != OK]
+    if not failed or attempts[-1].kind == OK:
+        return None
+    last = attempts[-1]
+    if last.sql and any(a.sql == last.sql for a in failed[:-1]):
+        return '重复执行了已经失败过的SQL'
+    if len(failed) > max_retries:
+        return f'SQL执行失败超过{max_retries}次'
+    same_kind = sum(1 for a in failed if a.kind == last.kind)
+    if same_kind > RETRY_BUDGETS.get(last.kind, 1):
+        return f'{last.kind} 类错误出现了{same_kind}次'
+    return None
+
+
+def _columns_hint(sql: str) -> str:
+    """列出SQL里用到的表的真实列名"""
+    lines = []
+    for table in sorted(set(parse_aliases(sql or '').values())):
+        meta = schema_snapshot.describe(table)
+        if meta is not None:
+            lines.append(f'{meta.name}: {", ".join(meta.types)}')
+    return '\n'.join(lines)
+
+
+def retry_hint(attempt: QueryAttempt) -> str:
+    """按上一次失败的类型，给重新生成SQL的大模型一条针对性的提示"""
+    if attempt.kind == SYNTAX:
+        return '上一条SQL有语法错误：只修正语法，不要改变查询的逻辑。'
+    if attempt.kind == UNKNOWN_COLUMN:
+        columns = _columns_hint(attempt.sql)
+        return '上一条SQL引用了不存在的列。只能使用下面这些列：\n' + columns if columns else \
+            '上一条SQL引用了不存在的列，请对照表结构修正列名。'
+    if attempt.kind == UNKNOWN_TABLE:
+        return f'上一条SQL引用了不存在的表。数据库中的表只有：{", ".join(schema_snapshot.refresh().table_names)}'
+    if attempt.kind in (TIMEOUT, TOO_EXPENSIVE):
+        return '上一条SQL代价太高：必须加上更严格的过滤条件、先聚合再关联或者加上LIMIT。这是最后一次重试机会。'
+    if attempt.kind == EMPTY:
+        return ('上一条SQL的结果为空：检查字符串的大小写、日期的格式和过滤条件是否过严；'
+                '如果确实没有符合条件的数据，直接回答没有找到，不要再次查询。')
+    return ''
+
+
+def give_up_answer(attempts: List[QueryAttempt], reason: str) -> str:
+    """放弃时直接返回给用户的回答（不再调用大模型）"""
+    if not attempts:
+        return f'抱歉，这个问题没能生成可以执行的SQL（{reason}）。'
+    last = attempts[-1]
+    if last.kind == EMPTY:
+        return f'没有查询到符合条件的数据。\n\n最后执行的SQL：\n```sql\n{last.sql}\n```'
+    sql = f'\n\n最后执行的SQL：\n```sql\n{last.sql}\n```' if last.sql else ''
+    return f'抱歉，这个问题没能生成可以正确执行的SQL（{reason}）。\n最后一次的错误：{last.detail[:300]}{sql}'
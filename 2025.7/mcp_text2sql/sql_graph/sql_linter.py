@@ -0,0 +1,87 @@
+import re
+from typing import List, Optional, Tuple
+
+from mcp_server.query_guard import parse_aliases
+from sql_graph.tools_node import SchemaSnapshot, TableMeta
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_COMMENT_RE = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+_NOT_IN_RE = re.compile(r'\bnot\s+in\s*\(\s*select\s+(?:distinct\s+)?((?:[A-Za-z_]\w*\.)?[A-Za-z_]\w*)\s+from\s+'
+                        r'["`\[]?(\w+)["`\]]?', re.IGNORECASE)
+_UNION_RE = re.compile(r'\bunion\b(?!\s+all\b)', re.IGNORECASE)
+_BETWEEN_RE = re.compile(r"((?:[A-Za-z_]\w*\.)?[A-Za-z_]\w*)\s+between\s+'[^']*'\s+and\s+'(\d{4}-\d{2}-\d{2})'",
+                         re.IGNORECASE)
+_QUALIFIED_RE = re.compile(r'(?<![\w.])([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b')
+_EQUALS_RE = re.compile(r'(?<![\w.])([A-Za-z_]\w*)\.([A-Za-z_]\w*)\s*=\s*([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b')
+
+
+class SQLLinter:
+    """
+    本地SQL检查：在毫秒级别内对照表结构检查 query_check_system 里列出的常见错误。
+    没有发现问题的SQL直接执行；发现问题时才交给大模型检查和改写。
+    """
+
+    def __init__(self, snapshot: SchemaSnapshot):
+        self.snapshot = snapshot
+
+    def _resolve(self, aliases: dict, qualifier: str) -> Optional[TableMeta]:
+        table = aliases.get(qualifier.lower(), qualifier)
+        return self.snapshot.describe(table)
+
+    def _find_column(self, aliases: dict, column: str) -> Optional[Tuple[TableMeta, str]]:
+        """找到列所在的表：带表名/别名的直接解析，不带的在FROM里的所有表中查找"""
+        if '.' in column:
+            qualifier, name = column.split('.', 1)
+            meta = self._resolve(aliases, qualifier)
+            return (meta, name.lower()) if meta and name.lower() in meta.columns else None
+        for table in set(aliases.values()):
+            meta = self.snapshot.describe(table)
+            if meta and column.lower() in meta.columns:
+                return meta, column.lower()
+        return None
+
+    def lint(self, sql: str) -> List[str]:
+        """返回发现的问题列表，空列表表示没有发现问题"""
+        self.snapshot.refresh()
+        sql = _COMMENT_RE.sub(' ', sql)
+        code = _STRING_RE.sub("''", sql)  # 去掉字符串常量，避免误匹配
+        aliases = parse_aliases(code)
+        issues = []
+
+        for column, table in _NOT_IN_RE.findall(code):
+            meta = self.snapshot.describe(table)
+            name = column.split('.')[-1].lower()
+            if meta is None or (meta.columns.get(name, True) and name not in meta.primary_key):
+                issues.append(f'NOT IN 子查询返回的列 {table}.{column.split(".")[-1]} 可能包含NULL，'
+                              f'此时 NOT IN 的结果永远为空，应改用 NOT EXISTS 或加上 IS NOT NULL 条件')
+
+        if _UNION_RE.search(code):
+            issues.append('使用了 UNION（会去重），请确认是否应该使用 UNION ALL')
+
+        for column, end in _BETWEEN_RE.findall(sql):
+            found = self._find_column(aliases, column)
+            if found and any(t in found[0].types.get(found[1], '') for t in ('DATETIME', 'TIMESTAMP')):
+                issues.append(f"{column} 是日期时间类型，BETWEEN ... AND '{end}' 不包含 {end} 当天0点之后的数据，"
+                              f"应改用 < 次日的写法")
+
+        for qualifier, column in _QUALIFIED_RE.findall(code):
+            if qualifier.lower() not in aliases:
+                continue
+            meta = self._resolve(aliases, qualifier)
+            if meta is not None and column.lower() not in meta.columns:
+                issues.append(f'列 {qualifier}.{column} 在表 {meta.name} 中不存在，'
+                              f'可用的列有: {", ".join(meta.columns)}')
+
+        for left_q, left_c, right_q, right_c in _EQUALS_RE.findall(code):
+            left, right = self._resolve(aliases, left_q), self._resolve(aliases, right_q)
+            if left is None or right is None or left_q.lower() == right_q.lower():
+                continue
+            left_c, right_c = left_c.lower(), right_c.lower()
+            if left_c not in left.columns or right_c not in right.columns or left_c == right_c:
+                continue
+            related = (left_c, right.name, right_c) in left.foreign_keys or \
+                      (right_c, left.name, left_c) in right.foreign_keys
+            if not related:
+                issues.append(f'关联条件 {left_q}.{left_c} = {right_q}.{right_c} 不是外键关系，请确认关联的列是否正确')
+
+        return list(dict.fromkeys(issues))
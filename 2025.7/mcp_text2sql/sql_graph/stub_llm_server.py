@@ -0,0 +1,157 @@
+"""
+压测用的OpenAI兼容桩服务：按脚本返回工具调用和回答，不调用真实的大模型。
+
+- 生成SQL（请求里没有 tool_choice）：按用户的问题在脚本里找SQL，本轮每有一次执行出错就换下一条SQL；
+  最后一条消息是执行成功的查询结果时，返回文字回答；
+- 检查SQL（tool_choice=required，对应 check_query）：原样返回要检查的SQL；
+- 每次请求等待 latency 秒（加上 jitter 以内的随机抖动），再按 tokens_per_second 模拟输出耗时，
+  返回的 usage 用本地估算的token数。
+
+用法（单独启动，然后把 LLM_BASE_URL 设置成 http://127.0.0.1:8765/v1）：
+    python -m sql_graph.stub_llm_server --port 8765 --latency 0.5
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_SQL = 'SELECT COUNT(*) FROM Track'
+
+
+def _text(content) -> str:
+    """OpenAI消息的content可能是字符串，也可能是内容块列表"""
+    if isinstance(content, str):
+        return content
+    return ''.join(block.get('text', '') for block in content or [] if isinstance(block, dict))
+
+
+class ScriptedLLM:
+    """根据脚本 {问题: [第一次的SQL, 出错后重试的SQL, ...]} 决定每次请求的返回"""
+
+    def __init__(self, script: Dict[str, List[str]], latency: float = 0.5, jitter: float = 0.0,
+                 tokens_per_second: float = 0.0):
+        self.script = script
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _reply(self, request: dict) -> Tuple[Optional[str], Optional[dict]]:
+        """返回 (文字回答, 工具调用)"""
+        messages = request.get('messages', [])
+        if request.get('tool_choice') not in (None, 'auto', 'none'):
+            # check_query：用户消息的第一段就是要检查的SQL
+            sql = _text(messages[-1].get('content')).split('\n\n')[0].strip()
+            return None, {'name': 'db_query_tool', 'arguments': {'query': sql}}
+
+        start = max((i for i, m in enumerate(messages) if m.get('role') == 'user'), default=0)
+        question = _text(messages[start].get('content')) if messages else ''
+        tool_names = {}  # 工具调用id -> 工具名
+        results = []  # 本轮db_query_tool的结果
+        for message in messages[start:]:
+            for tool_call in message.get('tool_calls') or []:
+                tool_names[tool_call['id']] = tool_call['function']['name']
+            if message.get('role') == 'tool' and tool_names.get(message.get('tool_call_id')) == 'db_query_tool':
+                results.append(_text(message.get('content')).strip())
+        failed = sum(1 for r in results if r.startswith('错误') or r.startswith('Error'))
+        last = messages[-1] if messages else {}
+        if results and last.get('role') == 'tool' and not (results[-1].startswith('错误') or
+                                                           results[-1].startswith('Error')):
+            first_rows = '\n'.join(results[-1].splitlines()[:4])
+            return f'根据查询结果，问题“{question}”的答案如下：\n{first_rows}', None
+        sqls = self.script.get(question.strip()) or [DEFAULT_SQL]
+        return None, {'name': 'db_query_tool', 'arguments': {'query': sqls[min(failed, len(sqls) - 1)]}}
+
+    def complete(self, request: dict) -> dict:
+        # 在这里导入：压测脚本要先启动桩服务拿到地址，再设置 LLM_BASE_URL，之后才能导入 sql_graph 的配置
+        from sql_graph.context_compactor import estimate_tokens
+
+        with self._lock:
+            self.calls += 1
+        content, tool_call = self._reply(request)
+        output = content or json.dumps(tool_call['arguments'], ensure_ascii=False)
+        prompt_tokens = sum(estimate_tokens(_text(m.get('content'))) + 4 for m in request.get('messages', []))
+        completion_tokens = estimate_tokens(output)
+        delay = self.latency + random.uniform(0, self.jitter)
+        if self.tokens_per_second > 0:
+            delay += completion_tokens / self.tokens_per_second
+        time.sleep(delay)
+
+        message = {'role': 'assistant', 'content': content or ''}
+        if tool_call:
+            message['tool_calls'] = [{
+                'id': f'call_{uuid.uuid4().hex[:12]}',
+                'type': 'function',
+                'function': {'name': tool_call['name'],
+                             'arguments': json.dumps(tool_call['arguments'], ensure_ascii=False)},
+            }]
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex[:12]}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': message, 'finish_reason': 'tool_calls' if tool_call else 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }
+
+
+def _make_handler(llm: ScriptedLLM):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if request.get('stream'):
+                self.send_error(400, 'stream is not supported by the stub server')
+                return
+            body = json.dumps(llm.complete(request), ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):  # 不输出每个请求的访问日志
+            pass
+
+    return Handler
+
+
+def start_stub_server(llm: ScriptedLLM, host: str = '127.0.0.1', port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """在后台线程启动桩服务，返回 (服务对象, base_url)；port=0 时随机选择端口"""
+    server = ThreadingHTTPServer((host, port), _make_handler(llm))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-llm', daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI兼容的大模型桩服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--script', help='JSON文件: [{"question": ..., "sql": [...]}]，默认使用压测的问题集')
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0)
+    args = parser.parse_args()
+
+    from sql_graph.bench_text2sql import load_questions
+    script = {q['question']: q['sql'] for q in load_questions(args.script)}
+    server, base_url = start_stub_server(ScriptedLLM(script, args.latency, args.jitter, args.tokens_per_second),
+                                         args.host, args.port)
+    print(f'桩服务已启动: {base_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,307 @@
+import uuid
 from contextlib import asynccontextmanager
-from typing import Literal
+from typing import List, Literal, Optional
 
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.constants import START, END
 from langgraph.graph import StateGraph
 from langgraph.prebuilt import ToolNode, create_react_agent
 
+from sql_graph.context_compactor import context_compactor, estimate_tokens
 from sql_graph.my_llm import llm
+from sql_graph.env_utils import SQL_CANDIDATES, SQL_CANDIDATE_TEMPERATURE, SQL_CANDIDATE_GRACE, MAX_SQL_RETRIES, \
+    MAX_EXPLORE_CALLS, MCP_SERVER_URL, MCP_TRANSPORT
+from sql_graph.log_utils import log
+from sql_graph.message_utils import message_text
 from sql_graph.my_state import SQLState
-from sql_graph.tools_node import generate_query_system_prompt, query_check_system, call_get_schema, get_schema_node
+from sql_graph.node_spans import traced_node
+from sql_graph.query_cache import query_cache
+from sql_graph.sql_candidates import generate_candidates
+from sql_graph.sql_errors import OK, QueryAttempt, SQL_RESULTS, classify_result, give_up_answer, give_up_reason, \
+    retry_hint
+from sql_graph.sql_linter import SQLLinter
+from sql_graph.tools_node import generate_query_system_prompt, query_check_system, call_get_schema, get_schema_node, \
+    route_after_call_schema, schema_snapshot
+
+sql_linter = SQLLinter(schema_snapshot)
+
+# 探查数据的工具 -> 告诉大模型什么时候用它；结果直接回到生成SQL的节点，不经过检查和执行SQL的流程
+EXPLORE_TOOLS = {
+    "column_stats_tool": "不确定某一列的取值（比如状态、国家的写法）、空值或者数值范围时，先调用 column_stats_tool 查看预先统计好的列信息，"
+                         "不要用 db_query_tool 执行 SELECT DISTINCT、COUNT 之类的探查查询。",
+    "value_lookup_tool": "问题里提到人名、地名、名称等具体的值时，先调用 value_lookup_tool 找到它在数据库里的准确写法，"
+                         "不要猜 WHERE 条件里的字符串，也不要用 LIKE 探查。",
+}
 
 mcp_server_config = {
-    "url": "http://localhost:8000/sse",
-    "transport": "sse"
+    "url": MCP_SERVER_URL,
+    "transport": MCP_TRANSPORT
 }
 
 
-def should_continue(state: SQLState) -> Literal[END, "check_query"]:
+def last_question(messages) -> str:
+    """当前这一轮用户的问题"""
+    return next((message_text(m) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+
+
+def is_follow_up(messages) -> bool:
+    """当前问题前面还有用户的问题：多轮会话里的追问可能依赖上文（比如“加拿大呢？”），不能单独作为缓存的键"""
+    return sum(isinstance(m, HumanMessage) for m in messages) > 1
+
+
+def is_query_error(message: ToolMessage) -> bool:
+    """db_query_tool 的执行结果是否是错误信息"""
+    content = message_text(message).lstrip()
+    return message.status == 'error' or content.startswith('错误') or content.startswith('Error')
+
+
+def is_query_result(message) -> bool:
+    """run_query 节点执行的工具调用结果：db_query_tool 的结果，以及调用出错（比如模型调用了不存在的工具）的结果"""
+    return isinstance(message, ToolMessage) and (message.name == "db_query_tool" or (
+            message.status == 'error' and message.name not in EXPLORE_TOOLS))
+
+
+def find_query(messages, tool_call_id: str) -> Optional[str]:
+    """根据工具调用id找到对应的SQL语句"""
+    for message in reversed(messages):
+        if isinstance(message, AIMessage):
+            for tool_call in message.tool_calls:
+                if tool_call["id"] == tool_call_id:
+                    return tool_call["args"].get("query")
+    return None
+
+
+def needs_new_query(messages) -> bool:
+    """最后一条消息不是成功的查询结果，说明需要（重新）生成SQL"""
+    last_message = messages[-1]
+    return not (isinstance(last_message, ToolMessage) and last_message.name == "db_query_tool"
+                and not is_query_error(last_message))
+
+
+def query_attempts(messages) -> List[QueryAttempt]:
+    """本轮问题中每次执行SQL的结果（按执行顺序）"""
+    attempts = []
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if is_query_result(message):  # 调用不存在的工具出错也算一次失败，占用重试预算
+            text = message_text(message)
+            kind = classify_result(text) if message.status != 'error' else classify_result('Error: ' + text)
+            attempts.append(QueryAttempt(find_query(messages, message.tool_call_id), kind, text))
+    attempts.reverse()
+    return attempts
+
+
+def explore_calls(messages) -> int:
+    """本轮问题中已经调用探查工具的次数"""
+    count = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, ToolMessage) and message.name in EXPLORE_TOOLS:
+            count += 1
+    return count
+
+
+def route_after_run(state: SQLState) -> Literal["generate_query", "give_up"]:
+    """执行SQL之后：成功或者还有重试预算时回到生成节点，预算用完时直接结束"""
+    attempts = query_attempts(state["messages"])
+    if not attempts:
+        # 没有得到任何执行结果，重新生成也没有意义
+        log.warning('run_query 没有返回 db_query_tool 的结果，放弃')
+        return "give_up"
+    last = attempts[-1]
+    SQL_RESULTS.inc(kind=last.kind)
+    if last.kind == OK:
+        return "generate_query"
+    reason = give_up_reason(attempts, MAX_SQL_RETRIES)
+    log.info(f'SQL执行结果: {last.kind}，第{len(attempts)}次执行' + (f'，放弃: {reason}' if reason else ''))
+    return "give_up" if reason else "generate_query"
+
+
+def give_up(state: SQLState):
+    """重试预算用完：不再调用大模型，直接告诉用户失败的原因"""
+    attempts = query_attempts(state["messages"])
+    reason = give_up_reason(attempts, MAX_SQL_RETRIES) or "重试次数用完"
+    for attempt in attempts:
+        if attempt.kind != OK and attempt.sql:
+            query_cache.invalidate(attempt.sql)  # 缓存里的SQL执行失败时不再复用
+    return {"messages": [AIMessage(content=give_up_answer(attempts, reason))]}
+
+
+def lookup_cache(state: SQLState):
+    """入口节点: 相似的问题之前回答过，直接复用验证过的SQL，跳过查表、取表结构、生成和检查SQL；追问不查缓存"""
+    if is_follow_up(state["messages"]):
+        return {"messages": []}
+    sql = query_cache.get(last_question(state["messages"]), schema_snapshot.refresh().version)
+    if sql is None:
+        return {"messages": []}
+    tool_call = {
+        "name": "db_query_tool",
+        "args": {"query": sql},
+        "id": f"cache_{uuid.uuid4().hex[:8]}",
+        "type": "tool_call",
+    }
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])]}
+
+
+def route_after_cache(state: SQLState) -> Literal["run_query", "call_list_tables"]:
+    """缓存命中直接执行SQL，否则走完整流程"""
+    last_message = state["messages"][-1]
+    if isinstance(last_message, AIMessage) and any(c["id"].startswith("cache_") for c in last_message.tool_calls):
+        return "run_query"
+    return "call_list_tables"
+
+
+def save_to_cache(messages):
+    """模型给出最终答案时，把本轮最后一条执行成功的SQL存进缓存（追问不存）；缓存的SQL执行失败则删掉它"""
+    follow_up = is_follow_up(messages)
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return
+        # 停在最近一次执行的结果上：最近一次调用出错时这一轮的答案不可信，不存缓存
+        if is_query_result(message):
+            sql = find_query(messages, message.tool_call_id)
+            if is_query_error(message):  # 包括没有SQL的出错调用（获取下一页出错、调用了不存在的工具）
+                if sql and message.tool_call_id.startswith("cache_"):
+                    query_cache.invalidate(sql)
+                return
+            if not sql:  # 获取下一页的调用，继续往前找执行SQL的那次调用
+                continue
+            if not follow_up:
+                query_cache.put(last_question(messages), sql, schema_snapshot.version)
+            return
+
+
+def should_continue(state: SQLState) -> Literal[END, "check_query", "explore_data"]:
     """条件路由的，动态边"""
     messages = state["messages"]
     last_message = messages[-1]
     if not last_message.tool_calls:
         return END
-    else:
-        return "check_query"
+    if all(tool_call["name"] in EXPLORE_TOOLS for tool_call in last_message.tool_calls):
+        return "explore_data"
+    return "check_query"
+
+
+def build_graph(tools, checkpointer=None):
+    """根据MCP服务提供的工具，定义并且编译工作流；传入 checkpointer 时按 thread_id 保存多轮对话的状态"""
+    # 所有表名列表的工具
+    list_tables_tool = next(tool for tool in tools if tool.name == "list_tables_tool")
+    # 执行sql的工具
+    db_query_tool = next(tool for tool in tools if tool.name == "db_query_tool")
+    # 探查数据的工具（旧版本的MCP服务没有）
+    explore_tools = [tool for tool in tools if tool.name in EXPLORE_TOOLS]
+    explore_prompt = "\n".join(EXPLORE_TOOLS[tool.name] for tool in explore_tools)
+
+    def call_list_tables(state: SQLState):
+        """第一个节点: 把用户的问题传给list_tables_tool，表很多时只返回相关的表"""
+        question = last_question(state["messages"])
+        tool_call = {
+            "name": "list_tables_tool",
+            "args": {"question": question},
+            "id": f"list_tables_{uuid.uuid4().hex[:8]}",
+            "type": "tool_call",
+        }
+        tool_call_message = AIMessage(content="", tool_calls=[tool_call])
+
+        # tool_message = list_tables_tool.invoke(tool_call)  # 调用工具
+        #
+        # response = AIMessage(f"所有可用的表: {tool_message.content}")
+
+        # return {"messages": [tool_call_message, tool_message, response]}
+        return {"messages": [tool_call_message]}
+
+
+    # 第二个节点
+    list_tables_tool = ToolNode([list_tables_tool], name="list_tables_tool")
+
+    async def generate_query(state: SQLState):
+        """第五个节点: 生成SQL语句"""
+        system_message = {
+            "role": "system",
+            "content": generate_query_system_prompt,
+        }
+        attempts = query_attempts(state['messages'])
+        if attempts and attempts[-1].kind != OK and isinstance(state['messages'][-1], ToolMessage):
+            # 上一次执行失败或者结果为空：按失败的类型给出针对性的提示
+            hint = retry_hint(attempts[-1])
+            if hint:
+                system_message["content"] = f'{generate_query_system_prompt}\n{hint}'
+        # 这里不强制工具调用，允许模型在获得解决方案时自然响应
+        bound_tools = [db_query_tool]
+        if explore_tools and explore_calls(state['messages']) < MAX_EXPLORE_CALLS:
+            bound_tools += explore_tools
+            system_message["content"] = f'{system_message["content"]}\n{explore_prompt}'
+        llm_with_tools = llm.bind_tools(bound_tools)
+        # 旧的表结构和查询结果不用每次都完整地发给大模型
+        messages = context_compactor.compact(state['messages'], estimate_tokens(generate_query_system_prompt))
+        if SQL_CANDIDATES > 1 and needs_new_query(state['messages']):
+            # 需要新写SQL时（第一次生成或者上一条SQL执行失败），并发生成多条候选，取有效且代价最小的
+            resp = await generate_candidates(llm_with_tools, [system_message] + messages, SQL_CANDIDATES,
+                                             SQL_CANDIDATE_TEMPERATURE, SQL_CANDIDATE_GRACE)
+        else:
+            resp = await llm_with_tools.ainvoke([system_message] + messages)
+        if not resp.tool_calls:
+            save_to_cache(state['messages'])
+        return {'messages': [resp]}
+
+    async def check_query(state: SQLState):
+        """第六个节点: 检查SQL语句，本地检查没有发现问题时直接执行，发现问题才让大模型检查和改写"""
+        system_message = {
+            "role": "system",
+            "content": query_check_system,
+        }
+        tool_call = state["messages"][-1].tool_calls[0]
+        if not tool_call["args"].get("query"):
+            # 只是获取下一页结果，没有新的SQL需要检查
+            return {"messages": []}
+        # 得到生成后的SQL
+        issues = sql_linter.lint(tool_call["args"]["query"])
+        if not issues:
+            return {"messages": []}
+        log.info(f'本地SQL检查发现问题，交给大模型检查: {issues}')
+        problems = "\n".join(f"- {issue}" for issue in issues)
+        user_message = {
+            "role": "user",
+            "content": f"{tool_call['args']['query']}\n\n本地检查发现以下可能的问题：\n{problems}",
+        }
+        llm_with_tools = llm.bind_tools([db_query_tool], tool_choice='any')
+        response = await llm_with_tools.ainvoke([system_message, user_message])
+        response.id = state["messages"][-1].id
+
+        return {"messages": [response]}
+
+    # 第 七个节点
+    run_query_node = ToolNode([db_query_tool], name="run_query")
+    nodes = [("lookup_cache", lookup_cache), ("call_list_tables", call_list_tables),
+             ("list_tables_tool", list_tables_tool), ("call_get_schema", call_get_schema),
+             ("get_schema", get_schema_node), ("generate_query", generate_query),
+             ("check_query", check_query), ("run_query", run_query_node), ("give_up", give_up)]
+    if explore_tools:
+        nodes.append(("explore_data", ToolNode(explore_tools, name="explore_data")))
+
+    workflow = StateGraph(SQLState)
+    # 每个节点都包一层计时，输出span日志并记录耗时直方图
+    for name, node in nodes:
+        workflow.add_node(name, traced_node(name, node))
+
+    workflow.add_edge(START, "lookup_cache")
+    workflow.add_conditional_edges("lookup_cache", route_after_cache)
+    workflow.add_edge("call_list_tables", "list_tables_tool")
+    workflow.add_edge("list_tables_tool", "call_get_schema")
+    workflow.add_conditional_edges("call_get_schema", route_after_call_schema)
+    workflow.add_edge("get_schema", "generate_query")
+    workflow.add_conditional_edges('generate_query', should_continue,
+                                   [END, "check_query"] + (["explore_data"] if explore_tools else []))
+    workflow.add_edge("check_query", "run_query")
+    workflow.add_conditional_edges("run_query", route_after_run)
+    workflow.add_edge("give_up", END)
+    if explore_tools:
+        workflow.add_edge("explore_data", "generate_query")
+
+    return workflow.compile(checkpointer=checkpointer)
 
 
 @asynccontextmanager  # 作用：用于快速创建异步上下文管理器。它使得异步资源的获取和释放可以像同步代码一样通过 async with 语法优雅地管理。
@@ -34,80 +311,7 @@ async def make_graph():
     client = MultiServerMCPClient({'lx_mcp': mcp_server_config})
     try:
         tools = await client.get_tools()
-        # 所有表名列表的工具
-        list_tables_tool = next(tool for tool in tools if tool.name == "list_tables_tool")
-        # 执行sql的工具
-        db_query_tool = next(tool for tool in tools if tool.name == "db_query_tool")
-
-        def call_list_tables(state: SQLState):
-            """第一个节点 """
-            tool_call = {
-                "name": "list_tables_tool",
-                "args": {},
-                "id": "abc123",
-                "type": "tool_call",
-            }
-            tool_call_message = AIMessage(content="", tool_calls=[tool_call])
-
-            # tool_message = list_tables_tool.invoke(tool_call)  # 调用工具
-            #
-            # response = AIMessage(f"所有可用的表: {tool_message.content}")
-
-            # return {"messages": [tool_call_message, tool_message, response]}
-            return {"messages": [tool_call_message]}
-
-
-        # 第二个节点
-        list_tables_tool = ToolNode([list_tables_tool], name="list_tables_tool")
-
-        def generate_query(state: SQLState):
-            """第五个节点: 生成SQL语句"""
-            system_message = {
-                "role": "system",
-                "content": generate_query_system_prompt,
-            }
-            # 这里不强制工具调用，允许模型在获得解决方案时自然响应
-            llm_with_tools = llm.bind_tools([db_query_tool])
-            resp = llm_with_tools.invoke([system_message] + state['messages'])
-            return {'messages': [resp]}
-
-        def check_query(state: SQLState):
-            """第六个节点: 检查SQL语句"""
-            system_message = {
-                "role": "system",
-                "content": query_check_system,
-            }
-            tool_call = state["messages"][-1].tool_calls[0]
-            # 得到生成后的SQL
-            user_message = {"role": "user", "content": tool_call["args"]["query"]}
-            llm_with_tools = llm.bind_tools([db_query_tool], tool_choice='any')
-            response = llm_with_tools.invoke([system_message, user_message])
-            response.id = state["messages"][-1].id
-
-            return {"messages": [response]}
-
-        # 第 七个节点
-        run_query_node = ToolNode([db_query_tool], name="run_query")
-
-        workflow = StateGraph(SQLState)
-        workflow.add_node(call_list_tables)
-        workflow.add_node(list_tables_tool)
-        workflow.add_node(call_get_schema)
-        workflow.add_node(get_schema_node)
-        workflow.add_node(generate_query)
-        workflow.add_node(check_query)
-        workflow.add_node(run_query_node)
-
-        workflow.add_edge(START, "call_list_tables")
-        workflow.add_edge("call_list_tables", "list_tables_tool")
-        workflow.add_edge("list_tables_tool", "call_get_schema")
-        workflow.add_edge("call_get_schema", "get_schema")
-        workflow.add_edge("get_schema", "generate_query")
-        workflow.add_conditional_edges('generate_query', should_continue)
-        workflow.add_edge("check_query", "run_query")
-        workflow.add_edge("run_query", "generate_query")
-
-        graph = workflow.compile()
+        graph = build_graph(tools)
         yield graph
         
     finally:
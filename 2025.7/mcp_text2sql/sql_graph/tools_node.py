@@ -1,32 +1,170 @@
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
+import threading
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
 from langchain_community.utilities import SQLDatabase
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import tool
 from langgraph.prebuilt import ToolNode
+from sqlalchemy import inspect
 
-from sql_graph.my_llm import llm
+from sql_graph.db_utils import get_schema_version
+from sql_graph.log_utils import log
+from sql_graph.message_utils import message_text
 from sql_graph.my_state import SQLState
 
 db = SQLDatabase.from_uri('sqlite:///../chinook.db')
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)
 
-tools = toolkit.get_tools()
 
-# 获取表结构的工具
-get_schema_tool = next(tool for tool in tools if tool.name == 'sql_db_schema')
+@dataclass
+class TableMeta:
+    """一张表的列信息，给本地SQL检查使用"""
+    name: str
+    columns: Dict[str, bool]  # 小写列名 -> 是否允许NULL
+    types: Dict[str, str]  # 小写列名 -> 大写的类型名
+    primary_key: List[str]  # 小写列名
+    foreign_keys: List[Tuple[str, str, str]]  # (小写列名, 引用的表名, 引用的小写列名)
+
+
+class _SchemaVersion:
+    """某一个 schema_version 的表结构和按需生成的缓存；表结构变化时整个替换，旧版本上补的缓存不会混进新版本"""
+
+    def __init__(self, database: SQLDatabase, version=None, table_names: Optional[List[str]] = None):
+        self.db = database
+        self.version = version
+        self.table_names: List[str] = table_names or []
+        self.table_info: Dict[str, str] = {}  # 表名 -> DDL和示例数据，按需生成后缓存
+        self.table_meta: Dict[str, TableMeta] = {}  # 小写表名 -> TableMeta，按需生成后缓存
+
+
+class SchemaSnapshot:
+    """
+    表结构快照：以 PRAGMA schema_version 作为版本号，缓存所有表名和每张表的DDL（含示例数据）。
+    版本号不变时直接从内存返回，不再反射表结构、也不再查询示例数据；表结构变化后自动重建。
+    表名和按需生成的缓存都放在同一个版本对象上，重建时整体替换；读写缓存前先取出当前的版本对象，
+    和重建并发时，按旧表结构生成的内容只会写回旧的版本对象。
+    """
+
+    def __init__(self, database: SQLDatabase):
+        self._lock = threading.Lock()
+        self._schema = _SchemaVersion(database)
+
+    @property
+    def version(self):
+        return self._schema.version
+
+    @property
+    def table_names(self) -> List[str]:
+        return self._schema.table_names
+
+    def refresh(self) -> 'SchemaSnapshot':
+        """检查版本号（一次PRAGMA查询），表结构变化时重建快照"""
+        version = get_schema_version(self._schema.db._engine)
+        if version != self._schema.version:
+            with self._lock:
+                schema = self._schema
+                if version != schema.version:
+                    # 表结构变了，重新反射整个数据库
+                    database = SQLDatabase(schema.db._engine) if schema.version is not None else schema.db
+                    self._schema = _SchemaVersion(database, version, list(database.get_usable_table_names()))
+                    log.info(f'表结构快照已重建，schema_version={version}，共{len(self._schema.table_names)}张表')
+        return self
+
+    def get_table_info(self, table_names: Iterable[str]) -> str:
+        """返回多张表的DDL和示例数据，不存在的表会被忽略"""
+        schema = self.refresh()._schema
+        infos = []
+        for name in table_names:
+            if name not in schema.table_names:
+                continue
+            info = schema.table_info.get(name)
+            if info is None:
+                info = schema.table_info.setdefault(name, schema.db.get_table_info([name]))
+            infos.append(info)
+        return '\n\n'.join(infos)
+
+    def describe(self, table_name: str) -> Optional[TableMeta]:
+        """返回表的列、主键和外键信息（表名不区分大小写），表不存在返回None"""
+        schema = self._schema
+        key = table_name.strip('"`[]').lower()
+        meta = schema.table_meta.get(key)
+        if meta is not None:
+            return meta
+        name = next((t for t in schema.table_names if t.lower() == key), None)
+        if name is None:
+            return None
+        inspector = inspect(schema.db._engine)
+        raw_columns = inspector.get_columns(name)
+        columns = {c['name'].lower(): c.get('nullable', True) for c in raw_columns}
+        types = {c['name'].lower(): str(c['type']).upper() for c in raw_columns}
+        primary_key = [c.lower() for c in inspector.get_pk_constraint(name).get('constrained_columns') or []]
+        foreign_keys = []
+        for fk in inspector.get_foreign_keys(name):
+            for col, ref_col in zip(fk['constrained_columns'], fk['referred_columns']):
+                foreign_keys.append((col.lower(), fk['referred_table'], ref_col.lower()))
+        return schema.table_meta.setdefault(key, TableMeta(name, columns, types, primary_key, foreign_keys))
+
+
+schema_snapshot = SchemaSnapshot(db)
+
+
+@tool('sql_db_schema', description='输入是以逗号分隔的表名列表，返回这些表的结构和示例数据')
+def get_schema_tool(table_names: str) -> str:
+    """从表结构快照中获取表的DDL和示例数据"""
+    names = [t.strip() for t in table_names.split(',') if t.strip()]
+    info = schema_snapshot.get_table_info(names)
+    if not info:
+        return f'错误: 表 {table_names} 不存在，可用的表有: {", ".join(schema_snapshot.table_names)}'
+    return info
+
+
 # 测试工具调用
 # print(get_schema_tool.invoke('employees'))
 
 
-def call_get_schema(state: SQLState):
-    """ 第三个节点"""
-    # 注意：LangChain强制要求所有模型都接受 `tool_choice="any"`
-    # 以及 `tool_choice=<工具名称字符串>` 这两种参数
-    llm_with_tools = llm.bind_tools([get_schema_tool], tool_choice="any")
-    response = llm_with_tools.invoke(state["messages"])
-
-    return {"messages": [response]}
+def has_schema_result(messages) -> bool:
+    """最近一次获取表结构的工具调用是否已经成功返回（执行被取消时可能只有调用没有结果）"""
+    last_call = next((c["id"] for m in reversed(messages) if isinstance(m, AIMessage)
+                      for c in m.tool_calls if c["name"] == "sql_db_schema"), None)
+    result = next((m for m in reversed(messages) if isinstance(m, ToolMessage) and m.name == "sql_db_schema"), None)
+    return result is not None and result.tool_call_id == last_call and not message_text(result).startswith('错误')
 
 
-# 第四个节点: 直接使用langgraph提供的ToolNode
+def call_get_schema(state: SQLState):
+    """ 第三个节点：直接根据表名列表构造获取表结构的工具调用，不再需要调用大模型"""
+    snapshot = schema_snapshot.refresh()
+    table_names = snapshot.table_names
+    last_message = state["messages"][-1]
+    if isinstance(last_message, ToolMessage):
+        # 上一个节点（list_tables_tool）返回的表名，只保留快照里存在的表
+        listed = [t.strip() for t in message_text(last_message).split(',')]
+        table_names = [t for t in listed if t in snapshot.table_names] or table_names
+
+    if (state.get("schema_version") == snapshot.version and set(table_names) <= set(state.get("schema_tables") or [])
+            and has_schema_result(state["messages"])):
+        # 多轮对话：之前获取的表结构还是最新的，并且包含了这次需要的表
+        return {"messages": []}
+
+    tool_call = {
+        "name": "sql_db_schema",
+        "args": {"table_names": ", ".join(table_names)},
+        "id": f"get_schema_{uuid.uuid4().hex[:8]}",
+        "type": "tool_call",
+    }
+    return {"messages": [AIMessage(content="", tool_calls=[tool_call])],
+            "schema_version": snapshot.version, "schema_tables": table_names}
+
+
+def route_after_call_schema(state: SQLState) -> Literal["get_schema", "generate_query"]:
+    """需要获取表结构时执行工具，复用之前的表结构时直接生成SQL"""
+    last_message = state["messages"][-1]
+    if isinstance(last_message, AIMessage) and last_message.tool_calls:
+        return "get_schema"
+    return "generate_query"
+
+
+# 第四个节点: 直接使用langgraph提供的ToolNode，表结构从快照中读取
 get_schema_node = ToolNode([get_schema_tool], name="get_schema")
 
 generate_query_system_prompt = """
@@ -0,0 +1,39 @@
+from sql_graph.query_cache import SemanticQueryCache
+
+USA_SQL = "SELECT * FROM Customer WHERE Country = 'USA'"
+
+
+def make_cache():
+    cache = SemanticQueryCache(max_entries=16)
+    cache.put('list customers in USA', USA_SQL, 1)
+    return cache
+
+
+def test_exact_match_after_normalization():
+    assert make_cache().get('List customers in USA?', 1) == USA_SQL
+
+
+def test_similar_question_with_same_content_words():
+    assert make_cache().get('list the customers in USA', 1) == USA_SQL
+
+
+def test_negation_is_not_served_from_cache():
+    assert make_cache().get('list customers not in USA', 1) is None
+
+
+def test_entity_swap_is_not_served_from_cache():
+    assert make_cache().get('list customers in UK', 1) is None
+
+
+def test_chinese_negation_and_entity_swap():
+    cache = SemanticQueryCache(max_entries=16)
+    cache.put('美国有多少客户', USA_SQL, 1)
+    assert cache.get('美国有多少客户？', 1) == USA_SQL
+    assert cache.get('美国没有多少客户', 1) is None
+    assert cache.get('英国有多少客户', 1) is None
+
+
+def test_number_mismatch_is_not_served_from_cache():
+    cache = SemanticQueryCache(max_entries=16)
+    cache.put('total sales in 2009', 'SELECT 2009', 1)
+    assert cache.get('total sales in 2010', 1) is None
@@ -0,0 +1,30 @@
+from mcp_server.result_cache import canonicalize_sql, is_read_only
+
+
+def test_keywords_identifiers_and_whitespace_are_normalized():
+    assert canonicalize_sql('SELECT  Name\nFROM "Artist" -- 歌手\n WHERE ArtistId = 007;') == \
+           canonicalize_sql('select name from artist where artistid = 7')
+
+
+def test_comments_are_removed():
+    assert canonicalize_sql('SELECT /* 所有列 */ * FROM t') == 'select * from t'
+
+
+def test_string_literals_keep_case():
+    assert canonicalize_sql("SELECT * FROM Customer WHERE Country = 'USA'") == \
+           "select * from customer where country = 'USA'"
+    assert canonicalize_sql("SELECT * FROM t WHERE c = 'ABC'") != canonicalize_sql("SELECT * FROM t WHERE c = 'abc'")
+
+
+def test_string_literals_keep_whitespace_and_comment_markers():
+    assert canonicalize_sql("SELECT 'a  b'") != canonicalize_sql("SELECT 'a b'")
+    assert canonicalize_sql("SELECT 'a--b', 'it''s'") == "select 'a--b' , 'it''s'"
+
+
+def test_quoted_identifiers_with_special_characters_are_kept():
+    assert canonicalize_sql('SELECT "Unit Price" FROM t') == 'select "Unit Price" from t'
+
+
+def test_is_read_only():
+    assert is_read_only(canonicalize_sql('WITH x AS (SELECT 1) SELECT * FROM x'))
+    assert not is_read_only(canonicalize_sql("UPDATE t SET c = 'x'"))
@@ -0,0 +1,56 @@
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+from sql_graph.sql_linter import SQLLinter
+from sql_graph.tools_node import SchemaSnapshot
+
+
+@pytest.fixture(scope='module')
+def linter(tmp_path_factory):
+    path = tmp_path_factory.mktemp('lint') / 'lint.db'
+    engine = create_engine(f'sqlite:///{path}')
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE Employee (EmployeeId INTEGER PRIMARY KEY, LastName TEXT NOT NULL)')
+        conn.exec_driver_sql('CREATE TABLE Customer (CustomerId INTEGER PRIMARY KEY, FirstName TEXT NOT NULL, '
+                             'Country TEXT, SupportRepId INTEGER REFERENCES Employee (EmployeeId))')
+        conn.exec_driver_sql('CREATE TABLE Invoice (InvoiceId INTEGER PRIMARY KEY, '
+                             'CustomerId INTEGER NOT NULL REFERENCES Customer (CustomerId), '
+                             'InvoiceDate DATETIME NOT NULL, BillingDate TEXT)')
+    return SQLLinter(SchemaSnapshot(SQLDatabase(engine)))
+
+
+def test_valid_query_has_no_issues(linter):
+    assert linter.lint('SELECT c.FirstName, COUNT(*) FROM Customer c JOIN Invoice i ON i.CustomerId = c.CustomerId '
+                       "WHERE c.Country = 'USA' GROUP BY c.FirstName") == []
+
+
+def test_not_in_nullable_column(linter):
+    issues = linter.lint('SELECT * FROM Employee WHERE EmployeeId NOT IN (SELECT SupportRepId FROM Customer)')
+    assert len(issues) == 1 and 'NOT IN' in issues[0]
+    assert linter.lint('SELECT * FROM Customer WHERE CustomerId NOT IN (SELECT CustomerId FROM Invoice)') == []
+
+
+def test_union_without_all(linter):
+    issues = linter.lint('SELECT FirstName FROM Customer UNION SELECT LastName FROM Employee')
+    assert len(issues) == 1 and 'UNION ALL' in issues[0]
+    assert linter.lint('SELECT FirstName FROM Customer UNION ALL SELECT LastName FROM Employee') == []
+
+
+def test_between_on_datetime_column(linter):
+    issues = linter.lint("SELECT * FROM Invoice WHERE InvoiceDate BETWEEN '2009-01-01' AND '2009-12-31'")
+    assert len(issues) == 1 and 'BETWEEN' in issues[0]
+    assert linter.lint("SELECT * FROM Invoice WHERE BillingDate BETWEEN '2009-01-01' AND '2009-12-31'") == []
+
+
+def test_unknown_qualified_column(linter):
+    issues = linter.lint('SELECT c.Nmae FROM Customer c')
+    assert len(issues) == 1 and 'c.Nmae' in issues[0]
+    # 字符串里的 表.列 不检查
+    assert linter.lint("SELECT c.FirstName FROM Customer c WHERE c.Country = 'c.Nmae'") == []
+
+
+def test_join_on_columns_without_foreign_key(linter):
+    issues = linter.lint('SELECT * FROM Invoice i JOIN Customer c ON i.InvoiceId = c.CustomerId')
+    assert len(issues) == 1 and '不是外键关系' in issues[0]
+    assert linter.lint('SELECT * FROM Customer c JOIN Employee e ON c.SupportRepId = e.EmployeeId') == []
@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+import sql_graph.text2sql_graph as text2sql_graph
+from sql_graph.query_cache import SemanticQueryCache
+
+USA_SQL = "SELECT CustomerId FROM Invoice WHERE BillingCountry = 'USA' GROUP BY CustomerId LIMIT 3"
+CANADA_SQL = "SELECT CustomerId FROM Invoice WHERE BillingCountry = 'Canada' GROUP BY CustomerId LIMIT 3"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SemanticQueryCache(max_entries=16)
+    snapshot = SimpleNamespace(version=1)
+    snapshot.refresh = lambda: snapshot
+    monkeypatch.setattr(text2sql_graph, 'query_cache', cache)
+    monkeypatch.setattr(text2sql_graph, 'schema_snapshot', snapshot)
+    return cache
+
+
+def turn(question, sql, call_id):
+    """一轮对话：问题、执行SQL、查询结果、最终答案"""
+    return [HumanMessage(question),
+            AIMessage(content='', tool_calls=[{'name': 'db_query_tool', 'args': {'query': sql}, 'id': call_id}]),
+            ToolMessage('CustomerId\n1', name='db_query_tool', tool_call_id=call_id),
+            AIMessage(content='答案')]
+
+
+def test_first_question_is_cached_and_reused(cache):
+    text2sql_graph.save_to_cache(turn('Top 3 customers in USA by spend', USA_SQL, 'call_1')[:3])
+    result = text2sql_graph.lookup_cache({'messages': [HumanMessage('Top 3 customers in USA by spend')]})
+    assert result['messages'][0].tool_calls[0]['args']['query'] == USA_SQL
+
+
+def test_follow_up_question_is_not_cached_across_threads(cache):
+    thread_a = turn('Top 3 customers in USA by spend', USA_SQL, 'call_1') \
+        + turn('What about Canada?', CANADA_SQL, 'call_2')[:3]
+    text2sql_graph.save_to_cache(thread_a)
+    assert cache.get('What about Canada?', 1) is None
+
+    thread_b = turn('How many invoices in 2009', 'SELECT COUNT(*) FROM Invoice', 'call_3') \
+        + [HumanMessage('What about Canada?')]
+    assert text2sql_graph.lookup_cache({'messages': thread_b}) == {'messages': []}
+
+
+def test_follow_up_does_not_reuse_first_questions(cache):
+    cache.put('What about Canada?', CANADA_SQL, 1)
+    thread = turn('How many invoices in 2009', 'SELECT COUNT(*) FROM Invoice', 'call_1') \
+        + [HumanMessage('What about Canada?')]
+    assert text2sql_graph.lookup_cache({'messages': thread}) == {'messages': []}
+
+
+def test_failed_tool_call_after_success_is_not_cached(cache):
+    messages = turn('Top 3 customers in USA by spend', USA_SQL, 'call_1')[:3] + [
+        AIMessage(content='', tool_calls=[{'name': 'sql_db_schema', 'args': {'table_names': 'Invoice'},
+                                           'id': 'call_2'}]),
+        ToolMessage('Error: sql_db_schema is not a valid tool', name='sql_db_schema', tool_call_id='call_2',
+                    status='error')]
+    text2sql_graph.save_to_cache(messages)
+    assert cache.get('Top 3 customers in USA by spend', 1) is None
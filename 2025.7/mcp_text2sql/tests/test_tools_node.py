@@ -0,0 +1,23 @@
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine
+
+from sql_graph.tools_node import SchemaSnapshot
+
+
+def test_schema_change_discards_entries_of_the_old_version(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'schema.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql('CREATE TABLE Artist (ArtistId INTEGER PRIMARY KEY, Name TEXT)')
+    snapshot = SchemaSnapshot(SQLDatabase(engine))
+    assert 'Country' not in snapshot.get_table_info(['Artist'])
+    assert 'country' not in snapshot.describe('artist').columns
+    old = snapshot._schema
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql('ALTER TABLE Artist ADD COLUMN Country TEXT')
+    snapshot.refresh()
+    # 和重建并发的调用按旧表结构生成的内容只会写回旧的版本对象
+    old.table_info['Artist'] = 'CREATE TABLE Artist (ArtistId INTEGER, Name TEXT)'
+    assert 'Country' in snapshot.get_table_info(['Artist'])
+    assert 'country' in snapshot.describe('Artist').columns
+    assert snapshot.version != old.version
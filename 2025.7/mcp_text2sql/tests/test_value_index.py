@@ -0,0 +1,90 @@
+import sqlite3
+import time
+
+import pytest
+
+from mcp_server.value_index import ValueIndex
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'values.db')
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE Artist (ArtistId INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE Customer (CustomerId INTEGER PRIMARY KEY, Country TEXT, City TEXT);
+        INSERT INTO Artist (Name) VALUES ('Aerosmith'), ('The Rolling Stones'), ('Brazil Band'), ('Rock'),
+                                         ('Rock Band'), ('Rocket');
+        INSERT INTO Customer (Country, City) VALUES ('Brazil', 'São Paulo'), ('Brazil', 'Rio de Janeiro'),
+                                                    ('Canada', 'Toronto');
+    ''')
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def index(db_path):
+    index = ValueIndex(db_path)
+    assert index.lookup('warm up', wait=10) is not None
+    yield index
+    index.close()
+
+
+def execute(db_path, sql):
+    """用另一个连接修改数据库，索引的连接能从 data_version 看到变化"""
+    conn = sqlite3.connect(db_path)
+    conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def values(results):
+    return [(r['table'], r['column'], r['value']) for r in results]
+
+
+def test_misspelled_lookup_finds_value(index):
+    results = index.lookup('Aerosmth')
+    assert values(results)[0] == ('Artist', 'Name', 'Aerosmith')
+    assert values(index.lookup('rolling stone'))[0] == ('Artist', 'Name', 'The Rolling Stones')
+
+
+def test_rows_counts_duplicate_values(index):
+    result = index.lookup('brazil', table='Customer')[0]
+    assert (result['value'], result['rows']) == ('Brazil', 2)
+
+
+def test_table_and_column_filter(index):
+    assert {r['table'] for r in index.lookup('brazil')} == {'Artist', 'Customer'}
+    assert values(index.lookup('brazil', table='customer')) == [('Customer', 'Country', 'Brazil')]
+    assert values(index.lookup('brazil', column='Name')) == [('Artist', 'Name', 'Brazil Band')]
+    assert index.lookup('brazil', table='Customer', column='City') == []
+
+
+def test_common_trigrams_are_skipped_but_still_verified(db_path):
+    # 每个片段最多统计1个值：rock 的片段都被跳过，只靠少见的片段找到候选，再精确计算相似度
+    index = ValueIndex(db_path, max_posting=1, max_posting_ratio=0)
+    try:
+        assert index.lookup('warm up', wait=10) is not None
+        results = index.lookup('Rockett', table='Artist')
+        assert values(results)[0] == ('Artist', 'Name', 'Rocket')
+        assert results[0]['score'] == 0.75
+    finally:
+        index.close()
+
+
+def test_appended_rows_are_found_without_rebuild(db_path, index):
+    execute(db_path, "INSERT INTO Artist (Name) VALUES ('Led Zeppelin')")
+    assert values(index.lookup('led zepelin'))[0] == ('Artist', 'Name', 'Led Zeppelin')
+    assert index.builds == 1
+    assert index.stats()['building'] is False
+
+
+def test_delete_triggers_rebuild(db_path, index):
+    execute(db_path, "DELETE FROM Artist WHERE Name = 'Aerosmith'")
+    index.lookup('Aerosmith')  # 发现行数减少，后台重建，这次还用旧的索引
+    deadline = time.monotonic() + 10
+    while index.builds < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.builds == 2
+    assert 'Aerosmith' not in [r['value'] for r in index.lookup('Aerosmith')]